@@ -34,6 +34,25 @@ def fix_paren_tag(line):
     return re.sub(paren_tag, r'\1_PU', line)
 
 
+def tag_lines(lines, tagger):
+    """Tag a list of segmented lines without newlines and return the list of
+    output lines, which has the section headers as they are and the tagged
+    sentences with fixed paren tags. All lines are handed to the tagger with
+    tag_many() so that the tagger does not wait for each line."""
+    texts = [line for line in lines if line[0:3] != "FH_"]
+    results = iter(tagger.tag_many(texts))
+    output = []
+    for line in lines:
+        if line[0:3] == "FH_":
+            output.append(line)
+        else:
+            tag_strings = next(results)
+            if tag_strings is None:
+                raise sdp.TaggerError("tagger failed on text: %s" % line[:100])
+            output.extend([fix_paren_tag(tag_string) for tag_string in tag_strings])
+    return output
+
+
 def tag(input_file, output_file, tagger):
     s_input = codecs.open(input_file, encoding='utf-8')
     s_output = open(output_file, "w")
@@ -17,12 +17,26 @@ of them through the segmenter, writing new files with the .seg extension:
 
 """
 
-import sys, re, codecs, StringIO
+import sys, re, codecs
 import sdp
 
+from utils.misc import SpanSplitter, visible_chars, count_ascii
+
 
 DEBUG = False
 
+# maximum length of a span handed to the segmenter, longer sentences are split
+MAX_SPAN = 500
+
+IDEOGRAPHIC_SPACE = u'\u3000'
+NO_BREAK_SPACE = u'\xa0'
+CN_PERIOD = u'\u3002'
+
+# kinds of lines returned by classify()
+SKIPABLE = 'skipable'
+ASCII = 'ascii'
+CHINESE = 'chinese'
+
 
 def debug(debug_string):
     if DEBUG:
@@ -33,48 +47,80 @@ def debug(debug_string):
 
 class Segmenter(object):
 
-    def __init__(self):
-        self.segmenter = sdp.Segmenter()
-        self.s_input = None
-        self.s_output = None
-        self.lines = []
+    """Wraps sdp.Segmenter. Sentences longer than max_span characters are split
+    into spans at clause boundaries which are segmented separately and written
+    on lines of their own, see utils.misc.SpanSplitter. All sentences of a file
+    are handed to the segmenter in one go, with processes > 1 they are divided
+    over a pool of segmenter processes, see sdp.SegmenterPool."""
 
-    def process(self, infile, outfile, verbose=False):
-        self.s_input = codecs.open(infile, encoding='utf-8')
-        self.s_output = codecs.open(outfile, "w", encoding='utf-8')
+    def __init__(self, max_span=MAX_SPAN, processes=1):
+        if processes > 1:
+            self.segmenter = sdp.SegmenterPool(processes)
+        else:
+            self.segmenter = sdp.Segmenter()
+        self.splitter = SpanSplitter(max_span)
         self.lines = []
+        self.output = []
+
+    def process(self, infile, outfile, verbose=False, sections=None):
+        """Segment infile and write the result to outfile. If sections is a
+        SectionSelector then only the selected sections are segmented and
+        written to outfile."""
         if verbose:
-            print "[Segmenter] processing %s" % self.s_input.name
-        for line in self.s_input:
-            # a hack to get rid of the character with ordinal 12288
-            # (CJK Character 0x3000 12288 IDEOGRAPHIC SPACE)
-            line = ''.join([c for c in line if ord(c) != 12288])
-            # this is needed because the segmenter has a normalization error for
-            # non-breaking spaces, replace them here with regular spaces.
-            line = line.replace(unichr(160), ' ').strip()
+            print "[Segmenter] processing %s" % infile
+        s_output = codecs.open(outfile, "w", encoding='utf-8')
+        for line in self.segment(infile, sections):
+            s_output.write(line + u"\n")
+        s_output.close()
+
+    def segment(self, infile, sections=None):
+        """Return the list of lines of the segmented version of infile, without
+        newlines."""
+        output = self.collect(infile, sections)
+        sentences = [text for text, segment_p in output if segment_p]
+        return merge_segmented(output, self.segmenter.seg_many(sentences))
+
+    def collect(self, infile, sections=None):
+        """Read infile and return a list of pairs of a text and a boolean that
+        tells whether the text still needs to be segmented. Texts that do not
+        need to be segmented are written as they are."""
+        s_input = codecs.open(infile, encoding='utf-8')
+        self.lines = []
+        self.output = []
+        if sections is not None:
+            sections.reset()
+        for line in s_input:
+            line = normalize(line)
             if line != "":
-                if line.startswith('FH_'):
+                if sections is not None and not sections.selected(line):
+                    # flushes the lines of a selected section that precedes
+                    # the unselected section header
+                    self._segment_lines()
+                elif line.startswith('FH_'):
                     self._segment_lines()
                     debug("[seg] header      [%s]" % line.strip())
-                    self.s_output.write(line + u"\n")
+                    self.output.append((line, False))
                 elif line.strip() == 'END':
                     self._segment_lines()
                     debug("[seg] end         [%s]" % line.strip())
-                    self.s_output.write(line + u"\n")
-                elif is_skipable(line):
-                    self._segment_lines()
-                    debug("[seg] skipable    [%s]" % line.strip())
-                elif is_ascii(line):
-                    self._segment_lines()
-                    debug("[seg] ascii       [%s]" % line.strip())
-                    self.s_output.write(line + u"\n")
+                    self.output.append((line, False))
                 else:
-                    debug("[seg] collecting  [%s]" % line.strip())
-                    if line:
+                    kind = classify(line)
+                    if kind == SKIPABLE:
+                        self._segment_lines()
+                        debug("[seg] skipable    [%s]" % line.strip())
+                    elif kind == ASCII:
+                        self._segment_lines()
+                        debug("[seg] ascii       [%s]" % line.strip())
+                        self.output.append((line, False))
+                    else:
+                        debug("[seg] collecting  [%s]" % line.strip())
                         self.lines.append(line)
         self._segment_lines()
-        self.s_input.close()
-        self.s_output.close()
+        s_input.close()
+        output = self.output
+        self.output = []
+        return output
 
     def _segment_lines(self):
         if not self.lines:
@@ -83,39 +129,59 @@ class Segmenter(object):
         split_text = split_cn(text).strip()
         split_text = split_text.split("\n")
         for split_line in split_text:
-            line_length = len(split_line)
-            if not line_length > 500:
-                debug("[seg] segmenting  [%s]" % split_line)
-                split_line = re.sub(r'^\s*$', '', split_line + "\n")
-                if is_ascii(split_line):
-                    self.s_output.write("%s" % split_line)
-                else:
-                    l_seg_string = self.segmenter.seg(split_line)
-                    self.s_output.write("%s" % l_seg_string)
+            for span in self.splitter.split(split_line):
+                debug("[seg] segmenting  [%s]" % span)
+                span = span.strip()
+                if not span:
+                    continue
+                self.output.append((span, not is_ascii(span)))
         self.lines = []
 
 
-def is_skipable(s):
-    """Return True if this string is not worth segmenting."""
-    s = s.strip()
-    s = ''.join(s.split())
-    length = len(s)
+def merge_segmented(output, segmented):
+    """Return the lines of the segmented file given the pairs returned by
+    Segmenter.collect() and the segmented versions of the texts that needed to
+    be segmented."""
+    segmented = iter(segmented)
+    return [next(segmented) if segment_p else text for text, segment_p in output]
+
+
+def normalize(line):
+    """Remove ideographic spaces (CJK character 0x3000) from the line, replace
+    non-breaking spaces with regular spaces and strip the line. The latter is
+    needed because the segmenter has a normalization error for non-breaking
+    spaces."""
+    return line.replace(IDEOGRAPHIC_SPACE, u'').replace(NO_BREAK_SPACE, u' ').strip()
+
+
+def classify(line):
+    """Return SKIPABLE if the line is not worth segmenting, ASCII if it is not
+    skipable and has only characters with an ordinal below 256, and CHINESE
+    otherwise. The ascii characters are counted once, with the character
+    classes in utils.misc that the garbage detector in txt2tag also uses, and
+    the test for numbers is only done when that can make a difference."""
+    chars = visible_chars(line)
+    length = len(chars)
     # skip strings with > 5000 characters
     if length > 5000:
-        return True
+        return SKIPABLE
     # skip strings longer than 10 characters where more than 90% of the
     # characters are ascii characters
-    ascii_chars = len([c for c in s if ord(c) < 256])
-    if length > 0:
-        ratio = ascii_chars/float(length)
-        if length > 10 and ratio > 0.9:
-            # print "%3d  %3d  %.2f  %s" % (ascii_chars , length, ratio, s)
-            return True
+    ascii_chars = count_ascii(chars)
+    if length > 10 and ascii_chars / float(length) > 0.9:
+        return SKIPABLE
+    if ascii_chars < length:
+        return CHINESE
     # skip short ascii only strings, except for numbers (this could also be the
-    # date in FH_DATE)
-    if ascii_chars == length and not s.isdigit():
-        return True
-    return False
+    # date in FH_DATE), a number can still have whitespace that is not ascii
+    if not chars.isdigit():
+        return SKIPABLE
+    return ASCII if is_ascii(line) else CHINESE
+
+
+def is_skipable(s):
+    """Return True if this string is not worth segmenting."""
+    return classify(s) == SKIPABLE
 
 
 def is_ascii(s):
@@ -128,23 +194,9 @@ def split_cn(text):
     and then splits on the Chinese period only, not using the \n character
     as an EOL marker."""
 
-    (cn_comma, cn_period) = (u'\uff0c', u'\u3002')
-    fh = StringIO.StringIO()
-    text = text.strip()
     # this normalizes all whitespace, gets rid of linefeeds and other crap
-    text = "\n".join(text.split())
-    length = len(text)
-    for i in range(length):
-        c = text[i]
-        if c == cn_period:
-            fh.write(c + u"\n")
-        elif c == "\n":
-            pass
-        else:
-            fh.write(c)
-    return_string = fh.getvalue()
-    fh.close()
-    return return_string
+    text = u''.join(text.split())
+    return text.replace(CN_PERIOD, CN_PERIOD + u"\n")
 
 
 def seg(infile, outfile, segmenter):
@@ -0,0 +1,102 @@
+"""cn_txt2tag.py
+
+Segment and tag Chinese text files in one pass. This gives the same result as
+running cn_txt2seg.py and then cn_seg2tag.py, but the segmented text is handed
+to the tagger in memory, the segmented file is only written when asked for.
+
+The sentences of a file are segmented in chunks and the segmenter works on the
+next chunk while the tagger works on the current one, so the segmenter and the
+tagger run at the same time.
+
+When run from the command line, this script takes a list of files and writes
+the tagged version of each file to a file with the .tag extension and the
+segmented version to a file with the .seg extension:
+
+    $ python cn_txt2tag.py FILE1 FILE2 ...
+
+"""
+
+import sys, codecs
+
+import cn_txt2seg
+import cn_seg2tag
+from utils.manifest import count_sentences_and_tokens_in_lines
+
+
+# maximum number of sentences handed to the segmenter in one chunk
+CHUNK_SIZE = 100
+
+
+class SegmenterTagger(object):
+
+    """Combines a cn_txt2seg.Segmenter and a cn_seg2tag.Tagger. With segmenters
+    > 1 the segmenter uses a pool of segmenter processes."""
+
+    def __init__(self, max_span=cn_txt2seg.MAX_SPAN, segmenters=1, chunk_size=CHUNK_SIZE):
+        self.segmenter = cn_txt2seg.Segmenter(max_span, segmenters)
+        self.tagger = cn_seg2tag.Tagger()
+        self.chunk_size = chunk_size
+
+    def process(self, infile, outfile, seg_file=None, sections=None):
+        """Segment and tag infile and write the result to outfile, the segmented
+        text is written to seg_file unless it is None. If sections is a
+        SectionSelector then only the selected sections are processed. Returns
+        the number of sentences and tokens of the segmented text."""
+        s_output = open(outfile, 'w')
+        seg_output = None
+        if seg_file is not None:
+            seg_output = codecs.open(seg_file, 'w', encoding='utf-8')
+        sentences, tokens = 0, 0
+        for lines in self._segmented_chunks(infile, sections):
+            if seg_output is not None:
+                for line in lines:
+                    seg_output.write(line + u"\n")
+            counts = count_sentences_and_tokens_in_lines([l.encode('utf-8') for l in lines])
+            sentences += counts[0]
+            tokens += counts[1]
+            for tag_string in cn_seg2tag.tag_lines(lines, self.tagger.tagger):
+                s_output.write("%s\n" % tag_string.encode('utf-8'))
+        s_output.close()
+        if seg_output is not None:
+            seg_output.close()
+        return sentences, tokens
+
+    def _segmented_chunks(self, infile, sections):
+        """Yield the lines of the segmented file in chunks. The next chunk is
+        sent to the segmenter before the current one is yielded."""
+        segmenter = self.segmenter.segmenter
+        previous = None
+        for chunk in self._chunks(self.segmenter.collect(infile, sections)):
+            sentences = [text for text, segment_p in chunk if segment_p]
+            request = segmenter.send_many(sentences)
+            if previous is not None:
+                yield self._receive(*previous)
+            previous = (chunk, sentences, request)
+        if previous is not None:
+            yield self._receive(*previous)
+
+    def _receive(self, chunk, sentences, request):
+        segmented = self.segmenter.segmenter.receive_many(request, sentences)
+        return cn_txt2seg.merge_segmented(chunk, segmented)
+
+    def _chunks(self, output):
+        """Split the pairs returned by Segmenter.collect() into chunks with at
+        most chunk_size texts that need to be segmented."""
+        chunks = [[]]
+        count = 0
+        for text, segment_p in output:
+            if segment_p:
+                if count == self.chunk_size:
+                    chunks.append([])
+                    count = 0
+                count += 1
+            chunks[-1].append((text, segment_p))
+        return chunks
+
+
+if __name__ == '__main__':
+
+    segtagger = SegmenterTagger()
+    for file_in in sys.argv[1:]:
+        print "[SegmenterTagger] processing %s" % file_in
+        segtagger.process(file_in, file_in + '.tag', file_in + '.seg')
@@ -104,6 +104,15 @@ STANFORD_OUTPUT_FORMAT = "wordsAndTags"
 # output_format = "penn,typedDependenciesCollapsed"
 
 
+### Perceptron tagger settings
+### -----------------------------------------------------------------------
+
+# Model for the pure-Python tagger used with --txt2tag --tagger=perceptron, see
+# perceptron.py for how to train a model from existing d2_tag files.
+
+PERCEPTRON_TAGGER_MODEL = os.path.join(RESOURCES, "perceptron-tagger-en.pickle.gz")
+
+
 # Some utilities for updating and checking tool directories
 
 def update_stanford_tagger(path):
@@ -25,13 +25,15 @@ typically used by scripts that process files in batch.
 #   add a line to the state/processing-history.txt file.
 
 
-import os, sys, shutil, random, time, codecs
+import os, sys, shutil, random, time, codecs, subprocess
 
+import sdp
 import xml2txt
 import txt2tag
 import tag2chunk
 import cn_txt2seg
 import cn_seg2tag
+import cn_txt2tag
 import config
 
 from docstructure.main import Parser
@@ -39,6 +41,9 @@ from utils.path import ensure_path, get_file_paths, read_only, open_input_file
 from utils.path import compress, uncompress
 from utils.git import get_git_commit
 from utils.batch import DataSet
+from utils.manifest import Manifest, describe_txt_file, count_sentences_and_tokens
+from utils.misc import get_section_selector, SpanSplitter
+from utils import parallel
 
 
 # Names of processing stages
@@ -50,7 +55,14 @@ TXT2SEG = '--txt2seg'
 SEG2TAG = '--seg2tag'
 TAG2CHK = '--tag2chk'
 
-ALL_STAGES = [POPULATE, XML2TXT, TXT2TAG, TXT2SEG, SEG2TAG, TAG2CHK]
+# Not a stage that creates a new data set, but one that adds to a data set
+# created by TAG2CHK
+AUGMENT = '--augment'
+
+# Not a stage in the pipeline either, it runs TXT2SEG and SEG2TAG in one pass
+TXT2SEG2TAG = '--txt2seg2tag'
+
+ALL_STAGES = [POPULATE, XML2TXT, TXT2TAG, TXT2SEG, SEG2TAG, TAG2CHK, TXT2SEG2TAG]
 
 
 # definition of mappings from document processing stage to input and output data
@@ -74,6 +86,9 @@ FNAME_FILELIST = 'files.txt'
 FNAME_INFO_GENERAL = 'general.txt'
 FNAME_INFO_ADDITIONS = 'additions.txt'
 FNAME_PIPELINE_DEFAULT = 'pipeline-default.txt'
+FNAME_PIPELINE_AUGMENTATIONS = 'pipeline-augmentations.txt'
+FNAME_AUGMENTATIONS = 'augmentations.txt'
+FNAME_QUARANTINE = 'quarantine.txt'
 
 
 class Corpus(object):
@@ -201,6 +216,10 @@ class Corpus(object):
     def seg2tag(rconfig, options,):
         run_seg2tag(rconfig, options)
 
+    @staticmethod
+    def txt2seg2tag(rconfig):
+        run_txt2seg2tag(rconfig)
+
     @staticmethod
     def tag2chk(rconfig, options):
         run_tag2chk(rconfig, options)
@@ -266,63 +285,188 @@ def run_xml2txt(rconfig, options):
     structure, keeping date, title, abstract, summary, description_rest,
     first_claim and other_claims. Does this by calling the document structure
     parser in onto mode if the document source is LexisNexis and uses a simple
-    parser defined in xml2txt if the source is WoS."""
+    parser defined in xml2txt if the source is WoS. Creates the manifest of the
+    output data set, see utils/manifest.py."""
 
     input_dataset, output_dataset = _get_datasets(XML2TXT, rconfig)
-    count = 0
-    doc_parser = _make_parser(rconfig.language)
+    manifest = Manifest(output_dataset.path)
     workspace = os.path.join(rconfig.corpus, 'data', 'workspace')
     fspecs = FileSpecificationList(rconfig.filelist, output_dataset.files_processed, rconfig.limit)
-    for fspec in fspecs:
-        count += 1
-        file_in, file_out = _prepare_io(XML2TXT, fspec, input_dataset, output_dataset, rconfig, count)
-        uncompress(file_in)
-        try:
-            xml2txt.xml2txt(doc_parser, rconfig.datasource, file_in, file_out, workspace)
-        except Exception:
-            # just write an empty file that can be consumed downstream
-            fh = codecs.open(file_out, 'w')
-            fh.close()
-            print "[--xml2txt] WARNING: error on", file_in
-        compress(file_in, file_out)
-        _update_state_files_processed(output_dataset, count)
-    return count % STEP, [output_dataset]
+    jobs = _make_jobs(fspecs, input_dataset, [output_dataset])
+    initargs = (rconfig.language, rconfig.datasource, workspace, rconfig.workers)
+    for job, metadata in _run_jobs(XML2TXT, rconfig, jobs, input_dataset, [output_dataset],
+                                   _xml2txt_file, _init_xml2txt, initargs):
+        manifest.add(job.file_id, metadata)
+    return len(jobs) % STEP, [output_dataset]
 
 
 @update_state
 def run_txt2tag(rconfig, options):
-    """Takes txt files and runs the tagger on them."""
-
+    """Takes txt files and runs the tagger on them. With the --sections option
+    only the listed sections are tagged. Lines longer than --max-span characters
+    are split into spans that are tagged separately and lines longer than
+    --max-line characters are skipped, --max-line=0 means that no line is
+    skipped. See utils.misc.SpanSplitter. Lines that are flagged by the garbage
+    detector are not tagged, see _get_garbage_detector(). The --tagger option
+    selects the tagger backend, with --tagger=stanford-batch the files are
+    tagged in batches, see _run_txt2tag_batches(). With --tagger=perceptron,
+    --tagger-model can be used to give the model of the tagger, relative paths
+    are taken to be relative to the config directory of the corpus."""
+
+    sections = get_section_selector(options.get('--sections'))
+    max_span, max_line = _get_span_limits(options, txt2tag.MAX_SPAN, txt2tag.MAX_LINE)
+    garbage = _get_garbage_detector(options)
+    backend = options.get('--tagger', txt2tag.STANFORD)
+    if backend not in txt2tag.TAGGERS:
+        sys.exit("[--txt2tag] ERROR: unknown tagger: %s" % backend)
+    model = options.get('--tagger-model')
+    if model is not None:
+        model = os.path.join(rconfig.config_dir, model)
+    if backend == txt2tag.PERCEPTRON:
+        if not os.path.exists(model or txt2tag.perceptron_model()):
+            sys.exit("[--txt2tag] ERROR: no tagger model at %s"
+                     % (model or txt2tag.perceptron_model()))
     input_dataset, output_dataset = _get_datasets(TXT2TAG, rconfig)
-    count = 0
-    tagger = txt2tag.Tagger(rconfig.language)
+    input_manifest, output_manifest = _get_manifests(input_dataset, output_dataset)
     fspecs = FileSpecificationList(rconfig.filelist, output_dataset.files_processed, rconfig.limit)
-    for fspec in fspecs:
-        count += 1
-        file_in, file_out = _prepare_io(TXT2TAG, fspec, input_dataset, output_dataset, rconfig, count)
-        uncompress(file_in)
-        tagger.tag(file_in, file_out)
-        compress(file_in, file_out)
+    jobs = _make_jobs(fspecs, input_dataset, [output_dataset])
+    splitter = SpanSplitter(max_span, max_line)
+    tagged_chars, tagging_time = 0, 0.0
+    initargs = (rconfig.language, sections, max_span, max_line, garbage, backend, model)
+    if backend == txt2tag.STANFORD_BATCH:
+        results = _run_txt2tag_batches(rconfig, jobs, output_dataset, initargs)
+    else:
+        results = _run_jobs(TXT2TAG, rconfig, jobs, input_dataset, [output_dataset],
+                            _txt2tag_file, _init_txt2tag, initargs)
+    for job, (counts, stats) in results:
+        output_manifest.add(job.file_id, counts, inherited=input_manifest)
+        splitter.add_counts(stats['splitter'])
+        if garbage is not None:
+            garbage.add_counts(stats['garbage'])
+        tagged_chars += stats['tagged_chars']
+        tagging_time += stats['tagging_time']
+    _print_split_counts(TXT2TAG, splitter)
+    if garbage is not None:
+        _print_garbage_counts(garbage, tagged_chars, tagging_time)
+    return len(jobs) % STEP, [output_dataset]
+
+
+def _run_txt2tag_batches(rconfig, jobs, output_dataset, initargs):
+    """Tag the files of the jobs in batches of rconfig.batch_size files with the
+    batch tagger, which runs in this process and uses rconfig.workers tagger
+    processes. Yields the same pairs of job and result as _run_jobs(). The
+    processed count of the output data set is updated after each batch.
+    Quarantined files are skipped, they cannot be retried in batch mode. If the
+    tagger fails on a batch, all files in the batch are quarantined."""
+    if rconfig.timeout is not None or rconfig.retry_quarantined:
+        print "[--txt2tag] WARNING: --timeout and --retry-quarantined are ignored" \
+              " by the batch tagger"
+    language, sections, max_span, max_line, garbage, backend, model = initargs
+    workspace = os.path.join(rconfig.corpus, 'data', 'workspace')
+    ensure_path(workspace)
+    tagger = txt2tag.Tagger(language, max_span, max_line, garbage,
+                            backend=txt2tag.STANFORD_BATCH, threads=rconfig.workers,
+                            workspace=workspace)
+    quarantine = _read_quarantine(output_dataset)
+    count = 0
+    for i in range(0, len(jobs), rconfig.batch_size):
+        batch = []
+        for job in jobs[i:i + rconfig.batch_size]:
+            if job.file_id in quarantine:
+                print "[--txt2tag] WARNING: skipping quarantined file %s" % job.file_id
+                _write_empty_output(job)
+            else:
+                batch.append(job)
+        for job in batch:
+            uncompress(job.file_in)
+        t1 = time.time()
+        try:
+            file_stats = tagger.tag_files([(job.file_in, job.file_out) for job in batch],
+                                          sections)
+        except sdp.TaggerError as e:
+            failure = parallel.JobFailure(parallel.JobFailure.ERROR, time.time() - t1, str(e))
+            for job in batch:
+                _quarantine_job(TXT2TAG, job, failure, [output_dataset])
+            file_stats = None
+        for job in jobs[i:i + rconfig.batch_size]:
+            count += 1
+            _print_file_progress(TXT2TAG, job.file_id, count, rconfig)
+        if file_stats is not None:
+            for job, stats in zip(batch, file_stats):
+                compress(job.file_in, job.file_out)
+                yield job, (_txt2tag_counts(job.file_out, stats), stats)
         _update_state_files_processed(output_dataset, count)
-    return count % STEP, [output_dataset]
+
+
+def _get_garbage_detector(options):
+    """Return a GarbageDetector if --garbage-filter=on, None otherwise. The
+    thresholds of the detector can be set with --garbage-min-length,
+    --garbage-min-letter-ratio and --garbage-min-word-ratio, see
+    txt2tag.GarbageDetector."""
+    if options.get('--garbage-filter', 'off') != 'on':
+        return None
+    settings = {}
+    for option, setting, convert in (('--garbage-min-length', 'min_length', int),
+                                     ('--garbage-min-letter-ratio', 'min_letter_ratio', float),
+                                     ('--garbage-min-word-ratio', 'min_word_ratio', float)):
+        if option in options:
+            settings[setting] = convert(options[option])
+    return txt2tag.GarbageDetector(**settings)
+
+
+def _print_garbage_counts(garbage, tagged_chars, tagging_time):
+    """Print the counts of the garbage detector and an estimate of the tagging
+    time it saved, based on the average time needed to tag a character."""
+    saved = garbage.garbage_chars * tagging_time / tagged_chars if tagged_chars else 0.0
+    print "[--txt2tag] garbage filter: %d of %d lines (%d characters) not tagged, " \
+          "flagged by rule: %s" \
+          % (garbage.garbage_lines, garbage.lines, garbage.garbage_chars,
+             ', '.join(["%s=%d" % (rule, garbage.flagged[rule])
+                        for rule in txt2tag.GarbageDetector.RULES]))
+    print "[--txt2tag] garbage filter: estimated tagging time saved %.1f seconds " \
+          "(%.1f seconds spent tagging %d characters)" % (saved, tagging_time, tagged_chars)
 
 
 @update_state
 def run_txt2seg(rconfig, options):
-    """Takes txt files and runs the Chinese segmenter on them."""
+    """Takes txt files and runs the Chinese segmenter on them. With the
+    --sections option only the listed sections are segmented. Sentences longer
+    than --max-span characters are split into spans that are segmented
+    separately."""
 
+    sections = get_section_selector(options.get('--sections'))
+    max_span, max_line = _get_span_limits(options, cn_txt2seg.MAX_SPAN, None)
     input_dataset, output_dataset = _get_datasets(TXT2SEG, rconfig)
-    count = 0
-    segmenter = cn_txt2seg.Segmenter()
+    input_manifest, output_manifest = _get_manifests(input_dataset, output_dataset)
     fspecs = FileSpecificationList(rconfig.filelist, output_dataset.files_processed, rconfig.limit)
-    for fspec in fspecs:
-        count += 1
-        file_in, file_out = _prepare_io(TXT2SEG, fspec, input_dataset, output_dataset, rconfig, count)
-        uncompress(file_in)
-        segmenter.process(file_in, file_out)
-        compress(file_in, file_out)
-        _update_state_files_processed(output_dataset, count)
-    return count % STEP, [output_dataset]
+    jobs = _make_jobs(fspecs, input_dataset, [output_dataset])
+    splitter = SpanSplitter(max_span)
+    for job, (counts, split_counts) in _run_jobs(TXT2SEG, rconfig, jobs, input_dataset,
+                                                 [output_dataset], _txt2seg_file,
+                                                 _init_txt2seg,
+                                                 (sections, max_span, rconfig.segmenters)):
+        output_manifest.add(job.file_id, counts, inherited=input_manifest)
+        splitter.add_counts(split_counts)
+    _print_split_counts(TXT2SEG, splitter)
+    return len(jobs) % STEP, [output_dataset]
+
+
+def _get_span_limits(options, default_max_span, default_max_line):
+    """Return the maximum span length and the maximum line length from the
+    --max-span and --max-line options. A maximum line length of 0 is returned
+    as None, which means that there is no maximum."""
+    max_span = int(options.get('--max-span', default_max_span))
+    max_line = int(options.get('--max-line', default_max_line or 0))
+    if max_span < 1:
+        sys.exit("ERROR: the value of --max-span should be a positive integer")
+    return max_span, max_line if max_line > 0 else None
+
+
+def _print_split_counts(stage, splitter):
+    if splitter.split_lines or splitter.skipped_lines:
+        print "[%s] %d lines, %d split into %d spans, %d skipped" \
+              % (stage, splitter.lines, splitter.split_lines, splitter.spans,
+                 splitter.skipped_lines)
 
 
 @update_state
@@ -330,40 +474,238 @@ def run_seg2tag(rconfig, options):
     """Takes seg files and runs the Chinese tagger on them."""
 
     input_dataset, output_dataset = _get_datasets(SEG2TAG, rconfig)
-    count = 0
-    tagger = cn_seg2tag.Tagger()
+    input_manifest, output_manifest = _get_manifests(input_dataset, output_dataset)
     fspecs = FileSpecificationList(rconfig.filelist, output_dataset.files_processed, rconfig.limit)
-    for fspec in fspecs:
-        count += 1
-        file_in, file_out = _prepare_io(SEG2TAG, fspec, input_dataset, output_dataset, rconfig, count)
-        uncompress(file_in)
-        tagger.tag(file_in, file_out)
-        compress(file_in, file_out)
-        _update_state_files_processed(output_dataset, count)
-    return count % STEP, [output_dataset]
+    jobs = _make_jobs(fspecs, input_dataset, [output_dataset])
+    for job, counts in _run_jobs(SEG2TAG, rconfig, jobs, input_dataset, [output_dataset],
+                                 _seg2tag_file, _init_seg2tag, ()):
+        output_manifest.add(job.file_id, counts, inherited=input_manifest)
+    return len(jobs) % STEP, [output_dataset]
+
+
+@update_state
+def run_txt2seg2tag(rconfig):
+    """Segments and tags txt files in one pass, without reading the segmented
+    files back in, see cn_txt2tag.py. Uses the options of the --txt2seg stage
+    of the pipeline and writes to the data set that --seg2tag would write to,
+    so the pipeline trace of that data set includes the --txt2seg stage even
+    though no segmented files were written. The segmented files are only
+    written, to the data set that --txt2seg would write to, if
+    rconfig.keep_segmented is set."""
+
+    stages = [step[0] for step in rconfig.pipeline]
+    if TXT2SEG not in stages or SEG2TAG not in stages:
+        sys.exit("ERROR: %s needs a pipeline with %s and %s" % (TXT2SEG2TAG, TXT2SEG, SEG2TAG))
+    options = rconfig.get_options(TXT2SEG)
+    sections = get_section_selector(options.get('--sections'))
+    max_span, max_line = _get_span_limits(options, cn_txt2seg.MAX_SPAN, None)
+    input_dataset = _find_input_dataset(TXT2SEG, rconfig)
+    output_datasets = [_find_output_dataset(SEG2TAG, rconfig)]
+    if rconfig.keep_segmented:
+        output_datasets.append(_find_output_dataset(TXT2SEG, rconfig))
+    print "[%s] input %s" % (TXT2SEG2TAG, input_dataset)
+    for output_dataset in output_datasets:
+        print "[%s] output %s" % (TXT2SEG2TAG, output_dataset)
+    _check_file_counts(input_dataset, output_datasets[0], rconfig.limit)
+    if len(set([ds.files_processed for ds in output_datasets])) > 1:
+        print "[%s] WARNING: output datasets have different file counts" % TXT2SEG2TAG
+        sys.exit("Exiting...")
+    input_manifest = Manifest(input_dataset.path)
+    output_manifests = [Manifest(ds.path) for ds in output_datasets]
+    fspecs = FileSpecificationList(rconfig.filelist, output_datasets[0].files_processed,
+                                   rconfig.limit)
+    jobs = _make_jobs(fspecs, input_dataset, output_datasets)
+    splitter = SpanSplitter(max_span)
+    initargs = (sections, max_span, rconfig.segmenters)
+    for job, (seg_counts, tag_counts, split_counts) in \
+            _run_jobs(TXT2SEG2TAG, rconfig, jobs, input_dataset, output_datasets,
+                      _txt2seg2tag_file, _init_txt2seg2tag, initargs):
+        # the tagged files get the counts of the segmented files as well, just
+        # like when they inherit them from the manifest of the segmented files
+        tag_counts.update(seg_counts)
+        output_manifests[0].add(job.file_id, tag_counts, inherited=input_manifest)
+        if rconfig.keep_segmented:
+            output_manifests[1].add(job.file_id, seg_counts, inherited=input_manifest)
+        splitter.add_counts(split_counts)
+    _print_split_counts(TXT2SEG2TAG, splitter)
+    return len(jobs) % STEP, output_datasets
 
 
 @update_state
 def run_tag2chk(rconfig, options):
-    """Runs the np-in-context code on tagged input. Populates d3_phr_feat."""
-
-    candidate_filter = options.get('--candidate-filter', 'off')
-    chunker_rules = options.get('--chunker-rules', 'en')
-    # this is a hack that maps the value of the new official name to the value
-    # expected by the old name
-    filter_p = True if candidate_filter == 'on' else False
-    input_dataset, output_dataset = _get_datasets(TAG2CHK, rconfig)
-    print "[--tag2chk] using '%s' chunker rules" % chunker_rules
+    """Runs the np-in-context code on tagged input. Populates d3_phr_feat. The
+    value of --chunker-rules can be a comma-separated list of rule sets, in that
+    case each tagged sentence is read once and chunked with all rule sets, and
+    the results for each rule set are written to their own d3_feats data set,
+    each with a pipeline head that has just that one rule set. If the sentence
+    cache size in rconfig is larger than zero, chunks and features of sentences
+    that were seen before are taken from a cache, this is a runtime setting and
+    it does not change the output. Which chunks are written is determined by
+    the candidate filter options, see _get_candidate_filter(). The year of each
+    document is taken from the manifest of the input data set, if there is
+    one. With the --sections option only the listed sections are chunked."""
+
+    chunker_rules = options.get('--chunker-rules', 'en').split(',')
+    sections = get_section_selector(options.get('--sections'))
+    candidate_filter = _get_candidate_filter(rconfig, options)
+    input_dataset, output_datasets = _get_tag2chk_datasets(rconfig, options, chunker_rules)
+    input_manifest = Manifest(input_dataset.path)
+    output_manifests = [Manifest(dataset.path) for dataset in output_datasets]
+    print "[--tag2chk] using %s chunker rules" % ', '.join(["'%s'" % r for r in chunker_rules])
+    fspecs = FileSpecificationList(rconfig.filelist, output_datasets[0].files_processed, rconfig.limit)
+    jobs = _make_jobs(fspecs, input_dataset, output_datasets)
+    for job in jobs:
+        job.year = input_manifest.get(job.file_id, 'year')
+    # the cache and the filter are created in each worker, counts are collected
+    # here from the results for each file
+    cache_counts = {'hits': 0, 'misses': 0}
+    initargs = (rconfig.language, chunker_rules, rconfig.sentence_cache,
+                candidate_filter, sections)
+    for job, result in _run_jobs(TAG2CHK, rconfig, jobs, input_dataset, output_datasets,
+                                 _tag2chk_file, _init_tag2chk, initargs):
+        for (chunks, written), manifest in zip(result['outputs'], output_manifests):
+            manifest.add(job.file_id, {'chunks': chunks, 'chunks_written': written},
+                         inherited=input_manifest)
+        candidate_filter.add_counts(result['filter'])
+        for key in cache_counts:
+            cache_counts[key] += result['cache'][key]
+    if rconfig.sentence_cache > 0:
+        lookups = cache_counts['hits'] + cache_counts['misses']
+        print "[--tag2chk] sentence cache: %d hits, %d misses, hit rate %.2f" \
+              % (cache_counts['hits'], cache_counts['misses'],
+                 cache_counts['hits'] / float(lookups) if lookups else 0.0)
+    if candidate_filter.is_active():
+        print "[--tag2chk] candidate filter: %d accepted, rejected by rule: %s" \
+              % (candidate_filter.accepted,
+                 ', '.join(["%s=%d" % (rule, candidate_filter.rejected[rule])
+                            for rule in tag2chunk.CandidateFilter.RULES]))
+    return len(jobs) % STEP, output_datasets
+
+
+def _get_candidate_filter(rconfig, options):
+    """Create a CandidateFilter from the tag2chk options. The title filter is
+    used with --candidate-filter=on. The other rules are used if their option
+    is given: --candidate-stoplist has a comma-separated list of stoplist files,
+    where relative paths are taken to be relative to the config directory of the
+    corpus, and --candidate-min-length and --candidate-max-length give the
+    minimum and maximum number of tokens in a term."""
+    title_filter = options.get('--candidate-filter', 'off') == 'on'
+    stoplist = set()
+    for fname in options.get('--candidate-stoplist', '').split(','):
+        if fname:
+            fname = os.path.join(rconfig.config_dir, fname)
+            if not (os.path.exists(fname) or os.path.exists(fname + '.gz')):
+                sys.exit("[--tag2chk] ERROR: stoplist %s does not exist" % fname)
+            stoplist.update(tag2chunk.read_stoplist(fname))
+    min_length = options.get('--candidate-min-length')
+    max_length = options.get('--candidate-max-length')
+    return tag2chunk.CandidateFilter(
+        title_filter=title_filter, stoplist=stoplist,
+        min_length=None if min_length is None else int(min_length),
+        max_length=None if max_length is None else int(max_length))
+
+
+def run_augment_features(rconfig, feature_names):
+    """Adds the features calculated by the feature methods in feature_names to
+    the existing d3_feats data set that matches the pipeline configuration. Only
+    files that were already processed by --tag2chk are augmented. Progress is
+    kept for each set of feature names in state/augmentations.txt and the
+    feature names are added to config/pipeline-augmentations.txt, the pipeline
+    head is not changed so the data set still matches the pipeline. If the
+    pipeline has several chunker rule sets then the data sets for all of them
+    are augmented, see run_tag2chk()."""
+
+    input_dataset = _find_input_dataset(TAG2CHK, rconfig)
+    feature_methods = tag2chunk.select_feature_methods(rconfig.language, feature_names)
+    unknown_names = set(feature_names) - set([m.__name__ for m in feature_methods])
+    if unknown_names:
+        print "[%s] WARNING: unknown feature methods: %s" % (AUGMENT, ' '.join(unknown_names))
+        sys.exit("Exiting...")
+    features = ','.join(sorted(feature_names))
+    options = rconfig.get_options(TAG2CHK)
+    for rules in options.get('--chunker-rules', 'en').split(','):
+        rules_options = dict(options)
+        rules_options['--chunker-rules'] = rules
+        rules_config = rconfig.with_stage_options(TAG2CHK, rules_options)
+        output_dataset = _find_output_dataset(TAG2CHK, rules_config, create=False)
+        _print_datasets(AUGMENT, input_dataset, output_dataset)
+        _augment_dataset(rconfig, input_dataset, output_dataset, feature_methods, features)
+
+
+def _augment_dataset(rconfig, input_dataset, output_dataset, feature_methods, features):
+    t1 = time.time()
+    chunker_rules = output_dataset.pipeline_head[1].get('--chunker-rules', 'en')
+    sections = get_section_selector(output_dataset.pipeline_head[1].get('--sections'))
+    augmented = _read_augmentation_state(output_dataset)
+    start = augmented.get(features, 0)
+    limit = min(rconfig.limit, output_dataset.files_processed - start)
+    if limit <= 0:
+        print "[%s] all processed files already have %s" % (AUGMENT, features)
+        return
+    print "[%s] adding %s to %d files" % (AUGMENT, features, limit)
+    if start == 0:
+        _add_augmentation_to_config(output_dataset, features)
     count = 0
-    fspecs = FileSpecificationList(rconfig.filelist, output_dataset.files_processed, rconfig.limit)
+    fspecs = FileSpecificationList(rconfig.filelist, start, limit)
     for fspec in fspecs:
         count += 1
-        file_in, file_out = _prepare_io(TAG2CHK, fspec, input_dataset, output_dataset, rconfig, count)
-        year = _get_year_from_file(file_in)
-        tag2chunk.Doc(file_in, file_out, year, rconfig.language,
-                      filter_p=filter_p, chunker_rules=chunker_rules, compress=True)
-        _update_state_files_processed(output_dataset, count)
-    return count % STEP, [output_dataset]
+        file_in, file_out = _prepare_io(AUGMENT, fspec, input_dataset, output_dataset, rconfig, count)
+        tag2chunk.AugmentedDoc(file_in, file_out, rconfig.language, chunker_rules,
+                               feature_methods, compress=True, sections=sections)
+    augmented[features] = start + count
+    _write_augmentation_state(output_dataset, augmented, count, t1)
+
+
+def _read_augmentation_state(dataset):
+    """Return a dictionary with the number of files augmented for each set of
+    feature names."""
+    augmented = {}
+    fname = os.path.join(dataset.path, 'state', FNAME_AUGMENTATIONS)
+    if os.path.exists(fname):
+        for line in open(fname):
+            features, count = line.split()
+            augmented[features] = int(count)
+    return augmented
+
+
+def _write_augmentation_state(dataset, augmented, count, t1):
+    fname = os.path.join(dataset.path, 'state', FNAME_AUGMENTATIONS)
+    with open(fname, 'w') as fh:
+        for features in sorted(augmented):
+            fh.write("%s\t%d\n" % (features, augmented[features]))
+    history_file = os.path.join(dataset.path, 'state', 'processing-history.txt')
+    with open(history_file, 'a') as fh:
+        fh.write("%s\t%d\t%s\t%s\t%s\n" % (AUGMENT, count,
+                                           time.strftime("%Y:%m:%d-%H:%M:%S"),
+                                           get_git_commit(), time.time() - t1))
+
+
+def _add_augmentation_to_config(dataset, features):
+    fname = os.path.join(dataset.path, 'config', FNAME_PIPELINE_AUGMENTATIONS)
+    with open(fname, 'a') as fh:
+        fh.write("%s --features=%s\n" % (AUGMENT, features))
+
+
+def _get_tag2chk_datasets(rconfig, options, chunker_rules):
+    """Return the input DataSet and a list of output DataSets for the tag2chk
+    stage, one output data set for each set of chunker rules. Exits if the
+    output data sets do not all have the same number of processed files, since
+    they are all filled in one pass."""
+    input_dataset = _find_input_dataset(TAG2CHK, rconfig)
+    output_datasets = []
+    for rules in chunker_rules:
+        rules_options = dict(options)
+        rules_options['--chunker-rules'] = rules
+        rules_config = rconfig.with_stage_options(TAG2CHK, rules_options)
+        output_datasets.append(_find_output_dataset(TAG2CHK, rules_config))
+    print "[%s] input %s" % (TAG2CHK, input_dataset)
+    for output_dataset in output_datasets:
+        print "[%s] output %s" % (TAG2CHK, output_dataset)
+        _check_file_counts(input_dataset, output_dataset, rconfig.limit)
+    if len(set([ds.files_processed for ds in output_datasets])) > 1:
+        print "[--tag2chk] WARNING: output datasets have different file counts"
+        sys.exit("Exiting...")
+    return input_dataset, output_datasets
 
 
 def _get_datasets(stage, rconfig):
@@ -403,10 +745,11 @@ def _find_input_dataset(stage, rconfig, data_type=None):
         sys.exit("Exiting...")
 
     
-def _find_output_dataset(stage, rconfig, data_type=None):
+def _find_output_dataset(stage, rconfig, data_type=None, create=True):
     """Find the output data set of a stage for a given configuration and return
-    it. Print a warning and exit if no dataset or more than one dataset was
-    found."""
+    it. Print a warning and exit if more than one dataset was found. If no
+    dataset was found, create one, or print a warning and exit if create is
+    False."""
 
     # Use the stage-to-data mapping to find the output names
     if data_type is None:
@@ -427,6 +770,9 @@ def _find_output_dataset(stage, rconfig, data_type=None):
         for ds in datasets3:
             print '  ', ds
         sys.exit("Exiting...")
+    elif len(datasets3) == 0 and not create:
+        print "WARNING: no datasets available to meet output requirements"
+        sys.exit("Exiting...")
     elif len(datasets3) == 0:
         highest_id = max([0] + [int(ds) for ds in datasets1])
         new_id = "%02d" % (highest_id + 1)
@@ -464,13 +810,349 @@ def _check_file_counts(input_dataset, output_dataset, limit):
 def _prepare_io(stage, fspec, input_dataset, output_dataset, rconfig, count):
     """Generate the file paths for the datasets and make sure the path to the file exists for
     the output dataset."""
+    file_in, files_out = _prepare_io_multi(stage, fspec, input_dataset, [output_dataset],
+                                           rconfig, count)
+    return file_in, files_out[0]
+
+
+def _prepare_io_multi(stage, fspec, input_dataset, output_datasets, rconfig, count):
+    """Like _prepare_io(), but for a list of output datasets, returns the input
+    file and a list of output files."""
+    _print_file_progress(stage, fspec.target, count, rconfig)
+    file_id = _get_file_id(fspec)
+    file_in = os.path.join(input_dataset.path, 'files', file_id)
+    files_out = []
+    for output_dataset in output_datasets:
+        file_out = os.path.join(output_dataset.path, 'files', file_id)
+        ensure_path(os.path.dirname(file_out))
+        files_out.append(file_out)
+    return file_in, files_out
+
+
+def _get_file_id(fspec):
+    """Return the path of the file relative to the files directory of a data
+    set, this is also the identifier used in the manifests."""
     filename = fspec.target
-    _print_file_progress(stage, filename, count, rconfig)
-    file_id = filename[1:] if filename.startswith(os.sep) else filename
+    return filename[1:] if filename.startswith(os.sep) else filename
+
+
+def _get_manifests(input_dataset, output_dataset):
+    return Manifest(input_dataset.path), Manifest(output_dataset.path)
+
+
+def _get_counts(file_out, prefix):
+    """Return the number of sentences and tokens in file_out in a dictionary for
+    the manifest, using prefix for the keys."""
+    sentences, tokens = count_sentences_and_tokens(file_out)
+    return {prefix + '_sentences': sentences, prefix + '_tokens': tokens}
+
+
+class FileJob(object):
+
+    """The work for one document in a processing stage, with the identifier of
+    the file and the paths of the input file and the output files."""
+
+    def __init__(self, file_id, file_in, files_out):
+        self.file_id = file_id
+        self.file_in = file_in
+        self.files_out = files_out
+        self.file_out = files_out[0]
+        self.year = None
+
+    def __str__(self):
+        return "<FileJob %s>" % self.file_id
+
+
+def _make_jobs(fspecs, input_dataset, output_datasets):
+    """Return a FileJob for each file specification and make sure the paths to
+    the output files exist."""
+    return [_make_job(_get_file_id(fspec), input_dataset, output_datasets)
+            for fspec in fspecs]
+
+
+def _make_job(file_id, input_dataset, output_datasets):
     file_in = os.path.join(input_dataset.path, 'files', file_id)
-    file_out = os.path.join(output_dataset.path, 'files', file_id)
-    ensure_path(os.path.dirname(file_out))
-    return file_in, file_out
+    files_out = []
+    for output_dataset in output_datasets:
+        file_out = os.path.join(output_dataset.path, 'files', file_id)
+        ensure_path(os.path.dirname(file_out))
+        files_out.append(file_out)
+    return FileJob(file_id, file_in, files_out)
+
+
+def _run_jobs(stage, rconfig, jobs, input_dataset, output_datasets,
+              function, initializer, initargs):
+    """Run function on all jobs, using the number of workers, the schedule and
+    the timeout from rconfig, and yield each job with its result as soon as the
+    job is done. The processed counts of the output datasets are only updated
+    for the jobs at the beginning of the list that are all done, so that the
+    count in state/processed.txt never includes files that were not processed
+    yet.
+
+    Jobs that run over the timeout or fail are not yielded, instead their file
+    is added to the quarantine of the output data sets and empty output files
+    are written, see _quarantine_job(). Files that are in the quarantine are
+    skipped, unless rconfig.retry_quarantined is set. In that case they are run
+    again, and all quarantined files not in the list of jobs are added to the
+    jobs (but not to the processed counts), those that succeed are taken out of
+    the quarantine."""
+    quarantine = _read_quarantine(output_datasets[0])
+    retry_ids = []
+    if rconfig.retry_quarantined:
+        job_ids = set([job.file_id for job in jobs])
+        retry_ids = [file_id for file_id in sorted(quarantine) if file_id not in job_ids]
+        print "[%s] retrying %d quarantined files" % (stage, len(quarantine))
+    retry_jobs = [_make_job(file_id, input_dataset, output_datasets) for file_id in retry_ids]
+    all_jobs = retry_jobs + jobs
+    offset = len(retry_jobs)
+    done = set()
+    runnable = []
+    for i, job in enumerate(all_jobs):
+        if job.file_id in quarantine and not rconfig.retry_quarantined:
+            print "[%s] WARNING: skipping quarantined file %s" % (stage, job.file_id)
+            _write_empty_output(job)
+            done.add(i)
+        else:
+            runnable.append(i)
+    costs = [parallel.file_cost(all_jobs[i].file_in) for i in runnable] \
+        if rconfig.schedule == parallel.SCHEDULE_COST else [0] * len(runnable)
+    order = [runnable[j] for j in parallel.schedule(costs, rconfig.schedule)]
+    recovered = []
+    finished = offset
+    for i, result in parallel.run_jobs(function, all_jobs, order, rconfig.workers,
+                                       initializer, initargs, rconfig.timeout):
+        done.add(i)
+        job = all_jobs[i]
+        _print_file_progress(stage, job.file_id, len(done), rconfig)
+        if isinstance(result, parallel.JobFailure):
+            _quarantine_job(stage, job, result, output_datasets)
+        else:
+            if job.file_id in quarantine:
+                recovered.append(job.file_id)
+            yield job, result
+        finished = _update_processed_prefix(output_datasets, done, finished, offset)
+    _update_processed_prefix(output_datasets, done, finished, offset)
+    if recovered:
+        print "[%s] removing %d files from the quarantine" % (stage, len(recovered))
+        for output_dataset in output_datasets:
+            _remove_from_quarantine(output_dataset, recovered)
+
+
+def _update_processed_prefix(output_datasets, done, finished, offset):
+    """Update the processed counts for all jobs from index finished onwards that
+    are done and that have no unfinished jobs before them. Returns the index of
+    the first unfinished job. Jobs before offset are not counted."""
+    while finished in done:
+        finished += 1
+        for output_dataset in output_datasets:
+            _update_state_files_processed(output_dataset, finished - offset)
+    return finished
+
+
+def _read_quarantine(dataset):
+    """Return a dictionary with the quarantined files of the data set, the
+    values are the lines from the quarantine file split into fields."""
+    quarantine = {}
+    fname = os.path.join(dataset.path, 'state', FNAME_QUARANTINE)
+    if os.path.exists(fname):
+        for line in open(fname):
+            fields = line.rstrip("\n").split("\t")
+            quarantine[fields[0]] = fields
+    return quarantine
+
+
+def _remove_from_quarantine(dataset, file_ids):
+    quarantine = _read_quarantine(dataset)
+    fname = os.path.join(dataset.path, 'state', FNAME_QUARANTINE)
+    with open(fname, 'w') as fh:
+        for file_id in sorted(quarantine):
+            if file_id not in file_ids:
+                fh.write("\t".join(quarantine[file_id]) + "\n")
+
+
+def _quarantine_job(stage, job, failure, output_datasets):
+    """Add the file of the job to the quarantine file in the state directory of
+    the output data sets, with the stage, the reason and the time spent, and
+    write empty output files that can be consumed downstream."""
+    print "[%s] WARNING: %s after %.2f seconds on %s, adding it to the quarantine" \
+          % (stage, failure.reason, failure.elapsed, job.file_id)
+    if failure.message:
+        print failure.message
+    for output_dataset in output_datasets:
+        fname = os.path.join(output_dataset.path, 'state', FNAME_QUARANTINE)
+        with open(fname, 'a') as fh:
+            fh.write("%s\t%s\t%s\t%.2f\t%s\n" % (job.file_id, stage, failure.reason,
+                                                  failure.elapsed,
+                                                  time.strftime("%Y:%m:%d-%H:%M:%S")))
+    _restore_compressed(job.file_in)
+    _write_empty_output(job, overwrite=True)
+
+
+def _write_empty_output(job, overwrite=False):
+    """Write empty compressed output files for the job, existing output files are
+    only replaced if overwrite is True."""
+    for file_out in job.files_out:
+        if os.path.exists(file_out + '.gz') and not overwrite:
+            continue
+        for fname in (file_out, file_out + '.gz'):
+            if os.path.exists(fname):
+                os.remove(fname)
+        open(file_out, 'w').close()
+        compress(file_out)
+
+
+def _restore_compressed(fname):
+    """Make sure that only the compressed version of fname exists, this is needed
+    when a worker was killed while it was compressing or uncompressing fname."""
+    if not os.path.exists(fname):
+        return
+    if os.path.exists(fname + '.gz'):
+        if subprocess.call(['gzip', '-t', fname + '.gz']) == 0:
+            os.remove(fname)
+            return
+        os.remove(fname + '.gz')
+    compress(fname)
+
+
+# State of the worker process, filled in by the _init_X functions and used by
+# the _X_file functions that do the work for one file, see _run_jobs().
+_worker = {}
+
+
+def _init_xml2txt(language, datasource, workspace, workers):
+    _worker['doc_parser'] = _make_parser(language)
+    _worker['datasource'] = datasource
+    # several workers should not share the workspace because intermediate files
+    # are named after the basename of the file
+    if workers > 1:
+        workspace = os.path.join(workspace, "worker-%d" % os.getpid())
+        ensure_path(workspace)
+    _worker['workspace'] = workspace
+
+
+def _xml2txt_file(job):
+    uncompress(job.file_in)
+    try:
+        xml2txt.xml2txt(_worker['doc_parser'], _worker['datasource'],
+                        job.file_in, job.file_out, _worker['workspace'])
+    except Exception:
+        # just write an empty file that can be consumed downstream
+        fh = codecs.open(job.file_out, 'w')
+        fh.close()
+        print "[--xml2txt] WARNING: error on", job.file_in
+    metadata = describe_txt_file(job.file_out)
+    metadata['source_size'] = os.path.getsize(job.file_in)
+    compress(job.file_in, job.file_out)
+    return metadata
+
+
+def _init_txt2tag(language, sections, max_span, max_line, garbage, backend, model):
+    _worker['tagger'] = txt2tag.Tagger(language, max_span, max_line, garbage,
+                                       backend=backend, model=model)
+    _worker['sections'] = sections
+
+
+def _txt2tag_file(job):
+    """Tag one file and return the counts for the manifest and the statistics
+    of the tagger for this file only, see txt2tag.Tagger.stats()."""
+    uncompress(job.file_in)
+    tagger = _worker['tagger']
+    tagger.reset_stats()
+    tagger.tag(job.file_in, job.file_out, _worker['sections'])
+    stats = tagger.stats()
+    counts = _txt2tag_counts(job.file_out, stats)
+    compress(job.file_in, job.file_out)
+    return counts, stats
+
+
+def _txt2tag_counts(file_out, stats):
+    """Return the counts for the manifest of a tagged file."""
+    counts = _get_counts(file_out, 'tag')
+    counts['tag_split_lines'] = stats['splitter']['split_lines']
+    counts['tag_skipped_lines'] = stats['splitter']['skipped_lines']
+    if stats['garbage'] is not None:
+        counts['tag_garbage_lines'] = stats['garbage']['garbage_lines']
+    return counts
+
+
+def _init_txt2seg(sections, max_span, segmenters):
+    _worker['segmenter'] = cn_txt2seg.Segmenter(max_span, segmenters)
+    _worker['sections'] = sections
+
+
+def _txt2seg_file(job):
+    uncompress(job.file_in)
+    splitter = _worker['segmenter'].splitter
+    splitter.reset_counts()
+    _worker['segmenter'].process(job.file_in, job.file_out, sections=_worker['sections'])
+    counts = _get_counts(job.file_out, 'seg')
+    counts['seg_split_lines'] = splitter.split_lines
+    compress(job.file_in, job.file_out)
+    return counts, splitter.counts()
+
+
+def _init_seg2tag():
+    _worker['tagger'] = cn_seg2tag.Tagger()
+
+
+def _seg2tag_file(job):
+    uncompress(job.file_in)
+    _worker['tagger'].tag(job.file_in, job.file_out)
+    counts = _get_counts(job.file_out, 'tag')
+    compress(job.file_in, job.file_out)
+    return counts
+
+
+def _init_txt2seg2tag(sections, max_span, segmenters):
+    _worker['segtagger'] = cn_txt2tag.SegmenterTagger(max_span, segmenters)
+    _worker['sections'] = sections
+
+
+def _txt2seg2tag_file(job):
+    """Segment and tag one file, the segmented file is written if the job has a
+    second output file. Returns the counts for the manifests of the segmented
+    and the tagged files and the counts of the span splitter."""
+    uncompress(job.file_in)
+    segtagger = _worker['segtagger']
+    splitter = segtagger.segmenter.splitter
+    splitter.reset_counts()
+    seg_file = job.files_out[1] if len(job.files_out) > 1 else None
+    sentences, tokens = segtagger.process(job.file_in, job.file_out, seg_file,
+                                          _worker['sections'])
+    seg_counts = {'seg_sentences': sentences, 'seg_tokens': tokens,
+                  'seg_split_lines': splitter.split_lines}
+    tag_counts = _get_counts(job.file_out, 'tag')
+    compress(job.file_in, *job.files_out)
+    return seg_counts, tag_counts, splitter.counts()
+
+
+def _init_tag2chk(language, chunker_rules, cache_size, candidate_filter, sections):
+    _worker['language'] = language
+    _worker['chunker_rules'] = chunker_rules
+    _worker['cache'] = tag2chunk.SentenceCache(cache_size) if cache_size > 0 else None
+    _worker['candidate_filter'] = candidate_filter.copy()
+    _worker['sections'] = sections
+
+
+def _tag2chk_file(job):
+    """Chunk one file and return the chunk counts for each output and the counts
+    of the candidate filter and sentence cache for this file only."""
+    year = job.year
+    if year is None:
+        year = _get_year_from_file(job.file_in)
+    cache = _worker['cache']
+    candidate_filter = _worker['candidate_filter']
+    candidate_filter.reset_counts()
+    hits, misses = (cache.hits, cache.misses) if cache is not None else (0, 0)
+    doc = tag2chunk.Doc(job.file_in, job.files_out, year, _worker['language'],
+                        chunker_rules=_worker['chunker_rules'], compress=True,
+                        cache=cache, candidate_filter=candidate_filter,
+                        sections=_worker['sections'])
+    if cache is not None:
+        hits, misses = cache.hits - hits, cache.misses - misses
+    return {'outputs': [(output.next_chunk_id, output.written) for output in doc.outputs],
+            'filter': candidate_filter.counts(),
+            'cache': {'hits': hits, 'misses': misses}}
 
 
 def _make_parser(language):
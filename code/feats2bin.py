@@ -0,0 +1,299 @@
+"""feats2bin.py
+
+Convert d3_feats files to and from a binary format with interned strings.
+
+The d3_feats files are compressed tab-separated files where each line contains
+a uid, a year, a term and a list of mallet features as created by
+tag2chunk.add_line_to_phr_feats(). In the binary format all terms and features
+are replaced by integer identifiers from vocabularies that are shared by all
+files in the data set. The binary data are stored inside the d3_feats data set:
+
+    binary/
+       vocabulary-years.txt
+       vocabulary-terms.txt
+       vocabulary-features.txt
+       files/
+          1980/US4192770A.xml.bin.gz
+          ...
+
+The vocabularies have one string per line, the identifier of the string is its
+line number (starting at 0). Each binary file starts with a header with the
+magic string TGF2 and the prefix of all uids in the file (the part before the
+final underscore, typically the file name). This is followed by one record per
+line in the original file. A record has the following unsigned little-endian
+integers: chunk number (4 bytes), year identifier (4 bytes), term identifier (4
+bytes), number of features (2 bytes) and the feature identifiers (4 bytes each).
+Years are interned like terms and features, so they come back exactly as they
+were in the text file, even if they are zero-padded or not numerical.
+
+Vocabularies are saved by writing a temporary file and renaming it, and binary
+files are written under a temporary name that is only renamed after the
+vocabularies with all strings they use have been saved. A conversion that is
+interrupted therefore never leaves a binary file with identifiers that are not
+in the vocabularies.
+
+USAGE:
+
+    $ python feats2bin.py --to-binary --dataset PATH
+    $ python feats2bin.py --to-text --dataset PATH --output PATH
+
+The first form adds the binary version of all files in the data set, the second
+one writes the text version of the binary files to the output directory, using
+the same directory structure as in the files directory of the data set. The
+data set path is the path to the data set version, for example
+data/patents/corpora/sample-us/data/d3_feats/01.
+
+To use binary files from other scripts:
+
+    import feats2bin
+    reader = feats2bin.BinaryFeatsReader('sample-us/data/d3_feats/01')
+    for (uid, year, term, features) in reader.records('1980/US4192770A.xml'):
+        print uid, year, term, len(features)
+
+The records() method yields the same records as you would get from splitting
+the lines of the text file, and lines() yields the lines themselves.
+
+"""
+
+
+import os, sys, io, struct, getopt, codecs, gzip
+
+from utils.path import ensure_path, open_output_file
+
+
+MAGIC = 'TGF2'
+
+HEADER = struct.Struct('<4sH')
+RECORD = struct.Struct('<IIIH')
+
+BINARY_DIR = 'binary'
+YEARS_FILE = 'vocabulary-years.txt'
+TERMS_FILE = 'vocabulary-terms.txt'
+FEATURES_FILE = 'vocabulary-features.txt'
+
+
+class Vocabulary(object):
+
+    """A list of strings stored in a file, where the identifier of a string is
+    its position in the list. New strings are added to the end of the list and
+    the file, so identifiers never change once they are assigned."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.strings = []
+        self.ids = {}
+        self.saved = 0
+        if os.path.exists(filename):
+            # only split on newlines, terms can have characters like \x85 and
+            # \u2028 that codecs would also take to end a line
+            with io.open(filename, encoding='utf-8', newline='\n') as fh:
+                for line in fh:
+                    self.ids[line.rstrip("\n")] = len(self.strings)
+                    self.strings.append(line.rstrip("\n"))
+        self.saved = len(self.strings)
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __getitem__(self, identifier):
+        return self.strings[identifier]
+
+    def intern(self, string):
+        """Return the identifier for string, adding string to the vocabulary if
+        it was not in it yet."""
+        identifier = self.ids.get(string)
+        if identifier is None:
+            identifier = len(self.strings)
+            self.ids[string] = identifier
+            self.strings.append(string)
+        return identifier
+
+    def save(self):
+        """Save the strings if any were added since the last save. The file is
+        replaced by writing a temporary file and renaming it, so it is never
+        left half written."""
+        if self.saved == len(self.strings) and os.path.exists(self.filename):
+            return
+        tmp_file = self.filename + '.tmp'
+        with codecs.open(tmp_file, 'w', encoding='utf-8') as fh:
+            for string in self.strings:
+                fh.write(u"%s\n" % string)
+        os.rename(tmp_file, self.filename)
+        self.saved = len(self.strings)
+
+
+class BinaryFeats(object):
+
+    """Gives access to the binary version of a d3_feats data set. The file
+    arguments of the methods are paths relative to the files directory of the
+    data set, as given in the third column of config/files.txt of a corpus."""
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.dir = os.path.join(dataset, BINARY_DIR)
+        self.files_dir = os.path.join(self.dir, 'files')
+        self.years = Vocabulary(os.path.join(self.dir, YEARS_FILE))
+        self.terms = Vocabulary(os.path.join(self.dir, TERMS_FILE))
+        self.features = Vocabulary(os.path.join(self.dir, FEATURES_FILE))
+
+    def text_file(self, filename):
+        return os.path.join(self.dataset, 'files', filename)
+
+    def binary_file(self, filename):
+        return os.path.join(self.files_dir, filename + '.bin.gz')
+
+
+class BinaryFeatsWriter(BinaryFeats):
+
+    """Writes binary files. Files are written under a temporary name and they
+    only get their real name when flush() is called, which first saves the
+    vocabularies."""
+
+    def __init__(self, dataset):
+        BinaryFeats.__init__(self, dataset)
+        self.pending = []
+
+    def write(self, filename, records):
+        """Write the records for filename to a binary file. Each record is a
+        tuple of uid, year, term and list of features."""
+        binary_file = self.binary_file(filename)
+        ensure_path(os.path.dirname(binary_file))
+        fh = gzip.open(binary_file + '.tmp', 'wb')
+        prefix = None
+        for (uid, year, term, features) in records:
+            uid_prefix, chunk_number = uid.rsplit('_', 1)
+            if prefix is None:
+                prefix = uid_prefix.encode('utf-8')
+                fh.write(HEADER.pack(MAGIC, len(prefix)))
+                fh.write(prefix)
+            elif uid_prefix.encode('utf-8') != prefix:
+                raise ValueError("uid %s does not start with %s" % (uid, prefix))
+            feature_ids = [self.features.intern(f) for f in features]
+            fh.write(RECORD.pack(int(chunk_number), self.years.intern(year),
+                                 self.terms.intern(term), len(feature_ids)))
+            fh.write(struct.pack('<%dI' % len(feature_ids), *feature_ids))
+        fh.close()
+        self.pending.append(binary_file)
+
+    def flush(self):
+        """Save the vocabularies and then give all files written since the last
+        flush their real name."""
+        ensure_path(self.dir)
+        self.years.save()
+        self.terms.save()
+        self.features.save()
+        for binary_file in self.pending:
+            os.rename(binary_file + '.tmp', binary_file)
+        self.pending = []
+
+
+class BinaryFeatsReader(BinaryFeats):
+
+    def records(self, filename):
+        """Yield the records in the binary file for filename as tuples of uid,
+        year, term and list of features, all strings."""
+        fh = gzip.open(self.binary_file(filename), 'rb')
+        data = fh.read()
+        fh.close()
+        if not data:
+            return
+        magic, prefix_length = HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError("not a binary feats file: %s" % filename)
+        offset = HEADER.size
+        prefix = data[offset:offset + prefix_length].decode('utf-8')
+        offset += prefix_length
+        years, terms, features = self.years, self.terms, self.features
+        while offset < len(data):
+            chunk_number, year_id, term_id, n = RECORD.unpack_from(data, offset)
+            offset += RECORD.size
+            feature_ids = struct.unpack_from('<%dI' % n, data, offset)
+            offset += 4 * n
+            yield (u"%s_%d" % (prefix, chunk_number), years[year_id],
+                   terms[term_id], [features[f] for f in feature_ids])
+
+    def lines(self, filename):
+        """Yield the lines of the text version of filename."""
+        for (uid, year, term, features) in self.records(filename):
+            yield u"\t".join([uid, year, term] + features) + u"\n"
+
+
+def read_text_records(text_file):
+    """Yield the records in a d3_feats text file. The lines are split before
+    they are decoded, so that they are only split on newlines, see Vocabulary."""
+    if os.path.exists(text_file + '.gz'):
+        fh = gzip.open(text_file + '.gz', 'rb')
+    else:
+        fh = open(text_file, 'rb')
+    for line in fh:
+        fields = line.decode('utf-8').rstrip("\n").split("\t")
+        yield (fields[0], fields[1], fields[2], fields[3:])
+    fh.close()
+
+
+def dataset_filenames(dataset):
+    """Return the names of all files in the data set, relative to its files
+    directory and without the .gz extension."""
+    files_dir = os.path.join(dataset, 'files')
+    filenames = []
+    for (root, dirs, files) in os.walk(files_dir):
+        for fname in files:
+            path = os.path.join(root, fname)[len(files_dir) + 1:]
+            filenames.append(path[:-3] if path.endswith('.gz') else path)
+    return sorted(filenames)
+
+
+def convert_to_binary(dataset, verbose=False):
+    writer = BinaryFeatsWriter(dataset)
+    count = 0
+    for filename in dataset_filenames(dataset):
+        count += 1
+        if verbose:
+            print "[--to-binary] %04d %s" % (count, filename)
+        writer.write(filename, read_text_records(writer.text_file(filename)))
+        if count % 100 == 0:
+            writer.flush()
+    writer.flush()
+    print "[--to-binary] converted %d files, %d terms, %d features" \
+          % (count, len(writer.terms), len(writer.features))
+
+
+def convert_to_text(dataset, output_dir, verbose=False):
+    reader = BinaryFeatsReader(dataset)
+    count = 0
+    for filename in dataset_filenames(dataset):
+        if not os.path.exists(reader.binary_file(filename)):
+            continue
+        count += 1
+        if verbose:
+            print "[--to-text] %04d %s" % (count, filename)
+        text_file = os.path.join(output_dir, filename)
+        ensure_path(os.path.dirname(text_file))
+        fh = open_output_file(text_file, compress=True)
+        for line in reader.lines(filename):
+            fh.write(line)
+        fh.close()
+    print "[--to-text] converted %d files" % count
+
+
+if __name__ == '__main__':
+
+    options = ['to-binary', 'to-text', 'dataset=', 'output=', 'verbose']
+    (opts, args) = getopt.getopt(sys.argv[1:], 'd:o:v', options)
+    to_binary_p, to_text_p, verbose = False, False, False
+    dataset, output = None, None
+    for opt, val in opts:
+        if opt == '--to-binary': to_binary_p = True
+        if opt == '--to-text': to_text_p = True
+        if opt in ('-d', '--dataset'): dataset = val
+        if opt in ('-o', '--output'): output = val
+        if opt in ('-v', '--verbose'): verbose = True
+
+    if dataset is None:
+        exit("WARNING: missing --dataset argument")
+    if to_binary_p:
+        convert_to_binary(dataset, verbose)
+    elif to_text_p:
+        if output is None:
+            exit("WARNING: missing --output argument")
+        convert_to_text(dataset, output, verbose)
@@ -0,0 +1,237 @@
+"""feats2matrix.py
+
+Build sparse feature matrices from the d3_feats files of a corpus.
+
+Usage:
+
+    $ python feats2matrix.py [--version VERSION] CORPUS_DIRECTORY OUTPUT_DIRECTORY
+
+This streams all d3_feats files listed in the file list of the corpus and
+creates two matrices in compressed sparse row (CSR) format: an occurrence x
+feature matrix with one row for each line in the d3_feats files and a term x
+feature matrix with one row for each term, where each cell has the number of
+times the feature occurred with the term. The following files are written to
+OUTPUT_DIRECTORY:
+
+    features.txt                column labels, one feature per line
+    occurrences.txt             row labels, uid, year and term for each row
+    occurrences.indptr.npy      row pointers
+    occurrences.indices.npy     column index for each non-zero cell
+    occurrences.data.npy        value of each non-zero cell
+    terms.txt                   row labels, one term per line
+    terms.indptr.npy
+    terms.indices.npy
+    terms.data.npy
+
+The files are taken from d3_feats data set 01, a corpus can have more than one
+d3_feats data set (for example one for each set of chunker rules) and the
+--version option selects another one, as in --version 02.
+
+The arrays are standard NumPy files, but they are written without using NumPy.
+Column indices within a row are sorted. The matrices can be loaded (and memory
+mapped) with load_matrix(), which does require NumPy and SciPy:
+
+    import feats2matrix
+    matrix = feats2matrix.load_matrix('sample-us-matrix', 'terms')
+
+Note that the term x feature matrix is built in memory, which may not be
+feasible for very large corpora, and that the occurrence rows are written as
+they are read.
+
+"""
+
+
+import os, sys, array, struct, codecs, getopt
+
+from corpus import Corpus
+from utils.path import ensure_path, open_input_file
+
+
+# total size of the header of the npy files, this is fixed so we can write the
+# header after all data are written and the shape is known
+NPY_HEADER_SIZE = 128
+
+
+class NpyWriter(object):
+
+    """Writes a one-dimensional array of integers to a file in the NumPy npy
+    format, values are buffered and appended to the file, the header is
+    written when the file is closed."""
+
+    def __init__(self, filename, typecode='i', buffer_size=100000):
+        self.filename = filename
+        self.typecode = typecode
+        self.buffer = array.array(typecode)
+        self.buffer_size = buffer_size
+        self.length = 0
+        self.fh = open(filename, 'wb')
+        self.fh.write(' ' * NPY_HEADER_SIZE)
+
+    def append(self, value):
+        self.buffer.append(value)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def extend(self, values):
+        self.buffer.extend(values)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        self.buffer.tofile(self.fh)
+        self.length += len(self.buffer)
+        self.buffer = array.array(self.typecode)
+
+    def close(self):
+        self.flush()
+        self.fh.seek(0)
+        self.fh.write(npy_header(self.typecode, self.length))
+        self.fh.close()
+
+
+def npy_header(typecode, length):
+    """Return the header for a version 1.0 npy file with a one-dimensional
+    array of the given array typecode and length, padded to NPY_HEADER_SIZE."""
+    byteorder = '<' if sys.byteorder == 'little' else '>'
+    descr = "%si%d" % (byteorder, array.array(typecode).itemsize)
+    header = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }" % (descr, length)
+    prefix = "\x93NUMPY\x01\x00" + struct.pack('<H', NPY_HEADER_SIZE - 10)
+    return prefix + header.ljust(NPY_HEADER_SIZE - 11) + "\n"
+
+
+class CSRWriter(object):
+
+    """Writes the indptr, indices and data arrays of a CSR matrix one row at a
+    time. Row pointers use the long typecode so they can exceed 2^31."""
+
+    def __init__(self, output_dir, name):
+        path = os.path.join(output_dir, name)
+        self.indptr = NpyWriter(path + '.indptr.npy', 'l')
+        self.indices = NpyWriter(path + '.indices.npy', 'i')
+        self.data = NpyWriter(path + '.data.npy', 'i')
+        self.nnz = 0
+        self.indptr.append(0)
+
+    def add_row(self, cells):
+        """Add a row, cells is a list of (column, value) pairs sorted on
+        column."""
+        for column, value in cells:
+            self.indices.append(column)
+            self.data.append(value)
+        self.nnz += len(cells)
+        self.indptr.append(self.nnz)
+
+    def close(self):
+        for writer in (self.indptr, self.indices, self.data):
+            writer.close()
+
+
+class FeatureIndex(object):
+
+    """Maps feature strings to column numbers in the order they were seen."""
+
+    def __init__(self):
+        self.features = []
+        self.columns = {}
+
+    def column(self, feature):
+        column = self.columns.get(feature)
+        if column is None:
+            column = len(self.features)
+            self.columns[feature] = column
+            self.features.append(feature)
+        return column
+
+
+def corpus_feats_files(corpus_path, version='01'):
+    """Return the paths of all d3_feats files in the corpus, in the order of
+    the corpus file list."""
+    data_set = os.path.join(corpus_path, 'data', 'd3_feats', version, 'files')
+    corpus = Corpus(None, None, None, None, corpus_path, None, None)
+    fnames = []
+    for line in open(corpus.file_list):
+        fields = line.strip().split("\t")
+        if len(fields) > 1:
+            fnames.append(os.path.join(data_set, fields[-1]))
+    return fnames
+
+
+def build_matrices(corpus_path, output_dir, version='01'):
+    ensure_path(output_dir)
+    feature_index = FeatureIndex()
+    occurrences = CSRWriter(output_dir, 'occurrences')
+    occurrence_labels = codecs.open(os.path.join(output_dir, 'occurrences.txt'),
+                                    'w', encoding='utf-8')
+    # term x feature counts, collected in memory
+    term_rows = {}
+    terms = []
+    count = 0
+    for fname in corpus_feats_files(corpus_path, version):
+        count += 1
+        if count % 100 == 0:
+            print "%6d  %s" % (count, fname)
+        fh = open_input_file(fname)
+        if fh is None:
+            continue
+        for line in fh:
+            fields = line.rstrip("\n").split("\t")
+            uid, year, term = fields[:3]
+            columns = sorted(set([feature_index.column(f) for f in fields[3:]]))
+            occurrences.add_row([(column, 1) for column in columns])
+            occurrence_labels.write(u"%s\t%s\t%s\n" % (uid, year, term))
+            row = term_rows.get(term)
+            if row is None:
+                row = term_rows[term] = {}
+                terms.append(term)
+            for column in columns:
+                row[column] = row.get(column, 0) + 1
+        fh.close()
+    occurrences.close()
+    occurrence_labels.close()
+    _write_term_matrix(output_dir, terms, term_rows)
+    _write_labels(os.path.join(output_dir, 'features.txt'), feature_index.features)
+    print "Wrote %d occurrences, %d terms and %d features to %s" \
+          % (occurrences.indptr.length - 1, len(terms), len(feature_index.features),
+             output_dir)
+
+
+def _write_term_matrix(output_dir, terms, term_rows):
+    matrix = CSRWriter(output_dir, 'terms')
+    for term in terms:
+        matrix.add_row(sorted(term_rows[term].items()))
+    matrix.close()
+    _write_labels(os.path.join(output_dir, 'terms.txt'), terms)
+
+
+def _write_labels(fname, labels):
+    with codecs.open(fname, 'w', encoding='utf-8') as fh:
+        for label in labels:
+            fh.write(u"%s\n" % label)
+
+
+def load_matrix(output_dir, name, mmap_mode='r'):
+    """Load one of the matrices created by build_matrices() as a SciPy CSR
+    matrix, name is either 'occurrences' or 'terms'. The arrays are memory
+    mapped unless mmap_mode is None."""
+    import numpy
+    from scipy.sparse import csr_matrix
+    path = os.path.join(output_dir, name)
+    indptr = numpy.load(path + '.indptr.npy', mmap_mode=mmap_mode)
+    indices = numpy.load(path + '.indices.npy', mmap_mode=mmap_mode)
+    data = numpy.load(path + '.data.npy', mmap_mode=mmap_mode)
+    columns = sum(1 for _ in open(os.path.join(output_dir, 'features.txt')))
+    return csr_matrix((data, indices, indptr), shape=(len(indptr) - 1, columns))
+
+
+if __name__ == '__main__':
+
+    (opts, args) = getopt.getopt(sys.argv[1:], 'v:', ['version='])
+    version = '01'
+    for opt, val in opts:
+        if opt in ('-v', '--version'): version = val
+    if len(args) != 2:
+        exit("Usage: python feats2matrix.py [--version VERSION] CORPUS_DIRECTORY OUTPUT_DIRECTORY")
+    data_set = os.path.join(args[0], 'data', 'd3_feats', version)
+    if not os.path.isdir(data_set):
+        exit("WARNING: data set %s does not exist" % data_set)
+    build_matrices(args[0], args[1], version)
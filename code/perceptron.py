@@ -0,0 +1,434 @@
+"""perceptron.py
+
+A pure-Python part-of-speech tagger based on an averaged perceptron, used by
+--txt2tag with the --tagger=perceptron option. It does not need Java and starts
+up much faster than the Stanford tagger, but it is less accurate.
+
+The tagger is trained on existing d2_tag files, so it learns the Penn Treebank
+tags (and the tokenization conventions, like -LRB- for an opening parenthesis)
+that the Stanford tagger produces and that the chunker rules in the chunk schema
+expect. Text is tokenized with a simple Penn Treebank style tokenizer and split
+into sentences at sentence-final punctuation.
+
+USAGE:
+
+    $ python perceptron.py --train --model FILE [--iterations N] PATH ...
+    $ python perceptron.py --evaluate --model FILE PATH ...
+
+PATH is a d2_tag file or a directory, in which case all files in the directory
+and its sub directories are used, for example the d2_tag/01 data set of a
+corpus. With --train, one in every ten sentences is held out and the accuracy on
+those sentences is printed at the end. The default number of training
+iterations is 5. With --evaluate the accuracy of the model on the sentences in
+the files is printed.
+
+To use the tagger from other scripts:
+
+    import perceptron
+    tagger = perceptron.PerceptronTagger('perceptron-tagger-en.pickle.gz')
+    print tagger.tag_many([u"The pump has a control element."])
+
+"""
+
+import os, sys, re, gzip, random, getopt, cPickle
+from collections import defaultdict
+
+from utils.path import open_input_file
+
+
+# Tokenization
+
+# parentheses and brackets are escaped the same way as by the Stanford tagger
+BRACKETS = {u'(': u'-LRB-', u')': u'-RRB-', u'[': u'-LSB-', u']': u'-RSB-',
+            u'{': u'-LCB-', u'}': u'-RCB-'}
+CLOSING = set([u'-RRB-', u'-RSB-', u'-RCB-', u"''", u"'"])
+LEADING = u'([{"\'`'
+TRAILING = u')]}"\',;:?!%'
+SENTENCE_FINAL = set([u'.', u'?', u'!'])
+
+# words with internal periods like U.S. and e.g., single capitals with a
+# period and some common abbreviations keep their period
+ABBREVIATION = re.compile(r"^(?:[^\W\d_]\.){2,}$|^[A-Z]\.$", re.UNICODE)
+ABBREVIATIONS = set(['al.', 'approx.', 'ca.', 'co.', 'corp.', 'eq.', 'etc.', 'fig.',
+                     'figs.', 'inc.', 'ltd.', 'no.', 'nos.', 'vol.', 'vs.'])
+
+CONTRACTION = re.compile(r"^(.+?)(n't|'s|'re|'ve|'ll|'d|'m)$", re.IGNORECASE | re.UNICODE)
+
+# periods between two words, as in 'hydrogen.Conventionally' or '400.degree',
+# which are often the result of missing whitespace in the source text, and long
+# runs of underscores, dashes and equal signs used as separators in tables
+GLUED_PERIOD = re.compile(r"(?<=[^\W_]{2})\.(?=[^\W\d_])", re.UNICODE)
+SEPARATOR = re.compile(r"(_{3,}|-{3,}|={3,})")
+
+
+def tokenize(text):
+    """Return the list of tokens in text."""
+    tokens = []
+    text = SEPARATOR.sub(r" \1 ", text)
+    chunks = []
+    for chunk in text.split():
+        if u'.' in chunk and ABBREVIATION.match(chunk) is None:
+            chunk = GLUED_PERIOD.sub(u" . ", chunk)
+        chunks.extend(chunk.split())
+    for chunk in chunks:
+        leading, trailing = [], []
+        while chunk and chunk[0] in LEADING:
+            leading.append(u'``' if chunk[0] == u'"' else chunk[0])
+            chunk = chunk[1:]
+        while chunk:
+            if chunk[-1] in TRAILING:
+                trailing.insert(0, u"''" if chunk[-1] == u'"' else chunk[-1])
+                chunk = chunk[:-1]
+            elif chunk.endswith(u'...'):
+                trailing.insert(0, u'...')
+                chunk = chunk[:-3]
+            elif chunk.endswith(u'.') and not _is_abbreviation(chunk):
+                trailing.insert(0, u'.')
+                chunk = chunk[:-1]
+            else:
+                break
+        tokens.extend(leading)
+        if chunk:
+            match = CONTRACTION.match(chunk)
+            tokens.extend(match.groups() if match else [chunk])
+        tokens.extend(trailing)
+    # the Stanford tokenizer escapes forward slashes
+    return [BRACKETS.get(token, token).replace(u'/', u'\\/') for token in tokens]
+
+
+def _is_abbreviation(word):
+    return ABBREVIATION.match(word) is not None or word.lower() in ABBREVIATIONS
+
+
+def split_sentences(tokens):
+    """Split a list of tokens into a list of sentences, each a list of tokens.
+    Sentences end after sentence-final punctuation and the closing brackets and
+    quotes that follow it."""
+    sentences, sentence = [], []
+    for token in tokens:
+        if sentence and sentence[-1] in SENTENCE_FINAL and token not in CLOSING:
+            sentences.append(sentence)
+            sentence = []
+        elif sentence and sentence[-1] in CLOSING and token not in CLOSING \
+                and _ends_sentence(sentence):
+            sentences.append(sentence)
+            sentence = []
+        sentence.append(token)
+    if sentence:
+        sentences.append(sentence)
+    return sentences
+
+
+def _ends_sentence(sentence):
+    """Return True if the sentence ends in sentence-final punctuation followed by
+    closing brackets and quotes only."""
+    for token in reversed(sentence):
+        if token not in CLOSING:
+            return token in SENTENCE_FINAL
+    return False
+
+
+# The perceptron
+
+class AveragedPerceptron(object):
+
+    """A multi-class perceptron where the final weights are the averages of the
+    weights after each update, which makes the model much less sensitive to the
+    last training examples. Weights are stored as a dictionary from features to
+    dictionaries from classes to weights."""
+
+    def __init__(self):
+        self.weights = {}
+        self.classes = set()
+        # accumulated weights for each (feature, class) pair and the time of
+        # their last change, used to compute the averages
+        self._totals = defaultdict(float)
+        self._timestamps = defaultdict(int)
+        self.updates = 0
+
+    def scores(self, features):
+        scores = defaultdict(float)
+        for feature in features:
+            weights = self.weights.get(feature)
+            if weights is None:
+                continue
+            for cls, weight in weights.iteritems():
+                scores[cls] += weight
+        return scores
+
+    def predict(self, features):
+        """Return the best class for the features, ties are broken on the name
+        of the class so that results do not depend on dictionary order."""
+        scores = self.scores(features)
+        return max(self.classes, key=lambda cls: (scores[cls], cls))
+
+    def update(self, truth, guess, features):
+        self.updates += 1
+        if truth == guess:
+            return
+        for feature in features:
+            weights = self.weights.setdefault(feature, {})
+            self._update_weight(feature, truth, weights.get(truth, 0.0), 1.0)
+            self._update_weight(feature, guess, weights.get(guess, 0.0), -1.0)
+
+    def _update_weight(self, feature, cls, weight, change):
+        key = (feature, cls)
+        self._totals[key] += (self.updates - self._timestamps[key]) * weight
+        self._timestamps[key] = self.updates
+        self.weights[feature][cls] = weight + change
+
+    def average_weights(self):
+        """Replace the weights with their averages, this should be called once
+        after training. Weights that average to zero are removed."""
+        for feature, weights in self.weights.items():
+            averaged = {}
+            for cls, weight in weights.iteritems():
+                key = (feature, cls)
+                total = self._totals[key] + (self.updates - self._timestamps[key]) * weight
+                average = round(total / float(self.updates), 3)
+                if average:
+                    averaged[cls] = average
+            if averaged:
+                self.weights[feature] = averaged
+            else:
+                del self.weights[feature]
+        self._totals = defaultdict(float)
+        self._timestamps = defaultdict(int)
+
+
+# The tagger
+
+START = [u'-START-', u'-START2-']
+END = [u'-END-', u'-END2-']
+
+
+class PerceptronTagger(object):
+
+    """Part-of-speech tagger with the same tag_many() interface as sdp.Tagger.
+    Words that were seen often enough in the training data and that almost
+    always had the same tag are tagged from a dictionary, all other words are
+    tagged by the perceptron, from left to right. The features that do not
+    depend on earlier tags are extracted for the whole sentence in one go."""
+
+    def __init__(self, model_file=None):
+        self.model = AveragedPerceptron()
+        self.tagdict = {}
+        if model_file is not None:
+            self.load(model_file)
+
+    def tag_many(self, texts):
+        """Tag all texts and return a list with a list of tagged sentence strings
+        for each text, with the format used by the Stanford tagger."""
+        return [self.tag_text(text) for text in texts]
+
+    def tag_text(self, text):
+        return [u' '.join([u"%s_%s" % (word, tag) for word, tag in self.tag_tokens(sentence)])
+                for sentence in split_sentences(tokenize(text))]
+
+    def tag_tokens(self, tokens):
+        """Return a list of pairs of token and tag."""
+        context = START + [normalize(token) for token in tokens] + END
+        static = sentence_features(tokens, context)
+        tags = []
+        prev, prev2 = START
+        for i, token in enumerate(tokens):
+            tag = self.tagdict.get(context[i + 2])
+            if tag is None:
+                tag = self.model.predict(tag_features(static[i], prev, prev2, context[i + 2]))
+            tags.append(tag)
+            prev2, prev = prev, tag
+        return zip(tokens, tags)
+
+    def train(self, sentences, iterations=5, verbose=False, seed=0):
+        """Train the tagger on a list of sentences, each a pair of a list of
+        tokens and a list of tags. The sentences are shuffled between
+        iterations."""
+        sentences = list(sentences)
+        self._make_tagdict(sentences)
+        shuffle = random.Random(seed).shuffle
+        for iteration in range(iterations):
+            correct, total = 0, 0
+            for tokens, gold_tags in sentences:
+                context = START + [normalize(token) for token in tokens] + END
+                static = sentence_features(tokens, context)
+                prev, prev2 = START
+                for i, token in enumerate(tokens):
+                    guess = self.tagdict.get(context[i + 2])
+                    if guess is None:
+                        features = tag_features(static[i], prev, prev2, context[i + 2])
+                        guess = self.model.predict(features)
+                        self.model.update(gold_tags[i], guess, features)
+                    prev2, prev = prev, guess
+                    correct += guess == gold_tags[i]
+                    total += 1
+            shuffle(sentences)
+            if verbose:
+                print "[perceptron] iteration %d: %d of %d correct (%.2f%%)" \
+                      % (iteration + 1, correct, total, _percentage(correct, total))
+        self.model.average_weights()
+
+    def _make_tagdict(self, sentences, min_frequency=20, min_ratio=0.97):
+        counts = defaultdict(lambda: defaultdict(int))
+        for tokens, tags in sentences:
+            for token, tag in zip(tokens, tags):
+                counts[normalize(token)][tag] += 1
+                self.model.classes.add(tag)
+        for word, tag_counts in counts.iteritems():
+            tag, count = max(tag_counts.iteritems(), key=lambda pair: (pair[1], pair[0]))
+            frequency = sum(tag_counts.values())
+            if frequency >= min_frequency and count / float(frequency) >= min_ratio:
+                self.tagdict[word] = tag
+
+    def evaluate(self, sentences):
+        """Return the number of correct tags and the number of tokens when the
+        tagger tags the tokens of the sentences."""
+        correct, total = 0, 0
+        for tokens, gold_tags in sentences:
+            for (token, tag), gold_tag in zip(self.tag_tokens(tokens), gold_tags):
+                correct += tag == gold_tag
+                total += 1
+        return correct, total
+
+    def save(self, model_file):
+        fh = gzip.open(model_file, 'wb')
+        cPickle.dump((self.model.weights, self.tagdict, self.model.classes), fh, 2)
+        fh.close()
+
+    def load(self, model_file):
+        fh = gzip.open(model_file, 'rb')
+        self.model.weights, self.tagdict, self.model.classes = cPickle.load(fh)
+        fh.close()
+
+
+def normalize(token):
+    """Return the normalized version of a token used for the features and the
+    tag dictionary, the model is caseless just like the Stanford model that we
+    use for English."""
+    if u'-' in token and token[0] != u'-':
+        return u'!HYPHEN'
+    if token.isdigit() and len(token) == 4:
+        return u'!YEAR'
+    if token[0].isdigit():
+        return u'!DIGITS'
+    return token.lower()
+
+
+def sentence_features(tokens, context):
+    """Return for each token the list of features that do not depend on the
+    tags of the previous tokens."""
+    features = []
+    for i, token in enumerate(tokens):
+        word = context[i + 2]
+        features.append([
+            u'bias',
+            u'w ' + word,
+            u'suf ' + token[-3:].lower(),
+            u'pre ' + token[0].lower(),
+            u'shape ' + _shape(token),
+            u'-1w ' + context[i + 1],
+            u'-1suf ' + context[i + 1][-3:],
+            u'-2w ' + context[i],
+            u'+1w ' + context[i + 3],
+            u'+1suf ' + context[i + 3][-3:],
+            u'+2w ' + context[i + 4]])
+    return features
+
+
+def tag_features(static, prev, prev2, word):
+    """Add the features that depend on the tags of the previous tokens to the
+    static features of a token."""
+    return static + [u'-1t ' + prev,
+                     u'-2t ' + prev2,
+                     u'-1t-2t %s %s' % (prev, prev2),
+                     u'-1t w %s %s' % (prev, word)]
+
+
+def _shape(token):
+    if token.isalpha():
+        return u'alpha'
+    if any(c.isdigit() for c in token):
+        return u'digit'
+    if any(c.isalpha() for c in token):
+        return u'mixed'
+    return u'punct'
+
+
+def read_tagged_sentences(filenames):
+    """Yield a pair of a list of tokens and a list of tags for each sentence in
+    the d2_tag files, section headers are skipped."""
+    for filename in filenames:
+        if filename.endswith('.gz'):
+            filename = filename[:-3]
+        fh = open_input_file(filename)
+        for line in fh:
+            if line.startswith('FH_') or not line.strip():
+                continue
+            tokens, tags = [], []
+            for tagged_token in line.split():
+                if u'_' not in tagged_token:
+                    continue
+                token, tag = tagged_token.rsplit(u'_', 1)
+                if token and tag:
+                    tokens.append(token)
+                    tags.append(tag)
+            if tokens:
+                yield tokens, tags
+        fh.close()
+
+
+def find_files(paths):
+    """Return the files for a list of paths, directories are replaced by all
+    files in them and their sub directories, in sorted order. File names of
+    compressed files keep their .gz extension."""
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            for (root, dirs, files) in os.walk(path):
+                filenames.extend([os.path.join(root, f) for f in files])
+        else:
+            filenames.append(path)
+    return sorted(filenames)
+
+
+def _percentage(part, total):
+    return 100.0 * part / total if total else 0.0
+
+
+def train_model(model_file, paths, iterations=5):
+    sentences = list(read_tagged_sentences(find_files(paths)))
+    training = [s for i, s in enumerate(sentences) if i % 10 != 0]
+    held_out = [s for i, s in enumerate(sentences) if i % 10 == 0]
+    print "[perceptron] training on %d sentences, holding out %d" \
+          % (len(training), len(held_out))
+    tagger = PerceptronTagger()
+    tagger.train(training, iterations, verbose=True)
+    tagger.save(model_file)
+    correct, total = tagger.evaluate(held_out)
+    print "[perceptron] accuracy on held out sentences: %.2f%%" % _percentage(correct, total)
+    print "[perceptron] saved model to %s" % model_file
+
+
+def evaluate_model(model_file, paths):
+    tagger = PerceptronTagger(model_file)
+    correct, total = tagger.evaluate(read_tagged_sentences(find_files(paths)))
+    print "[perceptron] %d of %d tags correct, accuracy %.2f%%" \
+          % (correct, total, _percentage(correct, total))
+
+
+if __name__ == '__main__':
+
+    options = ['train', 'evaluate', 'model=', 'iterations=']
+    (opts, args) = getopt.getopt(sys.argv[1:], 'm:', options)
+    train_p, evaluate_p, model, iterations = False, False, None, 5
+    for opt, val in opts:
+        if opt == '--train': train_p = True
+        if opt == '--evaluate': evaluate_p = True
+        if opt in ('-m', '--model'): model = val
+        if opt == '--iterations': iterations = int(val)
+
+    if model is None:
+        exit("WARNING: missing --model argument")
+    if train_p:
+        train_model(model, args, iterations)
+    elif evaluate_p:
+        evaluate_model(model, args)
@@ -17,8 +17,10 @@ for more details.
 USAGE:
 
     $ python repository.py --initialize --repository PATH --type STRING
-    $ python repository.py --add-corpus --repository PATH --corpus PATH
+    $ python repository.py --add-corpus --repository PATH --corpus PATH [--workers N]
     $ python repository.py --analyze --repository PATH
+    $ python repository.py --build-index --repository PATH
+    $ python repository.py --pack --repository PATH [--remove-packed-files]
 
     There are short versions for some of the options: --repository (-r),
     --type (-t) and --corpus (-c)
@@ -38,6 +40,8 @@ structure:
     documents/
     logs/
     index/
+       index.sqlite
+       idx-ids.cache
        idx-dates.txt
        idx-identifiers.txt
        idx-files.txt
@@ -57,8 +61,17 @@ files may be added over time, some specific to particular repository types. The
 type.txt file contains the type of the repository, which is used each time the
 repository is opened.
 
-TODO: add an SQLite database that replaces all the index files. The index files
-could still be kept around as a kind of journal files.
+The index is the SQLite database in index/index.sqlite, see RepositoryIndex for
+its tables. Lookups, membership checks and the analysis use the database, the
+idx-*.txt files are kept as journal files. The database is created from the
+journal files when a repository without a database is opened, and it can be
+rebuilt from the journal files with
+
+    $ python repository.py --build-index --repository test
+
+The identifiers in idx-ids.txt are also cached in a compact form in
+index/idx-ids.cache, see IdentifierSet, which is used to skip documents that
+are already in the repository when corpora are added.
 
 There are several kinds of repositories, each making different assumptions on
 identifiers:
@@ -99,8 +112,15 @@ To add all data from a corpus:
 Existing data will not be overwritten. At some point we may add a flag that
 allows you to overwrite existing data. 
 
-More corpora can be added later. This needs to be done one corpus at a time, no
-conccurrency is implemented.
+More corpora can be added later. Several corpora can be added in one go by
+repeating the --corpus option, and the files can be copied by several worker
+processes:
+
+    $ python repository.py --add-corpus -r test -c CORPUS1 -c CORPUS2 --workers 8
+
+Only the main process writes to the index. The index is locked while corpora
+are added, so if another process is adding corpora to the same repository then
+the second process waits for the first one to finish.
 
 During a corpus load, source files are added to /data/sources and processed
 files to data/processed. For patents, the directory strcuture in data/sources is
@@ -125,6 +145,23 @@ Corpus loads also update the index files and add a time-stamped log file to the
 logs directory.
 
 
+PACKED STORAGE
+
+Having a file for each source and processed file means millions of small files
+for large repositories. Optionally, these files can be moved to a packed store
+in data/packs, which has a few large segment files with the compressed files
+one after the other, see PackStore. The locations of the files in the segments
+are kept in the index. To move all files in the tree to the packed store:
+
+    $ python repository.py --pack -r test --remove-packed-files
+
+Without --remove-packed-files the files are copied and the tree is left as it
+is. Files that are already packed are skipped, so this can be run again after
+adding corpora, which always adds files to the tree. Note that the methods that
+return paths (see below) only know about the tree, use open_document() to read
+files from the packed store or from the tree.
+
+
 USING FROM OTHER SCRIPTS
 
 There are a couple of utility methods intended to be used from other
@@ -140,6 +177,13 @@ scripts. These methods convert between paths and identifiers:
 
 Methods that return paths will return None if the path does not exist.
 
+To read many documents, use get_documents(), which takes a list of identifiers
+and a processing step and yields pairs of identifiers and file objects, or
+uncompressed contents if contents=True. It looks up documents in batches and
+reads files ahead of the caller on a pool of threads, which helps a lot when
+the repository is on a network file system. Documents without a file for the
+step are skipped. Unlike the methods above it also reads from the packed store.
+
 What is returned is actually the path with the .gz extension stripped off. This
 is so the result works nicely with utils.path.open_input_file(), which does not
 expect the .gz extension.
@@ -158,14 +202,20 @@ Examples:
     print repo.shortid2filepath('5723853')
     print repo.shortid2filepath('5723853', 'd2_tag')
     print repo.longid2shortid('US5723853A.xml')
+    print repo.open_document('5723853', 'd2_tag').read()
+    for id, fh in repo.get_documents(['5723853', '5723854'], 'd2_tag'):
+        print id, fh.read()
 
 """
 
 
-import os, sys, re, time, shutil, getopt, glob
+import os, sys, re, time, shutil, getopt, glob, sqlite3, fcntl, gzip, StringIO
+import array, bisect, collections, heapq, threading, traceback
+from multiprocessing.pool import ThreadPool
 from config import DEFAULT_PIPELINE
 from corpus import Corpus
 from utils.path import compress, ensure_path, read_only, make_writable
+from utils import parallel
 
 
 REPOSITORY_DIR = '/home/j/corpuswork/fuse/FUSEData/repositories'
@@ -176,6 +226,17 @@ re_PATENT = re.compile('^(B|D|H|HD|RE|PP|T)?(\d+)(.*)')
 
 PROCESSING_STEPS = ('d1_txt', 'd2_seg', 'd2_tag', 'd3_phr_feats')
 
+# a new segment of the packed store is started when the last segment has grown
+# beyond this size, and each file in a segment is preceded by this header
+PACK_SEGMENT_SIZE = 1 << 30
+PACK_HEADER = "MEMBER\t%s\t%s\t%d\n"
+
+# number of threads that read files for get_documents(), the number of files
+# that are read ahead, and the number of identifiers looked up in one query
+FETCH_THREADS = 8
+FETCH_AHEAD = 64
+LOOKUP_BATCH_SIZE = 500
+
 
 
 class RepositoryError(Exception):
@@ -228,6 +289,12 @@ class Repository(object):
         self.idx_ids = os.path.join(self.idx_dir, 'idx-ids.txt')
         self.idx_files = os.path.join(self.idx_dir, 'idx-files.txt')
         self.idx_dates = os.path.join(self.idx_dir, 'idx-dates.txt')
+        self.idx_db = os.path.join(self.idx_dir, 'index.sqlite')
+        self.idx_ids_cache = os.path.join(self.idx_dir, 'idx-ids.cache')
+        self.pack_dir = os.path.join(self.dir, 'data', 'packs')
+        self.index = None
+        self.packs = None
+        self.identifiers = None
 
     def __str__(self):
         return "<%s '%s'>" % (self.__class__.__name__, self.dir)
@@ -244,23 +311,32 @@ class Repository(object):
         for fname in self._index_files():
             open(fname, 'w').close()
             read_only(fname)
+        RepositoryIndex(self).close()
 
     def _index_files(self):
         """Return a list of all index files."""
         fnames = [self.idx_ids, self.idx_files, self.idx_dates]
         for step in PROCESSING_STEPS:
-            fnames.append("%s%sidx-processed-%s.txt" % (self.idx_dir, os.sep, step))
+            fnames.append(self._processed_index_file(step))
         return fnames
 
+    def _processed_index_file(self, step):
+        return "%s%sidx-processed-%s.txt" % (self.idx_dir, os.sep, step)
+
     def read_identifiers(self):
-        """Return a dictionary with as keys all the identifiers in the
-        repository. This works for now with smaller repositories, but we may
-        need to start using an SQLite database."""
-        identifiers = {}
-        fh = open(self.idx_ids)
-        for line in fh:
-            identifiers[line.strip()] = True
-        return identifiers
+        """Return an IdentifierSet with all the identifiers in the repository.
+        The set is loaded from the cache of idx-ids.txt, only the identifiers
+        that were added to idx-ids.txt after the cache was saved are read from
+        that file."""
+        if self.identifiers is None:
+            self.identifiers = IdentifierSet.load(self.idx_ids_cache, self.idx_ids)
+        return self.identifiers
+
+    def save_identifiers(self):
+        """Save the cache of idx-ids.txt, this should only be done when the
+        index is locked and idx-ids.txt is closed."""
+        if self.identifiers is not None:
+            self.identifiers.save(self.idx_ids_cache, os.path.getsize(self.idx_ids))
 
     def filepath2longid(self, path): raise RepositoryError("not yet implemented")
     def filepath2shortid(self, path): raise RepositoryError("not yet implemented")
@@ -269,67 +345,277 @@ class Repository(object):
     def longid2shortid(self, id): raise RepositoryError("not yet implemented")
 
     def analyze(self):
-        files = 0
-        size = 0
-        for line in open(self.idx_files):
-            (timestamp, id, filesize, path) = line.rstrip().split("\t")
-            files += 1
-            size += int(filesize)
+        self.load_index()
+        files, size = self.index.file_statistics()
         print self
         print "  %6sMB  - source size (compressed)" % (size/1000000)
         print "  %8s -  number of files" % files
+        for step, count in self.index.processed_counts():
+            print "  %8s -  number of files in %s" % (count, step)
+        for step, count, size in self.index.packed_counts():
+            print "  %8s -  number of packed files in %s (%dMB)" % (count, step, size/1000000)
 
     def load_index(self):
-        self.index = RepositoryIndex(self)
+        if self.index is None:
+            self.index = RepositoryIndex(self)
+
+    def load_packs(self):
+        if self.packs is None:
+            self.load_index()
+            self.packs = PackStore(self)
+
+    def build_index(self):
+        """Rebuild the index database from the index files and the segment
+        files of the packed store."""
+        self.load_index()
+        self.index.import_index_files()
+        if os.path.isdir(self.pack_dir):
+            self.load_packs()
+            self.packs.rebuild_index()
+
+    def _lock_index(self):
+        """Take the lock on the index and return the open lock file, the lock
+        is released when the file is closed."""
+        lock = open(os.path.join(self.idx_dir, 'lock'), 'w')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            print "Waiting for another process to release the index lock..."
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def tree_path(self, identifier, step='source'):
+        """Return the path of the compressed file of the document in the tree
+        of sources or processed files, or None if the document has no source
+        file in the index. The path may not exist, for example if the document
+        was not processed or if the file was moved to the packed store."""
+        path = self.index.source_path(identifier)
+        if path is None:
+            return None
+        return self._tree_path(path, step)
+
+    def _tree_path(self, path, step):
+        base_dir = self.data_dir if step == 'source' else os.path.join(self.proc_dir, step)
+        return os.path.join(base_dir, path) + '.gz'
+
+    def open_document(self, identifier, step='source'):
+        """Return a file object with the uncompressed contents of the source of
+        the document or of the processed file for step, taken from the packed
+        store if it is there and from the tree otherwise. Returns None if there
+        is no such file."""
+        self.load_packs()
+        fh = self.packs.open(identifier, step)
+        if fh is not None:
+            return fh
+        path = self.tree_path(identifier, step)
+        if path is not None and os.path.exists(path):
+            return gzip.open(path)
+        return None
+
+    def get_documents(self, identifiers, step='source', contents=False,
+                      threads=FETCH_THREADS, ahead=FETCH_AHEAD):
+        """Yield a pair of the identifier and a file object with the uncompressed
+        contents for each document in identifiers that has a file for step, or
+        a pair of the identifier and the uncompressed contents if contents is
+        True. Documents are yielded in the order of identifiers, documents that
+        are not in the repository or that have no file for step are skipped.
+        The locations of the files are looked up in the index in batches and
+        files are read and uncompressed by a pool of threads that work at most
+        ahead documents ahead of the caller."""
+        self.load_packs()
+        pool = ThreadPool(threads)
+        pending = collections.deque()
+        try:
+            for identifier, packed, location in self._locate_documents(identifiers, step):
+                pending.append(pool.apply_async(
+                    self._fetch_document, (identifier, packed, location, contents)))
+                while len(pending) >= ahead or (pending and pending[0].ready()):
+                    result = pending.popleft().get()
+                    if result is not None:
+                        yield result
+            while pending:
+                result = pending.popleft().get()
+                if result is not None:
+                    yield result
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _locate_documents(self, identifiers, step):
+        """Yield triples of identifier, a boolean that says whether the file is
+        in the packed store and the location of the file, which is the segment,
+        offset and length for packed files and the path otherwise."""
+        batch = []
+        for identifier in identifiers:
+            batch.append(identifier)
+            if len(batch) == LOOKUP_BATCH_SIZE:
+                for location in self._locate_batch(batch, step):
+                    yield location
+                batch = []
+        for location in self._locate_batch(batch, step):
+            yield location
+
+    def _locate_batch(self, identifiers, step):
+        if not identifiers:
+            return []
+        paths = self.index.source_paths(identifiers)
+        packed = self.index.get_packed_batch(identifiers, step)
+        locations = []
+        for identifier in identifiers:
+            if identifier in packed:
+                locations.append((identifier, True, packed[identifier]))
+            elif identifier in paths:
+                path = self._tree_path(paths[identifier], step)
+                locations.append((identifier, False, path))
+        return locations
+
+    def _fetch_document(self, identifier, packed, location, contents):
+        if packed:
+            data = self.packs.read_location(*location)
+        else:
+            try:
+                with open(location, 'rb') as fh:
+                    data = fh.read()
+            except IOError:
+                return None
+        fh = gzip.GzipFile(fileobj=StringIO.StringIO(data))
+        if contents:
+            return identifier, fh.read()
+        return identifier, fh
+
+    def pack(self, remove=False):
+        """Move the files in the tree of sources and processed files to the
+        packed store, skipping files that are already packed. The files in the
+        tree are removed if remove is True, including files that were packed
+        before, but only after the index has the location of their packed
+        copy."""
+        self.load_packs()
+        lock = self._lock_index()
+        packed = 0
+        to_remove = []
+        try:
+            for identifier, step, path in self.index.stored_files():
+                fname = self.tree_path(identifier, step)
+                if not os.path.exists(fname):
+                    continue
+                if self.index.get_packed(identifier, step) is not None:
+                    if remove:
+                        to_remove.append(fname)
+                    continue
+                with open(fname, 'rb') as fh:
+                    self.packs.add(identifier, step, fh.read())
+                packed += 1
+                if remove:
+                    to_remove.append(fname)
+                if packed % 1000 == 0:
+                    print packed
+                    self._commit_packs(to_remove)
+        finally:
+            self._commit_packs(to_remove)
+            lock.close()
+        print "Packed %d files" % packed
+
+    def _commit_packs(self, to_remove):
+        self.packs.flush()
+        self.index.commit()
+        for fname in to_remove:
+            os.remove(fname)
+        del to_remove[:]
 
     def get(self, identifier, step=None):
-        self.index.get(identifier, step)
+        """Return the information in the index on the document, or on the
+        processing step of the document if step is given, see
+        RepositoryIndex.get(). Returns None if there is no information."""
+        self.load_index()
+        info = self.index.get(identifier)
+        if info is None or step is None:
+            return info
+        return info['processed'].get(step)
 
 
 class PatentRepository(Repository):
 
     def add_corpus(self, corpus_path, language='en', datasource='ln',
-                   limit=sys.maxint):
+                   limit=sys.maxint, workers=1):
+        """Adds the data of one corpus to the repository, see add_corpora()."""
+        self.add_corpora([corpus_path], language, datasource, limit, workers)
+
+    def add_corpora(self, corpus_paths, language='en', datasource='ln',
+                    limit=sys.maxint, workers=1):
 
         """Adds corpus data to the repository, both the source data taken from
         the external source of the corpus and the processed files. Updates the
         list of identifiers, the list of files and the list of processed files
         in the index by appending elements to the end of those files. Only adds
-        patents that are not in the identifier list.
-
-        The input corpus is expected to be one of the corpora created by
-        step1_init.py and step2_process.py.
-
-        Unlike with creating corpora, where we can create and process various
-        corpora on different cores/machines, this method should never be run in
-        parallel, always import one corpus at a time and wait for it to
-        finish."""
-
-        current_identifiers = self.read_identifiers()
-        corpus = CorpusInterface(language, datasource, corpus_path)
+        patents that are not in the identifier list. At most limit files are
+        taken from each corpus.
+
+        The input corpora are expected to be corpora created by step1_init.py
+        and step2_process.py.
+
+        Files are copied and compressed by a pool of worker processes, all the
+        rest is done by this process, which is the only one that writes to the
+        index. This process first collects the patents to be added from all
+        corpora, skipping patents that are in the repository already and
+        patents that were collected from an earlier line or corpus, and then
+        adds the records for each patent to the index as soon as a worker has
+        copied its files. The index is locked while corpora are added, another
+        process that wants to add corpora to the same repository waits until
+        the lock is released. So several corpora can be loaded at the same time
+        by handing them all to this method, but not by running several
+        processes on the same repository."""
+
+        self.load_index()
+        lock = self._lock_index()
+        # read after taking the lock, another process may have added documents
+        self.identifiers = None
+        self.read_identifiers()
         self._open_index_files()
         logfile = os.path.join(self.log_dir, "add-corpus-%s.txt" % timestamp())
         self.log = open(logfile, 'w')
-        log("Adding corpus %s" % corpus_path, self.log, notify=True)
-        c = 0
         t1 = time.time()
+        corpora = []
+        jobs = []
         added = 0
+        failed = 0
         try:
-            for line in open(corpus.file_list):
-                c += 1
-                if c % 100 == 0: print c
-                if c > limit: c -= 1; break
-                added_p = self._add_patent(current_identifiers, corpus, c, line)
-                if added_p:
-                    added += 1
+            claimed = set()
+            for corpus_path in corpus_paths:
+                corpus = CorpusInterface(language, datasource, corpus_path)
+                corpora.append(corpus)
+                log("Adding corpus %s" % corpus_path, self.log, notify=True)
+                jobs.extend(self._collect_patents(corpus, len(corpora) - 1, limit, claimed))
+            log("Copying %d patents with %d workers" % (len(jobs), workers),
+                self.log, notify=True)
+            for i, result in parallel.run_jobs(_copy_patent, jobs, workers=workers):
+                job = jobs[i]
+                if isinstance(result, parallel.JobFailure):
+                    log("%05d WARNING, copying %s failed (%s), skipping it"
+                        % (job.line_number, job.source, result.reason), self.log, notify=True)
+                    if result.message:
+                        log(result.message, self.log)
+                    failed += 1
+                    continue
+                size, steps = result
+                t = timestamp()
+                log("%05d Added %s to %s" % (job.line_number, job.source, job.path), self.log)
+                self._add_patent_source(t, job.id, size, job.path, job.basename)
+                self._add_patent_processed(t, corpora[job.corpus], job.id, steps)
+                added += 1
+                if added % 100 == 0:
+                    print added
+                    self.index.commit()
         except:
             log("An Exception occurred - exiting...", self.log, notify=True)
+            log(traceback.format_exc(), self.log)
         finally:
-            log("Added %d out of %d in %d seconds" % (added, c, time.time() - t1),
-                self.log, notify=True)
+            log("Added %d out of %d in %d seconds, %d failed"
+                % (added, len(jobs), time.time() - t1, failed), self.log, notify=True)
             self._close_log()
             self._close_index_files()
-
+            self.index.commit()
+            self.save_identifiers()
+            lock.close()
 
     def _open_index_files(self):
         for fname in self._index_files():
@@ -339,7 +625,7 @@ class PatentRepository(Repository):
         self.fh_dates = open(self.idx_dates, 'a')
         self.fh_processed = {}
         for step in PROCESSING_STEPS:
-            fname = "%s%sidx-processed-%s.txt" % (self.idx_dir, os.sep, step)
+            fname = self._processed_index_file(step)
             self.fh_processed[step] = open(fname, 'a')
 
     def _close_log(self):
@@ -354,63 +640,60 @@ class PatentRepository(Repository):
             fh.close()
             read_only(fname)
 
-    def _add_patent(self, current_identifiers, corpus, c, line):
-        """Add a document source and the processed files. Do nothing if source
-        cannot be found or if source is already in the list of current
-        identifiers. Return True is data were added, false otherwise."""
+    def _collect_patents(self, corpus, corpus_number, limit, claimed):
+        """Return a list of PatentJobs for the patents in the corpus that should
+        be added. Skips patents whose source cannot be found, patents that are
+        in the repository and patents whose identifier is in the claimed set,
+        which is updated with the identifiers of the returned jobs."""
         # TODO: there is a nasty potential problem here. Suppose we are
         # processing a file in a corpus and that file was in another corpus that
         # we imported before. And suppose that in the erarlier corpus this file
         # was not processed and it was processed in the later corpus. In that
         # case the processed files are not copied. Even if this occurs, it will
         # not impact the integrity of the repository.
-        (external_source, local_source) = get_filelist_paths(line)
-        external_source = validate_filename(external_source)
-        if external_source is None:
-            log("%05d WARNING, source not available for %s" % (c, external_source),
-                self.log, notify=True)
-            return False
-        (id, path, basename) = parse_patent_path(external_source)
-        if id in current_identifiers:
-            log("%05d Skipping %s" % (c, external_source), self.log)
-            return False
-        else:
-            t = timestamp()
-            log("%05d Adding %s to %s" % (c, external_source, os.sep.join(path)),
-                self.log)
-            self._add_patent_source(t, external_source, id, path, basename)
-            self._add_patent_processed(t, corpus, local_source, id, path, basename)
-            return True
-
-    def _add_patent_source(self, t, source, id, path, basename):
-        path = os.sep.join(path)
-        target_dir = os.path.join(self.data_dir, path)
-        target_file = os.path.join(target_dir, basename)
-        copy_and_compress(source, target_dir, target_file)
-        size = get_file_size(target_file)
+        jobs = []
+        c = 0
+        for line in open(corpus.file_list):
+            c += 1
+            if c > limit: break
+            (external_source, local_source) = get_filelist_paths(line)
+            source = validate_filename(external_source)
+            if source is None:
+                log("%05d WARNING, source not available for %s" % (c, external_source),
+                    self.log, notify=True)
+                continue
+            (id, path, basename) = parse_patent_path(source)
+            if id in self.identifiers or id in claimed:
+                log("%05d Skipping %s" % (c, source), self.log)
+                continue
+            claimed.add(id)
+            path = os.sep.join(path)
+            jobs.append(PatentJob(c, corpus_number, id, source, path, basename,
+                                  self.data_dir, self.proc_dir, corpus.location,
+                                  local_source))
+        return jobs
+
+    def _add_patent_source(self, t, id, size, path, basename):
         self.fh_ids.write("%s\n" % id)
+        self.identifiers.add(id)
+        self.index.add_document(t, id)
         self.add_entry_to_file_index(t, id, size, path, basename)
 
-    def _add_patent_processed(self, t, corpus, local_source, id, path, basename):
-        for step in PROCESSING_STEPS:
-            fname = get_path_of_processed_file(corpus, step, local_source)
-            if fname is not None:
-                target_dir = os.path.join(self.proc_dir, step, os.sep.join(path))
-                target_file = os.path.join(target_dir, basename)
-                log("      Adding %s" % target_file, self.log)
-                copy_and_compress(fname, target_dir, target_file)
-                #self.add_entry_to_processed_index(t, id, step, corpus.git_commits)
-                self.add_entry_to_processed_index(t, id, step, corpus)
+    def _add_patent_processed(self, t, corpus, id, steps):
+        for step in steps:
+            self.add_entry_to_processed_index(t, id, step, corpus)
 
     def add_entry_to_file_index(self, t, id, size, path, basename):
         if basename.endswith('.gz'):
             basename = basename[:-3]
         self.fh_files.write("%s\t%s\t%d\t%s%s%s\n" %
                             (t, id, size, path, os.sep, basename))
+        self.index.add_file(t, id, size, "%s%s%s" % (path, os.sep, basename))
 
     def add_entry_to_processed_index(self, t, id, step, corpus):
         commit = corpus.git_commits.get(step)
         options = "\t".join(corpus.options[step])
+        self.index.add_processed(t, id, step, commit, options)
         if options: options = "\t" + options
         self.fh_processed[step].write("%s\t%s\t%s%s\n" % (t, commit, id, options))
 
@@ -449,22 +732,544 @@ class PatentRepository(Repository):
 
 
 
+class PatentJob(object):
+
+    """The files to be copied for one patent, with the line number in the file
+    list and the number of the corpus the patent was taken from. The path is
+    the path of the patent relative to the sources directory and to the
+    directories of the processing steps."""
+
+    def __init__(self, line_number, corpus, id, source, path, basename,
+                 data_dir, proc_dir, corpus_location, local_source):
+        self.line_number = line_number
+        self.corpus = corpus
+        self.id = id
+        self.source = source
+        self.path = path
+        self.basename = basename
+        self.data_dir = data_dir
+        self.proc_dir = proc_dir
+        self.corpus_location = corpus_location
+        self.local_source = local_source
+
+    def __str__(self):
+        return "<PatentJob %s %s>" % (self.id, self.source)
+
+
+def _copy_patent(job):
+    """Copy and compress the source and the processed files of a patent, this
+    is run by the worker processes of add_corpora(). Returns the size of the
+    compressed source and the list of processing steps that had a file. If a
+    file cannot be copied, the files copied so far are removed before the
+    exception is passed on, so that the patent leaves no files behind that
+    are not in the index."""
+    copied = []
+    try:
+        target_dir = os.path.join(job.data_dir, job.path)
+        target_file = os.path.join(target_dir, job.basename)
+        copied.append(target_file)
+        copy_and_compress(job.source, target_dir, target_file)
+        size = get_file_size(target_file)
+        steps = []
+        for step in PROCESSING_STEPS:
+            fname = get_path_of_processed_file(job.corpus_location, step, job.local_source)
+            if fname is not None:
+                target_dir = os.path.join(job.proc_dir, step, job.path)
+                copied.append(os.path.join(target_dir, job.basename))
+                copy_and_compress(fname, target_dir, copied[-1])
+                steps.append(step)
+        return size, steps
+    except:
+        for fname in copied:
+            for name in (fname, fname + '.gz'):
+                if os.path.exists(name):
+                    os.remove(name)
+        raise
+
+
+# a line of idx-ids.txt with an identifier that is kept as a number, see
+# IdentifierSet._number()
+NUMBER_LINE = re.compile(r'(?:0|[1-9]\d{0,17})$')
+
+
+class IdentifierSet(object):
+
+    """A compact set of document identifiers for membership checks. Identifiers
+    that are numbers are kept in a sorted array of 64-bit integers and other
+    identifiers in a sorted list, both are searched by bisection. Identifiers
+    added to the set are kept in a small set until there are MERGE_SIZE of them,
+    at which point they are merged into the array and the list.
+
+    The set can be saved to a cache file together with the size of idx-ids.txt
+    at that point. When loading, the cache is read and the identifiers that were
+    added to idx-ids.txt later are read from that file, so the cache never needs
+    to be in sync with idx-ids.txt. The cache has a header line, the array in
+    machine format and the other identifiers, one per line."""
+
+    MERGE_SIZE = 100000
+    HEADER = "IDS\t%d\t%d\t%d\n"
+
+    def __init__(self):
+        self.numbers = array.array('l')
+        self.strings = []
+        self.added = set()
+
+    def __str__(self):
+        return "<IdentifierSet with %d identifiers>" % len(self)
+
+    def __len__(self):
+        return len(self.numbers) + len(self.strings) + len(self.added)
+
+    def __contains__(self, identifier):
+        if identifier in self.added:
+            return True
+        number = self._number(identifier)
+        if number is None:
+            return _in_sorted(self.strings, identifier)
+        return _in_sorted(self.numbers, number)
+
+    def __iter__(self):
+        for number in self.numbers:
+            yield str(number)
+        for identifier in self.strings:
+            yield identifier
+        for identifier in self.added:
+            yield identifier
+
+    @staticmethod
+    def _number(identifier):
+        """Return the identifier as an integer if it is a number that is written
+        the same way by str(), or None."""
+        if identifier.isdigit() and len(identifier) < 19 \
+           and (identifier[0] != '0' or identifier == '0'):
+            return int(identifier)
+        return None
+
+    def add(self, identifier):
+        if identifier not in self:
+            self.added.add(identifier)
+            if len(self.added) >= self.MERGE_SIZE:
+                self.merge()
+
+    def merge(self):
+        """Merge the identifiers added since the last merge into the array and
+        the sorted list."""
+        self._merge([], [])
+
+    def _merge(self, numbers, identifiers):
+        """Merge the numbers, the identifiers and the identifiers added since
+        the last merge into the array and the sorted list. The new numbers and
+        strings are sorted and then merged with the existing ones in one linear
+        pass, duplicates are dropped."""
+        numbers, strings = list(numbers), []
+        for identifiers in (identifiers, self.added):
+            for identifier in identifiers:
+                number = self._number(identifier)
+                if number is None:
+                    strings.append(identifier)
+                else:
+                    numbers.append(number)
+        if numbers:
+            numbers.sort()
+            if self.numbers:
+                numbers = heapq.merge(self.numbers, numbers)
+            self.numbers = array.array('l', _unique(numbers))
+        if strings:
+            strings.sort()
+            if self.strings:
+                strings = heapq.merge(self.strings, strings)
+            self.strings = list(_unique(strings))
+        self.added = set()
+
+    def add_from_file(self, filename, offset=0):
+        """Add the identifiers in filename, one per line, starting at offset.
+        They are merged into the set all at once. Lines with a number are picked
+        out and converted with a regular expression and map(), which avoids a
+        loop in Python over the typically millions of lines in idx-ids.txt, and
+        the numbers are collected in an array to keep memory use down."""
+        numbers, identifiers = array.array('l'), []
+        fh = open(filename)
+        fh.seek(offset)
+        while True:
+            lines = fh.readlines(1 << 20)
+            if not lines:
+                break
+            number_lines = filter(NUMBER_LINE.match, lines)
+            numbers.extend(map(int, number_lines))
+            if len(number_lines) < len(lines):
+                identifiers.extend([line.strip() for line in lines
+                                    if not NUMBER_LINE.match(line) and line.strip()])
+        fh.close()
+        self._merge(numbers, identifiers)
+
+    def save(self, filename, offset):
+        """Save the set to filename, offset is the number of bytes of
+        idx-ids.txt that are in the set."""
+        self.merge()
+        fh = open(filename + '.tmp', 'wb')
+        fh.write(self.HEADER % (offset, len(self.numbers), len(self.strings)))
+        self.numbers.tofile(fh)
+        for identifier in self.strings:
+            fh.write("%s\n" % identifier)
+        fh.close()
+        os.rename(filename + '.tmp', filename)
+
+    @classmethod
+    def load(cls, filename, idx_ids):
+        """Return the set saved in filename updated with the identifiers added
+        to idx_ids after it was saved. If there is no cache, or if it covers
+        more than there is in idx_ids, the set is read from idx_ids."""
+        identifiers = cls()
+        offset = 0
+        if os.path.exists(filename):
+            fh = open(filename, 'rb')
+            (_, offset, numbers, strings) = fh.readline().split("\t")
+            offset = int(offset)
+            if offset <= os.path.getsize(idx_ids):
+                identifiers.numbers.fromfile(fh, int(numbers))
+                identifiers.strings = [fh.readline().rstrip("\n")
+                                       for i in range(int(strings))]
+            else:
+                offset = 0
+            fh.close()
+        identifiers.add_from_file(idx_ids, offset)
+        return identifiers
+
+
+def _in_sorted(sequence, element):
+    i = bisect.bisect_left(sequence, element)
+    return i < len(sequence) and sequence[i] == element
+
+
+def _unique(elements):
+    """Yield the elements of a sorted sequence without duplicates."""
+    previous = None
+    for element in elements:
+        if element != previous:
+            yield element
+            previous = element
+
+
+class PackStore(object):
+
+    """The packed store of a repository, which keeps compressed files in large
+    segment files instead of in a tree with one file for each document and
+    processing step. Segment files are only appended to, a new segment is
+    started when the last one is larger than PACK_SEGMENT_SIZE. Each file in
+    a segment is preceded by a header line with the identifier, the step
+    (which is 'source' for sources) and the length of the file, the index has
+    the segment, offset and length of each file. This means that the index can
+    be rebuilt from the segments."""
+
+    def __init__(self, repository):
+        self.dir = repository.pack_dir
+        self.index = repository.index
+        self.readers = {}
+        self.writer = None
+        self.writer_segment = None
+        self.lock = threading.Lock()
+
+    def __str__(self):
+        return "<PackStore '%s'>" % self.dir
+
+    def segments(self):
+        """Return the sorted list of segment numbers."""
+        if not os.path.isdir(self.dir):
+            return []
+        return sorted([int(f[8:-5]) for f in os.listdir(self.dir)
+                       if f.startswith('segment-') and f.endswith('.pack')])
+
+    def _segment_file(self, segment):
+        return os.path.join(self.dir, "segment-%05d.pack" % segment)
+
+    def add(self, identifier, step, data):
+        """Append the compressed data of a file to the last segment and add its
+        location to the index, the index is not committed."""
+        if self.writer is None or self.writer.tell() >= PACK_SEGMENT_SIZE:
+            self._open_writer()
+        self.writer.write(PACK_HEADER % (identifier, step, len(data)))
+        offset = self.writer.tell()
+        self.writer.write(data)
+        self.index.add_packed(identifier, step, self.writer_segment, offset, len(data))
+
+    def _open_writer(self):
+        if self.writer is not None:
+            self.writer.close()
+        ensure_path(self.dir)
+        segments = self.segments()
+        segment = segments[-1] if segments else 0
+        if os.path.exists(self._segment_file(segment)) \
+           and os.path.getsize(self._segment_file(segment)) >= PACK_SEGMENT_SIZE:
+            segment += 1
+        self.writer = open(self._segment_file(segment), 'ab')
+        self.writer.seek(0, os.SEEK_END)
+        self.writer_segment = segment
+
+    def flush(self):
+        if self.writer is not None:
+            self.writer.flush()
+
+    def read(self, identifier, step='source'):
+        """Return the compressed data of the file, or None if it is not in the
+        packed store."""
+        location = self.index.get_packed(identifier, step)
+        if location is None:
+            return None
+        return self.read_location(*location)
+
+    def read_location(self, segment, offset, length):
+        """Return the data at offset in the segment, this can be used from
+        several threads."""
+        with self.lock:
+            if segment == self.writer_segment:
+                self.flush()
+            reader = self.readers.get(segment)
+            if reader is None:
+                reader = self.readers[segment] = open(self._segment_file(segment), 'rb')
+            reader.seek(offset)
+            return reader.read(length)
+
+    def open(self, identifier, step='source'):
+        """Return a file object with the uncompressed contents of the file, or
+        None if it is not in the packed store."""
+        data = self.read(identifier, step)
+        if data is None:
+            return None
+        return gzip.GzipFile(fileobj=StringIO.StringIO(data))
+
+    def rebuild_index(self):
+        """Replace the locations in the index with the ones from the headers in
+        the segment files."""
+        self.index.clear_packed()
+        for segment in self.segments():
+            with open(self._segment_file(segment), 'rb') as fh:
+                while True:
+                    header = fh.readline()
+                    if not header:
+                        break
+                    (_, identifier, step, length) = header.rstrip("\n").split("\t")
+                    length = int(length)
+                    self.index.add_packed(identifier, step, segment, fh.tell(), length)
+                    fh.seek(length, os.SEEK_CUR)
+        self.index.commit()
+
+    def close(self):
+        for fh in self.readers.values() + [self.writer]:
+            if fh is not None:
+                fh.close()
+        self.readers = {}
+        self.writer = None
+        self.writer_segment = None
+
+
 class RepositoryIndex(object):
 
-    """An object like this will probably be needed at some point."""
+    """The SQLite database with the index of a repository. It has the same
+    information as the index files, in three tables:
+
+        documents   id, timestamp
+        files       id, timestamp, size, path
+        processed   id, step, timestamp, git_commit, options
+
+    The documents table has the identifiers from idx-ids.txt, with the time
+    they were added, the other two tables have the records from idx-files.txt
+    and idx-processed-X.txt, with the options separated by tabs. All tables are
+    indexed on the identifier, the files and processed tables are also indexed
+    on the timestamp and the processed table on the step. A fourth table has the
+    locations of the files in the packed store, see PackStore:
+
+        packed      id, step, segment, offset, length
+
+    Use the in operator to check whether an identifier is in the repository.
+    Changes are not written to disk until commit() is called."""
+
+    SCHEMA = (
+        "CREATE TABLE documents (id TEXT PRIMARY KEY, timestamp TEXT)",
+        "CREATE TABLE files (id TEXT, timestamp TEXT, size INTEGER, path TEXT)",
+        "CREATE TABLE processed (id TEXT, step TEXT, timestamp TEXT, "
+        "git_commit TEXT, options TEXT)",
+        "CREATE INDEX documents_timestamp ON documents (timestamp)",
+        "CREATE INDEX files_id ON files (id)",
+        "CREATE INDEX files_timestamp ON files (timestamp)",
+        "CREATE INDEX processed_id ON processed (id, step)",
+        "CREATE INDEX processed_step ON processed (step, timestamp)")
+
+    # this table is not filled from the index files, so it is not dropped when
+    # the other tables are rebuilt
+    PACKED_SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS packed (id TEXT, step TEXT, segment INTEGER, "
+        "offset INTEGER, length INTEGER, PRIMARY KEY (id, step))",)
 
     def __init__(self, repository):
         self.repository = repository
-        self.index = {}
-        c = 0
-        for line in open(self.repository.idx_files):
-            c += 1
-            if c > 10: break
-            (timestamp, id, size, path) = line.split()
+        self.filename = repository.idx_db
+        exists = os.path.exists(self.filename)
+        self.connection = sqlite3.connect(self.filename)
+        self.connection.text_factory = str
+        for statement in self.PACKED_SCHEMA:
+            self.connection.execute(statement)
+        if not exists:
+            self.import_index_files()
+
+    def __str__(self):
+        return "<RepositoryIndex '%s'>" % self.filename
+
+    def __contains__(self, identifier):
+        cursor = self.connection.execute(
+            "SELECT 1 FROM documents WHERE id = ?", (identifier,))
+        return cursor.fetchone() is not None
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def add_document(self, timestamp, identifier):
+        self.connection.execute("INSERT OR IGNORE INTO documents VALUES (?, ?)",
+                                (identifier, timestamp))
+
+    def add_file(self, timestamp, identifier, size, path):
+        self.connection.execute("INSERT INTO files VALUES (?, ?, ?, ?)",
+                                (identifier, timestamp, size, path))
+
+    def add_processed(self, timestamp, identifier, step, git_commit, options):
+        self.connection.execute("INSERT INTO processed VALUES (?, ?, ?, ?, ?)",
+                                (identifier, step, timestamp, git_commit, options))
 
     def get(self, identifier):
-        """Return all information associated with an identifier."""
-        pass
+        """Return all information associated with an identifier in a dictionary
+        with the timestamp, a list of (timestamp, size, path) triples for the
+        files and a dictionary with a (timestamp, git_commit, options) triple
+        for each processing step, where options is a list. Returns None if the
+        identifier is not in the repository."""
+        row = self.connection.execute(
+            "SELECT timestamp FROM documents WHERE id = ?", (identifier,)).fetchone()
+        if row is None:
+            return None
+        files = self.connection.execute(
+            "SELECT timestamp, size, path FROM files WHERE id = ? ORDER BY rowid",
+            (identifier,)).fetchall()
+        processed = {}
+        for step, timestamp, git_commit, options in self.connection.execute(
+                "SELECT step, timestamp, git_commit, options FROM processed "
+                "WHERE id = ? ORDER BY rowid", (identifier,)):
+            processed[step] = (timestamp, git_commit, options.split("\t") if options else [])
+        return {'id': identifier, 'timestamp': row[0], 'files': files,
+                'processed': processed}
+
+    def source_path(self, identifier):
+        """Return the path of the source of the document relative to the
+        sources directory, without the .gz extension, or None if there is no
+        source."""
+        row = self.connection.execute(
+            "SELECT path FROM files WHERE id = ? ORDER BY rowid DESC LIMIT 1",
+            (identifier,)).fetchone()
+        return None if row is None else row[0]
+
+    def source_paths(self, identifiers):
+        """Return a dictionary with the source path of each identifier that has
+        a source, see source_path()."""
+        return dict(self._select_batch(
+            "SELECT id, path FROM files WHERE id IN (%s) ORDER BY rowid", identifiers))
+
+    def _select_batch(self, query, identifiers, *args):
+        placeholders = ', '.join(['?'] * len(identifiers))
+        return self.connection.execute(query % placeholders, tuple(identifiers) + args)
+
+    def stored_files(self):
+        """Yield an (id, step, path) triple for each source and processed file,
+        where step is 'source' for sources and path is the path of the source,
+        ordered on the path."""
+        return self.connection.execute(
+            "SELECT id, 'source', path FROM files "
+            "UNION SELECT processed.id, processed.step, files.path "
+            "FROM processed JOIN files ON processed.id = files.id "
+            "ORDER BY 3, 2")
+
+    def add_packed(self, identifier, step, segment, offset, length):
+        self.connection.execute("INSERT OR REPLACE INTO packed VALUES (?, ?, ?, ?, ?)",
+                                (identifier, step, segment, offset, length))
+
+    def get_packed(self, identifier, step):
+        """Return the segment, offset and length of the file in the packed
+        store, or None if the file is not packed."""
+        return self.connection.execute(
+            "SELECT segment, offset, length FROM packed WHERE id = ? AND step = ?",
+            (identifier, step)).fetchone()
+
+    def get_packed_batch(self, identifiers, step):
+        """Return a dictionary with the location in the packed store of each
+        identifier that has a packed file for step, see get_packed()."""
+        rows = self._select_batch(
+            "SELECT id, segment, offset, length FROM packed WHERE id IN (%s) AND step = ?",
+            identifiers, step)
+        return dict((row[0], row[1:]) for row in rows)
+
+    def clear_packed(self):
+        self.connection.execute("DELETE FROM packed")
+
+    def packed_counts(self):
+        """Return a list of triples of step, number of packed files and their
+        total size."""
+        return self.connection.execute(
+            "SELECT step, COUNT(*), SUM(length) FROM packed GROUP BY step "
+            "ORDER BY step").fetchall()
+
+    def file_statistics(self):
+        """Return the number of source files and their total size."""
+        files, size = self.connection.execute(
+            "SELECT COUNT(*), SUM(size) FROM files").fetchone()
+        return files, size or 0
+
+    def processed_counts(self):
+        """Return a list of pairs of processing step and number of files."""
+        return self.connection.execute(
+            "SELECT step, COUNT(*) FROM processed GROUP BY step ORDER BY step").fetchall()
+
+    def import_index_files(self):
+        """Drop all tables and fill them with the records from the index
+        files. The timestamp of a document is the timestamp of its first
+        file."""
+        print "[RepositoryIndex] importing index files into %s" % self.filename
+        for table in ('documents', 'files', 'processed'):
+            self.connection.execute("DROP TABLE IF EXISTS %s" % table)
+        for statement in self.SCHEMA:
+            self.connection.execute(statement)
+        self.connection.executemany(
+            "INSERT INTO files VALUES (?, ?, ?, ?)", self._read_file_index())
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO documents SELECT ?, "
+            "(SELECT MIN(timestamp) FROM files WHERE id = ?)",
+            ((id, id) for id in self._read_identifier_index()))
+        for step in PROCESSING_STEPS:
+            self.connection.executemany(
+                "INSERT INTO processed VALUES (?, ?, ?, ?, ?)",
+                self._read_processed_index(step))
+        self.connection.commit()
+
+    def _read_identifier_index(self):
+        for line in open(self.repository.idx_ids):
+            if line.strip():
+                yield line.strip()
+
+    def _read_file_index(self):
+        for line in open(self.repository.idx_files):
+            (timestamp, id, size, path) = line.rstrip("\n").split("\t")
+            yield id, timestamp, int(size), path
+
+    def _read_processed_index(self, step):
+        fname = self.repository._processed_index_file(step)
+        if not os.path.exists(fname):
+            return
+        for line in open(fname):
+            fields = line.rstrip("\n").split("\t")
+            (timestamp, git_commit, id) = fields[:3]
+            yield id, step, timestamp, git_commit, "\t".join(fields[3:])
 
 
 
@@ -526,10 +1331,10 @@ def get_filelist_paths(line):
     local_source = fields[2] if len(fields)> 2 else source
     return (source, local_source)
 
-def get_path_of_processed_file(corpus, step, local_source):
-    """Build a full file path given a corpus, a processing step and a local
-    source file"""
-    fname = os.path.join(corpus.location,
+def get_path_of_processed_file(corpus_location, step, local_source):
+    """Build a full file path given the location of a corpus, a processing step
+    and a local source file"""
+    fname = os.path.join(corpus_location,
                          'data', step, '01', 'files', local_source)
     return validate_filename(fname)
 
@@ -726,23 +1531,31 @@ def test_compare_lists(list1, list2):
 
 if __name__ == '__main__':
 
-    options = ['initialize', 'add-corpus', 'analyze', 'repository=', 'type=', 'corpus=']
+    options = ['initialize', 'add-corpus', 'analyze', 'build-index', 'pack',
+               'remove-packed-files', 'repository=', 'type=', 'corpus=', 'workers=']
     (opts, args) = getopt.getopt(sys.argv[1:], 'r:t:c:', options)
 
     init_p = False
     add_corpus_p = False
     analyze_p = False
+    build_index_p = False
+    pack_p, remove_packed_p = False, False
     repository = None
     repotype = 'patents'
-    corpus = None
+    corpora = []
+    workers = 1
 
     for opt, val in opts:
         if opt == '--initialize': init_p = True
         if opt == '--add-corpus': add_corpus_p = True
         if opt == '--analyze': analyze_p = True
+        if opt == '--build-index': build_index_p = True
+        if opt == '--pack': pack_p = True
+        if opt == '--remove-packed-files': remove_packed_p = True
         if opt in ('-r', '--repository'): repository = val
         if opt in ('-t', '--type'): repotype = val
-        if opt in ('-c', '--corpus'): corpus = val
+        if opt in ('-c', '--corpus'): corpora.append(val)
+        if opt == '--workers': workers = int(val)
 
     if repository is None:
         exit("WARNING: missing repository argument")
@@ -751,9 +1564,15 @@ if __name__ == '__main__':
         print "Initializing repository '%s'" % repository
         create_repository(repository, repotype)
     elif add_corpus_p:
-        if corpus is None:
+        if not corpora:
             exit("WARNING: missing corpus argument")
-        open_repository(repository).add_corpus(corpus)
+        open_repository(repository).add_corpora(corpora, workers=workers)
     elif analyze_p:
         print "Analyzing repository '%s'" % repository
         open_repository(repository).analyze()
+    elif build_index_p:
+        print "Building index of repository '%s'" % repository
+        open_repository(repository).build_index()
+    elif pack_p:
+        print "Packing repository '%s'" % repository
+        open_repository(repository).pack(remove=remove_packed_p)
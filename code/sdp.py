@@ -6,7 +6,7 @@ Wrappers for the Stanford tagger and segmenter.
 
 """
 
-import sys, os
+import sys, os, re, math, atexit, shutil, tempfile, subprocess, threading, Queue, collections
 from subprocess import Popen, PIPE
 import config
 
@@ -27,85 +27,254 @@ class Tagger:
     We use the following:
         English: english-caseless-left3words-distsim.tagger
         Chinese: chinese.tagger
+
+    The tagger runs as a subprocess. Each text handed to the tagger is followed
+    by a terminator line with a request identifier, and a background thread
+    reads the output of the tagger and collects the tagged lines for each
+    request. This allows several requests to be in flight (see tag_many()),
+    and it means that a tagger that dies, hangs or loses a terminator is
+    noticed. In those cases the tagger is restarted and all unanswered texts
+    are sent again. A text that needs more than max_restarts restarts is
+    given up on.
     """
 
-    def __init__(self, model):
+    def __init__(self, model, timeout=300, max_restarts=3, window=16):
         self.stag_dir = config.STANFORD_TAGGER_DIR
         self.mx = config.STANFORD_MX
         self.tag_separator = config.STANFORD_TAG_SEPARATOR
         self.model = model
         self.verbose = False
-        # Make the models directory explicit to fix a broken pipe error that
-        # results when the entire models path is not specified. We are not using
-        # "-outputFormatOptions lemmatize" because it does not work.
-        tagger_jar = self.stag_dir + "/stanford-postagger.jar:"
-        maxent_tagger = 'edu.stanford.nlp.tagger.maxent.MaxentTagger'
-        model = "%s/models/%s" % (self.stag_dir, self.model)
-        tag_separator_option = ""
-        if self.tag_separator != "":
-            tag_separator_option = " -tagSeparator " + self.tag_separator
-        tagcmd = "java -mx%s -cp '%s' %s -model %s%s 2> tagger.log" % \
-                 (self.mx, tagger_jar, maxent_tagger, model, tag_separator_option)
+        # seconds to wait for the answer to a request, the number of restarts
+        # allowed for one text, and the maximum number of requests in flight
+        self.timeout = timeout
+        self.max_restarts = max_restarts
+        self.window = window
+        self.restarts = 0
+        self.next_request_id = 0
+        self.tagcmd = tagger_command(self.model)
         if self.verbose:
-            print "[stagWrapper init] \n$ %s" % tagcmd
-        # create a subprocess that reads from stdin and writes to stdout
-        self.proc = Popen(tagcmd, shell=True, stdin=PIPE, stdout=PIPE, universal_newlines=False)
+            print "[stagWrapper init] \n$ %s" % self.tagcmd
+        self.proc = None
+        self.responses = None
+        self.start()
+
+    def start(self):
+        """Create a subprocess that reads from stdin and writes to stdout and a
+        thread that reads the responses of the subprocess."""
+        self.proc = Popen(self.tagcmd, shell=True, stdin=PIPE, stdout=PIPE, universal_newlines=False)
+        self.responses = Queue.Queue()
+        reader = threading.Thread(target=read_responses, args=(self.proc.stdout, self.responses))
+        reader.daemon = True
+        reader.start()
+
+    def stop(self):
+        try:
+            self.proc.kill()
+        except OSError:
+            pass
+        self.proc.wait()
+
+    def restart(self):
+        print "[Tagger] WARNING: restarting the tagger"
+        self.stop()
+        self.start()
+        self.restarts += 1
 
     def tag(self, text):
         """returns a list of tagged sentence strings"""
         if self.verbose:
             print "[tag] text: %s" % text
-        self.give_input_and_end(text)
+        result = self.tag_many([text])[0]
+        if result is None:
+            raise TaggerError("tagger failed on text: %s" % text[:100])
         if self.verbose:
-            print "[tag] after give_input_and_end"
-        result = self.get_output_to_end()
-        if self.verbose:
-            print "[tag] after setting result to: %s" % result
+            print "[tag] result: %s" % result
         return result
 
-    def give_input_and_end(self, text):
-        """Passes a string to the sdp tagger subprocess. Adds a special termination
-        string to use as a signal that tag output is finished."""
-        terminated_line = text + u'\n~_\n'
-        if self.verbose:
-            print "[give_input_and_end] terminated_line: |%s|" % terminated_line
-        self.proc.stdin.write(terminated_line.encode('utf-8'))
+    def tag_many(self, texts):
+        """Tag all texts and return a list with a list of tagged sentence strings
+        for each text, or None for texts that could not be tagged. Up to window
+        texts are handed to the tagger before waiting for the results."""
+        results = [None] * len(texts)
+        attempts = [0] * len(texts)
+        # indexes of texts not yet sent, and pairs of index and request
+        # identifier for texts that were sent but not answered yet
+        pending = collections.deque(range(len(texts)))
+        in_flight = collections.deque()
+        while pending or in_flight:
+            response = None
+            try:
+                while pending and len(in_flight) < self.window:
+                    in_flight.append((pending[0], self.send(texts[pending[0]])))
+                    pending.popleft()
+            except IOError:
+                # the tagger is not reading its input anymore, but the answers
+                # it gave before that should still be collected
+                pass
+            if in_flight:
+                index, request_id = in_flight[0]
+                response = self.receive(request_id)
+            if response is not None:
+                results[index] = response
+                in_flight.popleft()
+                continue
+            # the tagger died, timed out or lost a terminator, restart it and
+            # send all unanswered texts again, except for the oldest one if it
+            # was tried too often
+            unanswered = [i for i, _ in in_flight] + list(pending)
+            attempts[unanswered[0]] += 1
+            if attempts[unanswered[0]] > self.max_restarts:
+                print "[Tagger] WARNING: giving up on text %d" % unanswered[0]
+                unanswered = unanswered[1:]
+            self.restart()
+            pending = collections.deque(unanswered)
+            in_flight = collections.deque()
+        return results
+
+    def send(self, text):
+        """Hand a text and a terminator line with a new request identifier to
+        the tagger, returns the identifier."""
+        request_id = self.next_request_id
+        self.next_request_id += 1
+        terminated_text = u"%s\n~_ %d\n" % (text, request_id)
+        self.proc.stdin.write(terminated_text.encode('utf-8'))
         self.proc.stdin.flush()
+        return request_id
 
-    def get_output_to_end(self):
-        """Reads lines from the output of the subprocess (sdp parser) and returns them
-        as a list of unicode strings. We use a line "~-" to signal the end of
-        the output from the tagger. """
-        result = []
-        line = self.proc.stdout.readline()
-        # Not sure why this is needed if this is called from pubmed.sh rather than 
-        # fxml.test_pm() within python.  PGA
-        if line is None:
-            return result
-        # now turn the stdout line, which is of type str, into a unicode string
-        line = line.decode(sys.stdout.encoding)
-        if self.verbose:
-            print "[get_output_to_end] %s line is: |%s|" % (type(line).__name__, line)
+    def receive(self, request_id):
+        """Return the tagged lines for the request, or None if the tagger did not
+        answer in time, has died, or skipped the terminator of the request."""
         while True:
-            # remove tabs from sdp output (e.g. for Phrase structure)
-            line = line.strip("\n")
-            line = line.lstrip()
-            # The tagger will add a tag to the terminating line, so we match on
-            # the first two characters only.
-            if line[0:2] == "~_": 
-                if self.verbose:
-                    print "[get_output_to_end] found_terminator string, breaking from while loop"
-                break
-            if self.verbose:
-                print "[get_output_to_end] in while loop"
-                print "[get_output_to_end] appending line |%s|" % line
-            if line != "":
-                result.append(line)
-            line = self.proc.stdout.readline().decode(sys.stdout.encoding)
-            if self.verbose:
-                print "[get_output_to_end] next %s line: |%s|" % (type(line).__name__, line)
+            try:
+                response_id, lines = self.responses.get(timeout=self.timeout)
+            except Queue.Empty:
+                return None
+            if response_id is None or response_id > request_id:
+                return None
+            if response_id == request_id:
+                return lines
+
+
+def tagger_command(model):
+    """Return the shell command that runs the Stanford tagger with a model, the
+    tagger reads from stdin and writes to stdout."""
+    # Make the models directory explicit to fix a broken pipe error that
+    # results when the entire models path is not specified. We are not using
+    # "-outputFormatOptions lemmatize" because it does not work.
+    tagger_jar = config.STANFORD_TAGGER_DIR + "/stanford-postagger.jar:"
+    maxent_tagger = 'edu.stanford.nlp.tagger.maxent.MaxentTagger'
+    model = "%s/models/%s" % (config.STANFORD_TAGGER_DIR, model)
+    tag_separator_option = ""
+    if config.STANFORD_TAG_SEPARATOR != "":
+        tag_separator_option = " -tagSeparator " + config.STANFORD_TAG_SEPARATOR
+    # exec makes sure that killing the subprocess kills the JVM, not the shell
+    return "exec java -mx%s -cp '%s' %s -model %s%s 2> tagger.log" % \
+           (config.STANFORD_MX, tagger_jar, maxent_tagger, model, tag_separator_option)
+
+
+class BatchTagger:
+
+    """Runs the Stanford tagger once on all texts. The texts are written to an
+    input file, each followed by a terminator line as with Tagger.send(), and
+    the tagger reads that file as its standard input and writes its output to
+    another file, which is split up at the terminators. Reading from standard
+    input, the tagger handles each line on its own and splits the sentences
+    within a line, so the output is the same as with Tagger. The file mode of
+    the tagger cannot be used for this, it either runs lines together or takes
+    each line to be one sentence. With more than one thread the texts are
+    divided over that many tagger processes that run at the same time, each
+    with its own copy of the model. This does not give the tagger a chance to
+    recover from errors, but it avoids the overhead of talking to the tagger
+    one text at a time and it is the fastest way to tag many texts. Temporary
+    files are created in workspace, or in the default temporary directory if
+    workspace is None."""
+
+    def __init__(self, model, threads=1, workspace=None):
+        self.model = model
+        self.threads = threads
+        self.workspace = workspace
+        self.verbose = False
+
+    def tag(self, text):
+        """returns a list of tagged sentence strings"""
+        result = self.tag_many([text])[0]
+        if result is None:
+            raise TaggerError("tagger failed on text: %s" % text[:100])
         return result
 
+    def tag_many(self, texts):
+        """Tag all texts and return a list with a list of tagged sentence strings
+        for each text, or None for texts whose terminator did not come back.
+        Raises a TaggerError if the tagger fails."""
+        directory = tempfile.mkdtemp(prefix='tagger-', dir=self.workspace)
+        try:
+            processes = []
+            size = int(math.ceil(len(texts) / float(max(1, self.threads)))) or 1
+            for start in range(0, len(texts), size):
+                processes.append(self._start(texts, start, start + size, directory))
+            failed = [output_file for process, output_file in processes
+                      if process.wait() != 0 or not os.path.exists(output_file)]
+            if failed:
+                raise TaggerError("tagger failed on batch of %d texts, see tagger.log" % len(texts))
+            results = [None] * len(texts)
+            for process, output_file in processes:
+                responses = Queue.Queue()
+                with open(output_file) as fh:
+                    read_responses(fh, responses)
+                while True:
+                    request_id, lines = responses.get()
+                    if request_id is None:
+                        break
+                    if request_id < len(texts):
+                        results[request_id] = lines
+            return results
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def _start(self, texts, start, end, directory):
+        """Start a tagger on texts[start:end], the request identifier of a text
+        is its index in texts. Returns the process and its output file."""
+        input_file = os.path.join(directory, "input-%d.txt" % start)
+        output_file = os.path.join(directory, "output-%d.txt" % start)
+        with open(input_file, 'w') as fh:
+            for request_id in range(start, min(end, len(texts))):
+                fh.write((u"%s\n~_ %d\n" % (texts[request_id], request_id)).encode('utf-8'))
+        command = "%s < %s > %s" % (tagger_command(self.model), input_file, output_file)
+        if self.verbose:
+            print "[BatchTagger] $ %s" % command
+        return Popen(command, shell=True), output_file
+
+
+class TaggerError(Exception):
+    pass
+
+
+# The tagger reads the terminating line "~_ 12" as a line of its own, so it
+# comes back as a line of its own with a tag added to each token, something
+# like "~__SYM 12_CD". We match on the "~_" at the start of the line, as that
+# does not depend on the tag separator or on how "~_" is tokenized, and take the
+# request identifier from the last token. Only a text line that starts with a
+# tilde can look like this, txt2tag._fix_line() removes all tildes.
+TERMINATOR = re.compile(r'^~_.*\s(\d+)[^\s\d]*$')
+
+
+def read_responses(stdout, responses):
+    """Read lines from the output of the tagger and put a pair of the request
+    identifier and the list of lines before the terminator on the responses
+    queue for each terminator. Puts (None, None) on the queue when the output
+    is closed, which happens when the tagger dies."""
+    lines = []
+    for line in iter(stdout.readline, ''):
+        # remove tabs from sdp output (e.g. for Phrase structure)
+        line = line.decode('utf-8').strip("\n").lstrip()
+        match = TERMINATOR.match(line)
+        if match is not None:
+            responses.put((int(match.group(1)), lines))
+            lines = []
+        elif line != "":
+            lines.append(line)
+    responses.put((None, None))
+
 
 class Segmenter:
 
@@ -115,9 +284,17 @@ class Segmenter:
     data files, you may want to change memory allocation in Java e.g., to be
     able to use 8Gb of memory, you need to change the self.mx variable "8g".
     The default in the configuration file is "2000m."
+
+    Sentences are handed to the segmenter in frames, see seg_many(). A frame
+    has one sentence per line and ends with a marker line with the identifier
+    of the frame and two empty lines, the latter make the segmenter flush its
+    output. A background thread reads the output of the segmenter and collects
+    the lines before each marker, so all output lines are accounted for, also
+    the ones that only have ascii characters. Frames that come in while the
+    client waits for another frame are kept until they are asked for.
     """
 
-    def __init__(self):
+    def __init__(self, timeout=300):
         try:
             self.seg_dir = config.STANFORD_SEGMENTER_DIR
         except AttributeError:
@@ -128,10 +305,22 @@ class Segmenter:
             self.mx = "300m"
         self.data_dir = self.seg_dir + "/data"
         self.verbose = False
+        self.timeout = timeout
+        self.next_frame_id = 0
+        # frames received before they were asked for, and the first frame sent
+        # to the current segmenter process, earlier frames were lost if the
+        # segmenter was restarted
+        self.early_frames = {}
+        self.first_frame_id = 0
         self.segcmd = self.segmenter_command()
         if self.verbose:
             print "[segWrapper init]segcmd: %s" % self.segcmd
-        self.proc = Popen(self.segcmd, shell=True, stdin=PIPE, stdout=PIPE, universal_newlines=False)
+        self.proc = None
+        self.responses = None
+        self.reader = None
+        self.start()
+        # the reader thread should not be left running at interpreter shutdown
+        atexit.register(self.stop)
 
     def segmenter_command(self):
         # make the models directory explicit
@@ -140,7 +329,8 @@ class Segmenter:
         # One issue is to read from stdin rather than from a file.  We use the linux solution described in
         # https://mailman.stanford.edu/pipermail/java-nlp-user/2012-July/002371.html
         # to set file to /dev/stdin
-        return ('java -mx' + self.mx
+        # exec makes sure that killing the subprocess kills the JVM, not the shell
+        return ('exec java -mx' + self.mx
                 + ' -cp ' + self.seg_dir + '/seg.jar edu.stanford.nlp.ie.crf.CRFClassifier'
                 + ' -sighanCorporaDict ' + self.data_dir
                 + ' -testFile /dev/stdin -inputEncoding UTF-8'
@@ -149,62 +339,148 @@ class Segmenter:
                 + ' -loadClassifier ' + self.data_dir + '/ctb.gz'
                 + ' -serDictionary ' + self.data_dir + '/dict-chris6.ser.gz 2> segmenter.log')
 
+    def start(self):
+        self.proc = Popen(self.segcmd, shell=True, stdin=PIPE, stdout=PIPE, universal_newlines=False)
+        self.responses = Queue.Queue()
+        self.early_frames = {}
+        self.first_frame_id = self.next_frame_id
+        self.reader = threading.Thread(target=read_frames, args=(self.proc.stdout, self.responses))
+        self.reader.daemon = True
+        self.reader.start()
+
+    def stop(self):
+        try:
+            self.proc.kill()
+        except OSError:
+            pass
+        self.proc.wait()
+        self.reader.join(1)
+
+    def restart(self):
+        print "[Segmenter] WARNING: restarting the segmenter"
+        self.stop()
+        self.start()
+
     def seg(self, text):
-        self.give_input_and_end(text)
-        result = self.get_output_to_end()
-        return result
-    
-    def get_output_to_end(self):
-        line = self.proc.stdout.readline()
-        while is_ascii(line):
-            line = self.proc.stdout.readline()
-        line = line.decode(sys.stdout.encoding)
-        return line
-
-    # version without special terminator marker added.
-    # passes a string to the sdp tagger subprocess
-    # Also passes a special "~" string to use as a signal that tag output
-    # is finished.
-    def give_input_and_end(self, text):
-        terminated_line = text
-        if self.verbose:
-            print "[give_input_and_end]terminated_line: |%s|" % terminated_line
-        self.proc.stdin.write(terminated_line.encode('utf-8'))
-        if self.verbose:
-            print "[give_input_and_end]After proc.stdin.write"
+        """Return the segmented text as a single line, including the newline."""
+        return self.seg_many([text.strip()])[0] + u"\n"
+
+    def seg_many(self, sentences):
+        """Segment a list of sentences, none of which may contain a newline, and
+        return the list of segmented sentences. All sentences are sent in one
+        frame, if the segmenter does not return one line for each sentence then
+        the sentences are sent again, each in a frame of its own."""
+        return self.receive_many(self.send_many(sentences), sentences)
+
+    def send_many(self, sentences):
+        """Send a frame with the sentences to the segmenter and return the frame
+        identifier, use receive_many() to get the results. Several frames can
+        be sent before receiving their results."""
+        frame_id = self.next_frame_id
+        self.next_frame_id += 1
+        lines = [sentence for sentence in sentences if sentence] + [FRAME_MARKER % frame_id]
+        self.proc.stdin.write((u"\n".join(lines) + u"\n\n\n").encode('utf-8'))
         self.proc.stdin.flush()
-        self.proc.stdin.write('\n')
-        self.proc.stdin.write('\n')
-
-    # Reads lines from the output of the subprocess (sdp parser) and 
-    # concatenates them into a single string, returned as the result
-    # We use a line with a single "~" to signal the end of the output
-    # from the tagger.  Note that the tagger will add _<tag> to the tilda,
-    # so we match on the first two characters only for the termination condition.
-    def get_output_to_end_old(self):
-        result = []
-        line = self.proc.stdout.readline().decode('utf8')
-        # Not sure why the != None is needed if this is called from pubmed.sh rather than
-        #  fxml.test_pm() within python.  PGA
-        if line is not None:
-            line = line.decode(sys.stdout.encoding)
-        # remove tabs from sdp output (e.g. for Phrase structure)
-        line = line.strip("\n")
-        if self.verbose:
-            print "[get_output_to_end]in while loop.  line: |%s|" % line
-        # Append result only if line is not empty
-        if line != "":
-            result.append(line)
-        if self.verbose:
-            print "[get_output_to_end]result: |%s|" % result
-        line = self.proc.stdout.readline().decode(sys.stdout.encoding)
-        if self.verbose:
-            print "[get_output_to_end]next line: |%s|" % line
+        return frame_id
 
-        if self.verbose:
-            print "[get_output_to_end]Out of loop.  Returning..."
+    def receive_many(self, frame_id, sentences):
+        """Return the segmented sentences sent in the frame with frame_id."""
+        lines = self.receive(frame_id)
+        if lines is None:
+            # the segmenter died or hangs, try once more with a fresh segmenter
+            self.restart()
+            lines = self.receive(self.send_many(sentences))
+            if lines is None:
+                raise SegmenterError("segmenter failed on %d sentences" % len(sentences))
+        results = iter(lines)
+        if len(lines) != len([s for s in sentences if s]):
+            if len(sentences) == 1:
+                return [u" ".join(lines)]
+            return [self.seg_many([sentence])[0] for sentence in sentences]
+        return [next(results) if sentence else u"" for sentence in sentences]
 
-        return result
+    def receive(self, frame_id):
+        """Return the output lines for the frame, or None if the segmenter did
+        not answer in time, died, or was restarted after the frame was sent."""
+        if frame_id < self.first_frame_id:
+            return None
+        if frame_id in self.early_frames:
+            return self.early_frames.pop(frame_id)
+        while True:
+            try:
+                response_id, lines = self.responses.get(timeout=self.timeout)
+            except Queue.Empty:
+                return None
+            if response_id is None:
+                return None
+            if response_id == frame_id:
+                return lines
+            self.early_frames[response_id] = lines
+
+
+class SegmenterPool:
+
+    """A number of segmenter processes that share the work of seg_many(). The
+    sentences are divided over the segmenters, which all work at the same
+    time. Like with a single Segmenter, several sets of sentences can be sent
+    with send_many() before their results are collected with receive_many()."""
+
+    def __init__(self, size, timeout=300):
+        self.segmenters = [Segmenter(timeout) for _ in range(size)]
+
+    def seg(self, text):
+        return self.segmenters[0].seg(text)
+
+    def seg_many(self, sentences):
+        return self.receive_many(self.send_many(sentences), sentences)
+
+    def send_many(self, sentences):
+        """Send the sentences to the segmenters and return the list of frames,
+        with the segmenter, the frame identifier and the sentences of each
+        frame."""
+        size = int(math.ceil(len(sentences) / float(len(self.segmenters)))) or 1
+        batches = [sentences[i:i + size] for i in range(0, len(sentences), size)]
+        return [(segmenter, segmenter.send_many(batch), batch)
+                for segmenter, batch in zip(self.segmenters, batches)]
+
+    def receive_many(self, frames, sentences):
+        """Return the segmented sentences for the frames returned by send_many(),
+        the sentences are the ones handed to send_many()."""
+        results = []
+        for segmenter, frame_id, batch in frames:
+            results.extend(segmenter.receive_many(frame_id, batch))
+        return results
+
+    def stop(self):
+        for segmenter in self.segmenters:
+            segmenter.stop()
+
+
+class SegmenterError(Exception):
+    pass
+
+
+# The marker line that ends a frame of sentences. The segmenter may put spaces
+# in the marker, so these are removed before the line is matched.
+FRAME_MARKER = u"SEGMENTERFRAME%d"
+FRAME = re.compile(r'^SEGMENTERFRAME(\d+)$')
+
+
+def read_frames(stdout, responses):
+    """Read lines from the output of the segmenter and put a pair of the frame
+    identifier and the list of non-empty lines before the marker on the
+    responses queue for each frame marker. Puts (None, None) on the queue when
+    the output is closed."""
+    lines = []
+    for line in iter(stdout.readline, ''):
+        line = line.decode('utf-8').strip()
+        match = FRAME.match(line.replace(' ', ''))
+        if match is not None:
+            responses.put((int(match.group(1)), lines))
+            lines = []
+        elif line != "":
+            lines.append(line)
+    responses.put((None, None))
 
 
 def is_ascii(s):
@@ -94,7 +94,10 @@ class Sentence(object):
     # given a tag_string, generate all chunks in the sentence in a chart
     # data structure
     # e.g. 'John_NNP went_VBD today_NN ._.'
-    def __init__(self, sid, field, num, tag_string, chunk_schema):
+    # tagged_tokens is an optional list of (token, tag) pairs as returned by
+    # split_tag_string(), it can be handed in if the tag_string was already
+    # split, for example when one sentence is chunked with several schemas.
+    def __init__(self, sid, field, num, tag_string, chunk_schema, tagged_tokens=None):
         self.debug_p = False
         #self.debug_p = True
         # make sure there are no ws on edges since we will split on ws later
@@ -115,7 +118,7 @@ class Sentence(object):
 
         # chart is a sequence of chunk instances, one for each token
         self.chart = []
-        self.init_chart(tag_string)
+        self.init_chart(tag_string, tagged_tokens)
         self.chunk_chart_tech(chunk_schema)
 
 
@@ -133,18 +136,18 @@ class Sentence(object):
         return(section_loc)
 
     # create initial chart using raw token list
-    def init_chart(self, tag_string):
+    def init_chart(self, tag_string, tagged_tokens=None):
         if self.debug_p:
             print "[init_chart]tag_string: %s" % tag_string
-        self.tags = tag_string.split(" ")
-        self.len = len(self.tags)
+        if tagged_tokens is None:
+            tagged_tokens = split_tag_string(tag_string)
+        self.tags = [tag for (tok, tag) in tagged_tokens]
+        self.len = len(tagged_tokens)
         self.last = self.len - 1
         l_tok = []
         index = 0
         next = 1
-        for tag in self.tags:
-            # use rsplit with maxsplit = 1 so that we don't further split tokens like CRF07_BC
-            (tok, tag) = tag.rsplit("_", 1)
+        for (tok, tag) in tagged_tokens:
             chunk = Chunk(index, next, tok, tag)
             self.chart.append(chunk)
             l_tok.append(tok)
@@ -1417,6 +1420,12 @@ def add_chunk_pattern_element(line, start_pat, cont_pat, end_pat):
 for lang in language_list:
     d_chunkSchema[lang] = chunk_schema(lang)
 
+# split a tag_string into a list of (token, tag) pairs, the result can be handed
+# to the Sentence constructor so a string does not need to be split twice
+def split_tag_string(tag_string):
+    # use rsplit with maxsplit = 1 so that we don't further split tokens like CRF07_BC
+    return [tuple(tagged_token.rsplit("_", 1)) for tagged_token in tag_string.split(" ")]
+
 # return a Sentence object for the given language and arguments
 def get_sentence_for_lang(lang, sent_args):
     sentence_func = d_sent_for_lang.get(lang)
@@ -15,6 +15,63 @@ OPTIONS:
   --seg2tag    tagging segemented text (Chinese only)
   --tag2chk    creating chunks in context and adding features
 
+  --txt2seg2tag
+       segmenting and tagging in one pass (Chinese only), this uses the
+       --txt2seg and --seg2tag stages of the pipeline and creates the same
+       d2_tag data set as running those two stages, but the segmented text is
+       not written to and read back from d2_seg, see cn_txt2tag.py
+
+  --keep-seg
+       also write the segmented files to the d2_seg data set when running
+       --txt2seg2tag, this requires that d2_seg and d2_tag have the same number
+       of processed files
+
+  --augment-features NAMES
+       add the features calculated by the comma-separated feature methods in
+       NAMES to an existing d3_feats data set, only processing files that were
+       already processed by --tag2chk, see corpus.run_augment_features()
+
+  --sentence-cache INTEGER
+       number of tagged sentences for which --tag2chk keeps the chunks and
+       features in a cache, so that repeated sentences (boilerplate, claims that
+       repeat other claims) are not chunked again, the default is 0, which
+       means that no cache is used; this does not change the results
+
+  --workers INTEGER
+       number of worker processes used for --xml2txt, --txt2tag, --txt2seg,
+       --seg2tag and --tag2chk, the default is 1; each worker has its own
+       tagger, segmenter or sentence cache
+
+  --schedule list|cost
+       the order in which files are handed to the workers, with 'list' (the
+       default) files are processed in the order of the file list, with 'cost'
+       the largest input files are processed first so that a few big files at
+       the end of a batch do not keep all but one worker idle
+
+  --timeout SECONDS
+       maximum number of seconds for processing one document; a worker that
+       runs over is killed together with its tagger or segmenter and replaced
+       by a new one, and the document is added to state/quarantine.txt of the
+       output data set and gets an empty output file; this also runs the
+       documents in a separate worker process when there is only one worker;
+       documents that raise an error are quarantined with or without this
+       option, quarantined documents are skipped when they come up again
+
+  --retry-quarantined
+       process the quarantined documents of the output data set again, in
+       addition to the -n documents, these are removed from the quarantine if
+       they succeed; use -n 0 to only process the quarantined documents
+
+  --batch-size INTEGER
+       number of files that are tagged with one run of the tagger when --txt2tag
+       uses the stanford-batch tagger, the default is 100; with this tagger
+       --workers sets the number of tagger processes
+
+  --segmenters INTEGER
+       number of segmenter processes used by each worker for --txt2seg, the
+       sentences of a file are divided over these processes, the default is 1;
+       this is also used by --txt2seg2tag
+
   --corpus TARGET_PATH
        corpus directory, this is a required option
 
@@ -52,6 +109,9 @@ Examples:
    %  python step2_document_processing.py --corpus data/patents/en --xml2txt -n 5
    %  python step2_document_processing.py --corpus data/patents/en --txt2tag -n 5
    %  python step2_document_processing.py --corpus data/patents/en --tag2chk -n 5
+   %  python step2_document_processing.py --corpus data/patents/en --tag2chk -n 5 --sentence-cache 10000
+   %  python step2_document_processing.py --corpus data/patents/en --txt2tag -n 500 --workers 8 --schedule cost
+   %  python step2_document_processing.py --corpus data/patents/en --augment-features prev_J -n 5
 
 There are two options that allow you to specifiy the location of the Stanford
 tagger and segmenter. These should be used if these tools are not on a location
@@ -72,18 +132,24 @@ import sys, getopt
 import config
 from corpus import Corpus
 from corpus import POPULATE, XML2TXT, TXT2TAG, TXT2SEG, SEG2TAG, TAG2CHK
+from corpus import TXT2SEG2TAG
 from corpus import ALL_STAGES
+from corpus import run_augment_features
 from utils.batch import RuntimeConfig
 from utils.batch import show_datasets, show_pipelines
 from utils.batch import show_processing_time
+from utils.parallel import SCHEDULES
 
 
 def read_opts():
     options = ['corpus=', 'populate', 
                'xml2txt', 'txt2tag', 'txt2seg', 'seg2tag', 'tag2chk',
+               'txt2seg2tag', 'keep-seg',
                'stanford-segmenter-dir=', 'stanford-tagger-dir=',
                'verbose', 'pipeline=', 'show-data', 'show-pipelines',
-               'show-processing-time']
+               'show-processing-time', 'augment-features=', 'sentence-cache=',
+               'workers=', 'schedule=', 'timeout=', 'retry-quarantined',
+               'batch-size=', 'segmenters=']
     try:
         return getopt.getopt(sys.argv[1:], 'n:c:v', options)
     except getopt.GetoptError as e:
@@ -98,6 +164,12 @@ if __name__ == '__main__':
     opt_pipeline_config = 'pipeline-default.txt'
     opt_verbose, opt_show_data_p, opt_show_pipelines_p = False, False, False
     opt_show_processing_time_p = False
+    opt_augment_features = None
+    opt_sentence_cache = 0
+    opt_workers, opt_schedule = 1, 'list'
+    opt_timeout, opt_retry_quarantined = None, False
+    opt_batch_size, opt_segmenters = 100, 1
+    opt_keep_segmented = False
     opt_limit = 1
 
     (opts, args) = read_opts()
@@ -109,14 +181,36 @@ if __name__ == '__main__':
         if opt == '--show-data': opt_show_data_p = True
         if opt == '--show-pipelines': opt_show_pipelines_p = True
         if opt == '--show-processing-time': opt_show_processing_time_p = True
+        if opt == '--augment-features': opt_augment_features = val.split(',')
+        if opt == '--sentence-cache': opt_sentence_cache = int(val)
+        if opt == '--workers': opt_workers = int(val)
+        if opt == '--schedule': opt_schedule = val
+        if opt == '--timeout': opt_timeout = float(val)
+        if opt == '--retry-quarantined': opt_retry_quarantined = True
+        if opt == '--batch-size': opt_batch_size = int(val)
+        if opt == '--segmenters': opt_segmenters = int(val)
+        if opt == '--keep-seg': opt_keep_segmented = True
         if opt == '--stanford-segmenter-dir': config.update_stanford_segmenter(val)
         if opt == '--stanford-tagger-dir': config.update_stanford_tagger(val)
         if opt in ALL_STAGES:
             opt_stage = opt
 
+    if opt_schedule not in SCHEDULES:
+        sys.exit("ERROR: unknown schedule: %s" % opt_schedule)
+    if opt_batch_size < 1:
+        sys.exit("ERROR: the batch size should be a positive integer")
+
     runtime_configuration = RuntimeConfig(opt_corpus_path, None, None,
                                           opt_pipeline_config,
                                           verbose=opt_verbose, limit=opt_limit)
+    runtime_configuration.sentence_cache = opt_sentence_cache
+    runtime_configuration.workers = opt_workers
+    runtime_configuration.schedule = opt_schedule
+    runtime_configuration.timeout = opt_timeout
+    runtime_configuration.retry_quarantined = opt_retry_quarantined
+    runtime_configuration.batch_size = opt_batch_size
+    runtime_configuration.segmenters = max(1, opt_segmenters)
+    runtime_configuration.keep_segmented = opt_keep_segmented
 
     if opt_show_data_p:
         show_datasets(runtime_configuration, config.DATA_DIRS, opt_verbose)
@@ -127,7 +221,13 @@ if __name__ == '__main__':
         show_processing_time(runtime_configuration, config.DATA_DIRS)
         exit()
 
-    options = runtime_configuration.get_options(opt_stage)
+    if opt_augment_features is not None:
+        run_augment_features(runtime_configuration, opt_augment_features)
+        exit()
+
+    # the options of --txt2seg2tag come from two stages of the pipeline
+    if opt_stage != TXT2SEG2TAG:
+        options = runtime_configuration.get_options(opt_stage)
 
     # corpus already exists in a directory, so just need its location
     corpus = Corpus(corpus_path=opt_corpus_path)
@@ -142,5 +242,7 @@ if __name__ == '__main__':
         corpus.txt2seg(runtime_configuration, options)
     elif opt_stage == SEG2TAG:
         corpus.seg2tag(runtime_configuration, options)
+    elif opt_stage == TXT2SEG2TAG:
+        corpus.txt2seg2tag(runtime_configuration)
     elif opt_stage == TAG2CHK:
         corpus.tag2chk(runtime_configuration, options)
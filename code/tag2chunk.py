@@ -6,15 +6,15 @@
 # one with all chunks indexed by id with all features for that phrase occurrence (phr_feats)
 # one with only chunk and <id><tab><bracketed sentence>, to be used for annotation)
 
-import os
+import os, hashlib, collections
 import sentence
 from utils.path import open_input_file, open_output_file
 
 
-# returns True if lists share at least one term
-def share_term_p(l1, l2):
-    for term in l1:
-        if term in l2:
+# returns True if any of the tokens is in terms, terms should be a set
+def share_term_p(terms, tokens):
+    for token in tokens:
+        if token in terms:
             return True
     return False
 
@@ -35,13 +35,38 @@ def mallet_feature(name, value):
 class Doc:
 
     def __init__(self, tag_file, phr_feats_file, year, lang,
-                 filter_p=True, chunker_rules='en', compress=True):
+                 filter_p=True, chunker_rules='en', compress=True, cache=None,
+                 candidate_filter=None, sections=None):
+        """Create the chunks and their features for tag_file and write them to
+        phr_feats_file. Both phr_feats_file and chunker_rules can also be lists
+        of the same length, in which case each sentence is read and split once
+        and then chunked with each set of chunker rules, writing the results of
+        each rule set to the corresponding phr_feats file. If a SentenceCache is
+        handed in, sentences that were seen before are not chunked again, note
+        that those sentences are not added to d_sent and d_field. Chunks are
+        written if they pass candidate_filter, if no CandidateFilter is handed
+        in then one is created that only uses the title filter, and only if
+        filter_p is True. The counts of the filter are for the chunks of the
+        first set of chunker rules only. If sections is a SectionSelector then only the lines
+        in the selected sections are chunked."""
+        if isinstance(chunker_rules, basestring):
+            chunker_rules = [chunker_rules]
+            phr_feats_file = [phr_feats_file]
         self.input = tag_file
-        self.output = phr_feats_file
+        self.outputs = [ChunkerOutput(rules, fname)
+                        for rules, fname in zip(chunker_rules, phr_feats_file)]
+        # the first output is the primary output, the sentences and chunks
+        # stored on the document are those created with its chunker rules
+        self.output = self.outputs[0].filename
+        self.chunk_schema = self.outputs[0].chunk_schema
         self.year = year
-        self.chunk_schema = sentence.chunk_schema(chunker_rules)
         self.lang = lang
         self.compress = compress
+        self.cache = cache
+        if candidate_filter is None:
+            candidate_filter = CandidateFilter(title_filter=filter_p)
+        self.candidate_filter = candidate_filter
+        self.sections = sections
         # field_name to list of sent instances
         # field name is header string without FH_ or : affixes
         self.d_field = {}
@@ -49,9 +74,8 @@ class Doc:
         self.d_sent = {}
         self.d_chunk = {}
         self.next_sent_id = 0
-        self.next_chunk_id = 0
-        # lc noun tokens appearing in title
-        self.l_lc_title_noun = []
+        # lc noun tokens appearing in title or abstract
+        self.lc_title_nouns = set()
         # create the chunks
         self.process_doc(filter_p, chunker_rules)
 
@@ -64,15 +88,20 @@ class Doc:
             print "[process_doc] filter_p: %s, writing to %s" % \
                   (filter_p, self.output)
         s_input = open_input_file(self.input)
-        s_output = open_output_file(self.output, compress=self.compress)
+        for output in self.outputs:
+            output.open(self.compress)
         section = "FH_NONE"   # default section if document has no section header lines
         self.d_field[section] = []
 
+        if self.sections is not None:
+            self.sections.reset()
         sent_no_in_section = 0
         for line in s_input:
             line = line.strip("\n")
             if debug_p:
                 print "[process_doc] line: %s" % line
+            if self.sections is not None and not self.sections.selected(line):
+                continue
 
             if line[0:3] == "FH_":
                 # we are at a section header; note we have to strip off both
@@ -86,61 +115,397 @@ class Doc:
             else:
                 # process the sentence, the line is a list of token_tag pairs
                 if section == "TITLE" or section == "ABSTRACT":
-                    self.l_lc_title_noun.extend(lc_nouns(line))
-
-                # call the appropriate Sentence subclass based on the language
-                sent_args = [self.next_sent_id, section, sent_no_in_section, line,
-                             self.chunk_schema]
-                sent = sentence.get_sentence_for_lang(self.lang, sent_args)
-                # get context info
-                i = 0
-                for chunk in sent.chunk_iter():
-                    if chunk.label == "tech":
-                        # index of chunk start in sentence => ci
-                        ci = chunk.chunk_start
-                        mallet_feature_list = get_features(sent, ci)
-                        mallet_feature_list.sort()
-                        uid = os.path.basename(self.input) + "_" + str(self.next_chunk_id)
-                        metadata_list = [uid, self.year, chunk.phrase.lower()]
-                        if debug_p:
-                            print "index: %i, start: %i, end: %i, sentence: %s" % \
-                                (i, chunk.chunk_start, chunk.chunk_end, sent.sentence)
-                        if add_chunk_data(self, chunk, section, filter_p):
-                            add_line_to_phr_feats(metadata_list, mallet_feature_list,
-                                                  s_output)
-                        chunk.sid = self.next_sent_id
-                        self.d_chunk[self.next_chunk_id] = chunk
-                        sent.chunks.append(chunk)
-                        self.next_chunk_id += 1
-                    i = chunk.chunk_end
-                    
+                    self.lc_title_nouns.update(lc_nouns(line))
+
+                # split the line only once, even if we use several chunkers
+                tagged_tokens = sentence.split_tag_string(line)
+                for output in self.outputs:
+                    cached_chunks = None
+                    if self.cache is not None:
+                        key = self.cache.key(line, output.chunker_rules, self.lang)
+                        cached_chunks = self.cache.get(key)
+                        if cached_chunks is not None:
+                            self.process_cached_chunks(cached_chunks, section,
+                                                       sent_no_in_section, output)
+                            continue
+                        cached_chunks = []
+                        self.cache.put(key, cached_chunks)
+                    # call the appropriate Sentence subclass based on the language
+                    sent_args = [self.next_sent_id, section, sent_no_in_section, line,
+                                 output.chunk_schema, tagged_tokens]
+                    sent = sentence.get_sentence_for_lang(self.lang, sent_args)
+                    self.process_chunks(sent, section, output, cached_chunks)
+                    if output is self.outputs[0]:
+                        self.d_field[section].append(sent)
+                        self.d_sent[self.next_sent_id] = sent
+
                 # keep track of the location of this sentence within the section
                 sent_no_in_section += 1
-                self.d_field[section].append(sent)
-                self.d_sent[self.next_sent_id] = sent
                 self.next_sent_id += 1
 
         s_input.close()
-        s_output.close()
+        for output in self.outputs:
+            output.close()
+
+    def process_chunks(self, sent, section, output, cached_chunks=None):
+        """Calculate features for all technology chunks in the sentence that
+        pass the candidate filter and write them to the output. If cached_chunks
+        is a list, add a CachedChunk for each technology chunk to it, in that
+        case the features that go into the cache are calculated for rejected
+        chunks too since the same sentence may occur later in another section."""
+        debug_p = False
+        # get context info
+        i = 0
+        for chunk in sent.chunk_iter():
+            if chunk.label == "tech":
+                # index of chunk start in sentence => ci
+                ci = chunk.chunk_start
+                accepted = self.accept(chunk, section, output)
+                if cached_chunks is not None:
+                    static_methods, location_methods = split_feature_methods(sent)
+                    static_features = get_features(sent, ci, static_methods)
+                    cached_chunks.append(
+                        CachedChunk(chunk.chunk_start, chunk.chunk_end, chunk.phrase,
+                                    chunk.lc_tokens, static_features))
+                if debug_p:
+                    print "index: %i, start: %i, end: %i, sentence: %s" % \
+                        (i, chunk.chunk_start, chunk.chunk_end, sent.sentence)
+                if accepted:
+                    if cached_chunks is None:
+                        mallet_feature_list = get_features(sent, ci)
+                    else:
+                        mallet_feature_list = static_features \
+                                              + get_features(sent, ci, location_methods)
+                    mallet_feature_list.sort()
+                    uid = os.path.basename(self.input) + "_" + str(output.next_chunk_id)
+                    metadata_list = [uid, self.year, chunk.phrase.lower()]
+                    add_line_to_phr_feats(metadata_list, mallet_feature_list,
+                                          output.stream)
+                    output.written += 1
+                chunk.sid = self.next_sent_id
+                if output is self.outputs[0]:
+                    self.d_chunk[output.next_chunk_id] = chunk
+                sent.chunks.append(chunk)
+                output.next_chunk_id += 1
+            i = chunk.chunk_end
+
+
+    def accept(self, chunk, section, output):
+        """Return True if the chunk passes the candidate filter. Only the chunks
+        of the first output are counted by the filter, otherwise the counts
+        would be multiplied by the number of outputs."""
+        if output is self.outputs[0]:
+            return self.candidate_filter.accept(chunk, section, self.lc_title_nouns)
+        return self.candidate_filter.rejecting_rule(chunk, section, self.lc_title_nouns) is None
+
+    def process_cached_chunks(self, cached_chunks, section, sent_no_in_section,
+                              output):
+        """Write the technology chunks of a sentence that was found in the
+        cache, only the location features need to be calculated."""
+        location = SentenceLocation(self.next_sent_id, section, sent_no_in_section)
+        location_methods = split_feature_methods(sentence.d_sent_for_lang[self.lang])[1]
+        for chunk in cached_chunks:
+            if self.accept(chunk, section, output):
+                location.chart[chunk.chunk_start] = chunk
+                mallet_feature_list = chunk.features \
+                                      + get_features(location, chunk.chunk_start, location_methods)
+                mallet_feature_list.sort()
+                uid = os.path.basename(self.input) + "_" + str(output.next_chunk_id)
+                metadata_list = [uid, self.year, chunk.phrase.lower()]
+                add_line_to_phr_feats(metadata_list, mallet_feature_list, output.stream)
+                output.written += 1
+            output.next_chunk_id += 1
+
+
+class ChunkerOutput(object):
+
+    """Bundles a set of chunker rules with the phr_feats file that the chunks
+    created by those rules are written to. Chunk identifiers are counted for
+    each output separately since different rules create different chunks."""
+
+    def __init__(self, chunker_rules, filename):
+        self.chunker_rules = chunker_rules
+        self.chunk_schema = sentence.chunk_schema(chunker_rules)
+        self.filename = filename
+        self.stream = None
+        self.next_chunk_id = 0
+        self.written = 0
+
+    def open(self, compress=True):
+        self.stream = open_output_file(self.filename, compress=compress)
+
+    def close(self):
+        self.stream.close()
+
+
+class AugmentedDoc(Doc):
+
+    """Adds features to the chunks in an existing phr_feats file. The tagged
+    file is processed again with the chunker rules that created the phr_feats
+    file so chunks get the same identifiers, but only the feature methods
+    handed in are called. New features are merged into the existing lines,
+    replacing features with the same name, and lines are matched on their
+    uid. The phr_feats file is only replaced if all its lines were matched."""
+
+    def __init__(self, tag_file, phr_feats_file, lang, chunker_rules,
+                 feature_methods, compress=True, sections=None):
+        self.phr_feats_file = phr_feats_file
+        self.feature_methods = feature_methods
+        self.d_lines = read_phr_feats(phr_feats_file)
+        self.augmented = 0
+        tmp_file = phr_feats_file + '.augmenting'
+        Doc.__init__(self, tag_file, tmp_file, None, lang, filter_p=False,
+                     chunker_rules=chunker_rules, compress=compress, sections=sections)
+        if compress:
+            tmp_file, phr_feats_file = tmp_file + '.gz', phr_feats_file + '.gz'
+        if self.d_lines:
+            print "[AugmentedDoc] WARNING: %d unmatched lines in %s, not augmenting" \
+                  % (len(self.d_lines), phr_feats_file)
+            os.remove(tmp_file)
+        else:
+            os.rename(tmp_file, phr_feats_file)
+
+    def process_chunks(self, sent, section, output, cached_chunks=None):
+        """Calculate the requested features for those technology chunks that
+        are in the existing phr_feats file and write the augmented line."""
+        for chunk in sent.chunk_iter():
+            if chunk.label == "tech":
+                uid = os.path.basename(self.input) + "_" + str(output.next_chunk_id)
+                fields = self.d_lines.pop(uid, None)
+                if fields is not None:
+                    ci = chunk.chunk_start
+                    features = [method(sent, ci) for method in self.feature_methods]
+                    features = [feat for feat in features if feat is not None]
+                    metadata_list = fields[:3]
+                    mallet_feature_list = merge_features(fields[3:], features)
+                    add_line_to_phr_feats(metadata_list, mallet_feature_list, output.stream)
+                    self.augmented += 1
+                output.next_chunk_id += 1
+
+
+def read_phr_feats(phr_feats_file):
+    """Return a dictionary of all lines in a phr_feats file, indexed on the uid
+    and with the line split into fields as the value."""
+    d_lines = {}
+    s_input = open_input_file(phr_feats_file)
+    for line in s_input:
+        fields = line.rstrip("\n").split("\t")
+        d_lines[fields[0]] = fields
+    s_input.close()
+    return d_lines
+
+
+def merge_features(old_features, new_features):
+    """Return a sorted list with the new features and those old features whose
+    names do not occur in the new features."""
+    new_names = set([feat.split("=", 1)[0] for feat in new_features])
+    merged = [feat for feat in old_features if feat.split("=", 1)[0] not in new_names]
+    merged.extend(new_features)
+    merged.sort()
+    return merged
+
+
+def select_feature_methods(lang, method_names):
+    """Return the feature methods of the Sentence subclass for lang whose names
+    are in method_names."""
+    sentence_class = sentence.d_sent_for_lang[lang]
+    return [method for method in sentence_class.feature_methods
+            if method.__name__ in method_names]
+
+
+class SentenceCache(object):
+
+    """A least-recently-used cache of the technology chunks in a sentence and
+    the features of those chunks that do not depend on where the sentence
+    occurs in the document. Keys are created from a hash of the tagged sentence,
+    the chunker rules and the language, the latter determines the Sentence
+    subclass and therefore the feature methods. The cache keeps counts of hits
+    and misses."""
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __str__(self):
+        return "<SentenceCache size=%d hits=%d misses=%d hit_rate=%.2f>" \
+            % (self.size, self.hits, self.misses, self.hit_rate())
 
+    @staticmethod
+    def key(tag_string, chunker_rules, lang):
+        return hashlib.md5(tag_string.encode('utf-8')).digest(), chunker_rules, lang
 
-def get_features(sent, ci):
+    def get(self, key):
+        """Return the cached chunks for key or None if key is not cached, a key
+        that is found becomes the most recently used key."""
+        cached_chunks = self.entries.pop(key, None)
+        if cached_chunks is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries[key] = cached_chunks
+        return cached_chunks
+
+    def put(self, key, cached_chunks):
+        self.entries[key] = cached_chunks
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / float(lookups) if lookups else 0.0
+
+
+class CachedChunk(object):
+
+    """The parts of a technology chunk that are needed to write it to a phr_feats
+    file, including the features that do not depend on the sentence location."""
+
+    def __init__(self, chunk_start, chunk_end, phrase, lc_tokens, features):
+        self.chunk_start = chunk_start
+        self.chunk_end = chunk_end
+        self.phrase = phrase
+        self.lc_tokens = lc_tokens
+        self.features = features
+
+
+class SentenceLocation(object):
+
+    """Stands in for a Sentence when calculating the location features for
+    cached chunks, it has all that those feature methods use."""
+
+    make_section_loc = sentence.Sentence.make_section_loc.im_func
+
+    def __init__(self, sid, field, num):
+        self.sid = sid
+        self.field = field
+        self.num = num
+        self.chart = {}
+
+
+# names of the feature methods whose values depend on where a sentence occurs in
+# the document rather than on the sentence itself
+LOCATION_FEATURE_METHODS = ('document_loc', 'sentence_loc', 'section_loc')
+
+_feature_methods_split = {}
+
+
+def split_feature_methods(sent):
+    """Return the feature methods of a Sentence class or instance as a pair of
+    lists, the first with the methods that only depend on the sentence itself
+    and the second with the location feature methods."""
+    sentence_class = sent if isinstance(sent, type) else sent.__class__
+    if sentence_class not in _feature_methods_split:
+        methods = sentence_class.feature_methods
+        _feature_methods_split[sentence_class] = (
+            [m for m in methods if m.__name__ not in LOCATION_FEATURE_METHODS],
+            [m for m in methods if m.__name__ in LOCATION_FEATURE_METHODS])
+    return _feature_methods_split[sentence_class]
+
+
+def get_features(sent, ci, feature_methods=None):
     """Call all feature_methods for the current sentence and create a list of their
-    results, these are unbound methods, so must supply instance."""
-    mallet_feature_list = [method(sent, ci) for method in sent.feature_methods]
+    results, these are unbound methods, so must supply instance. Uses the
+    feature methods of the sentence if no feature methods are handed in."""
+    if feature_methods is None:
+        feature_methods = sent.feature_methods
+    mallet_feature_list = [method(sent, ci) for method in feature_methods]
     mallet_feature_list = [feat for feat in mallet_feature_list if feat is not None]
     return mallet_feature_list
 
 
-def add_chunk_data(doc, chunk, section, filter_p):
-    """FILTERING technology terms to output (if filter_p is True). We only output terms
-    that are in the title or share a term with a title term.  Note that our 'title terms'
-    can actually come from title or abstract. Many German patent titles are only one word
-    long! This filter may need adjustment (e.g. for German compound terms, which may not
-    match exactly, fitering ought to be based on component terms, not the compound as a
-    whole).  Filtering is not applied if filter_p parameter is False. """
-    return not filter_p \
-           or (section == "TITLE" or share_term_p(doc.l_lc_title_noun, chunk.lc_tokens))
+class CandidateFilter(object):
+
+    """FILTERING technology terms to output. The filter has the following rules,
+    which are applied in this order:
+
+    stoplist     reject terms that are in the stoplist
+    min_length   reject terms with fewer than min_length tokens
+    max_length   reject terms with more than max_length tokens
+    title        only output terms that are in the title or share a term with a
+                 title term
+
+    A rule is only applied if it was configured. Note that our 'title terms' can
+    actually come from title or abstract. Many German patent titles are only one
+    word long! The title rule may need adjustment (e.g. for German compound
+    terms, which may not match exactly, fitering ought to be based on component
+    terms, not the compound as a whole). The filter counts how many terms were
+    accepted and how many were rejected by each rule."""
+
+    RULES = ('stoplist', 'min_length', 'max_length', 'title')
+
+    def __init__(self, title_filter=False, stoplist=None, min_length=None, max_length=None):
+        self.title_filter = title_filter
+        self.stoplist = stoplist if stoplist is not None else set()
+        self.min_length = min_length
+        self.max_length = max_length
+        self.reset_counts()
+
+    def __str__(self):
+        rejected = ' '.join(["%s=%d" % (rule, self.rejected[rule])
+                             for rule in CandidateFilter.RULES])
+        return "<CandidateFilter accepted=%d %s>" % (self.accepted, rejected)
+
+    def copy(self):
+        """Return a filter with the same rules and with all counts set to 0."""
+        return CandidateFilter(self.title_filter, self.stoplist, self.min_length,
+                               self.max_length)
+
+    def counts(self):
+        counts = dict(self.rejected)
+        counts['accepted'] = self.accepted
+        return counts
+
+    def add_counts(self, counts):
+        """Add counts as returned by counts() to the counts of this filter."""
+        self.accepted += counts['accepted']
+        for rule in CandidateFilter.RULES:
+            self.rejected[rule] += counts[rule]
+
+    def reset_counts(self):
+        self.accepted = 0
+        self.rejected = dict([(rule, 0) for rule in CandidateFilter.RULES])
+
+    def is_active(self):
+        return self.title_filter or bool(self.stoplist) \
+            or self.min_length is not None or self.max_length is not None
+
+    def rejecting_rule(self, chunk, section, title_nouns):
+        """Return the name of the first rule that rejects the chunk, or None if
+        the chunk is accepted. The title_nouns argument is a set of lower-cased
+        nouns from the title and abstract."""
+        if self.stoplist and chunk.phrase.lower() in self.stoplist:
+            return 'stoplist'
+        if self.min_length is not None and len(chunk.lc_tokens) < self.min_length:
+            return 'min_length'
+        if self.max_length is not None and len(chunk.lc_tokens) > self.max_length:
+            return 'max_length'
+        if self.title_filter and section != "TITLE" \
+           and not share_term_p(title_nouns, chunk.lc_tokens):
+            return 'title'
+        return None
+
+    def accept(self, chunk, section, title_nouns):
+        rule = self.rejecting_rule(chunk, section, title_nouns)
+        if rule is None:
+            self.accepted += 1
+            return True
+        self.rejected[rule] += 1
+        return False
+
+
+def read_stoplist(filename):
+    """Return the set of lower-cased terms in a stoplist file. The file has one
+    term per line, empty lines and lines starting with # are ignored."""
+    stoplist = set()
+    s_input = open_input_file(filename)
+    for line in s_input:
+        term = line.strip()
+        if term and not term.startswith('#'):
+            stoplist.add(term.lower())
+    s_input.close()
+    return stoplist
 
 
 def add_line_to_phr_occ(uid, doc, chunk, hsent, s_output_phr_occ):
@@ -0,0 +1,7 @@
+"""
+
+Unit tests. Run them from the code directory with
+
+    $ python -m unittest discover tests
+
+"""
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for the classification of Chinese lines in cn_txt2seg."""
+
+import os, sys, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cn_txt2seg
+from cn_txt2seg import classify, SKIPABLE, ASCII, CHINESE
+
+
+class ClassifyTest(unittest.TestCase):
+
+    def test_skipable(self):
+        for line in (u"", u"  ", u"abc", u"12a", u"this is an english sentence",
+                     u"中" + u"x" * 20, u"中" * 5001):
+            self.assertEqual(classify(line), SKIPABLE, repr(line))
+
+    def test_numbers(self):
+        self.assertEqual(classify(u"20120709"), ASCII)
+        self.assertEqual(classify(u"2012 07 09"), ASCII)
+        self.assertEqual(classify(u"2012　07"), CHINESE)
+        self.assertEqual(classify(u"12\xb2"), ASCII)
+
+    def test_chinese(self):
+        self.assertEqual(classify(u"中文。"), CHINESE)
+        self.assertEqual(classify(u"abc 中文"), CHINESE)
+
+    def test_is_skipable(self):
+        self.assertTrue(cn_txt2seg.is_skipable(u"abc"))
+        self.assertFalse(cn_txt2seg.is_skipable(u"中文"))
+
+
+if __name__ == '__main__':
+    unittest.main()
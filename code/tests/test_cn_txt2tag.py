@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for segmenting and tagging Chinese files in one pass, with stand-ins for
+the segmenter and the tagger."""
+
+import os, sys, codecs, shutil, tempfile, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sdp, cn_txt2seg, cn_seg2tag, cn_txt2tag
+from utils.manifest import count_sentences_and_tokens
+
+
+# puts a space between the characters of each line
+FAKE_SEGMENTER = """
+import sys
+for line in iter(sys.stdin.readline, ''):
+    line = line.decode('utf-8').rstrip('\\n')
+    sys.stdout.write(' '.join(line).encode('utf-8') + '\\n')
+    sys.stdout.flush()
+"""
+
+# tags each token with NN, and the terminator lines as the Stanford tagger does
+FAKE_TAGGER = """
+import sys
+for line in iter(sys.stdin.readline, ''):
+    tokens = line.split()
+    if tokens and tokens[0] == '~_':
+        sys.stdout.write('~__SYM %s_CD\\n' % tokens[1])
+    else:
+        sys.stdout.write(' '.join([token + '_NN' for token in tokens]) + '\\n')
+    sys.stdout.flush()
+"""
+
+TEXT = u"""FH_TITLE:
+一种泵(设备)
+FH_DATE:
+20120709
+FH_ABSTRACT:
+泵包括壳体。壳体有入口。
+入口在上方。出口在下方。泵很小。
+this line is skipped because it is english
+FH_DESCRIPTION:
+泵用于水。
+END
+"""
+
+
+class SegmenterTaggerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for name, script in (('segmenter.py', FAKE_SEGMENTER), ('tagger.py', FAKE_TAGGER)):
+            with open(self.path(name), 'w') as fh:
+                fh.write(script)
+        self.segmenter_command = sdp.Segmenter.segmenter_command
+        self.tagger_command = sdp.tagger_command
+        sdp.Segmenter.segmenter_command = \
+            lambda segmenter: "exec %s %s" % (sys.executable, self.path('segmenter.py'))
+        sdp.tagger_command = \
+            lambda model: "exec %s %s" % (sys.executable, self.path('tagger.py'))
+        with codecs.open(self.path('input.txt'), 'w', encoding='utf-8') as fh:
+            fh.write(TEXT)
+
+    def tearDown(self):
+        sdp.Segmenter.segmenter_command = self.segmenter_command
+        sdp.tagger_command = self.tagger_command
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def read(self, name):
+        with open(self.path(name)) as fh:
+            return fh.read()
+
+    def test_same_as_two_stages(self):
+        segmenter = cn_txt2seg.Segmenter()
+        segmenter.process(self.path('input.txt'), self.path('expected.seg'))
+        tagger = cn_seg2tag.Tagger()
+        tagger.tag(self.path('expected.seg'), self.path('expected.tag'))
+        segmenter.segmenter.stop()
+        tagger.tagger.stop()
+        segtagger = cn_txt2tag.SegmenterTagger(chunk_size=2)
+        counts = segtagger.process(self.path('input.txt'), self.path('fused.tag'),
+                                   self.path('fused.seg'))
+        segtagger.segmenter.segmenter.stop()
+        segtagger.tagger.tagger.stop()
+        self.assertEqual(self.read('fused.seg'), self.read('expected.seg'))
+        self.assertEqual(self.read('fused.tag'), self.read('expected.tag'))
+        self.assertTrue("(_PU" in self.read("fused.tag"))
+        self.assertEqual(counts, count_sentences_and_tokens(self.path('expected.seg')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for the binary format of d3_feats files."""
+
+import os, sys, shutil, tempfile, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import feats2bin
+from utils.path import ensure_path, open_input_file, open_output_file
+
+
+FILES = {
+    '1980/US4192770A.xml': [
+        u"US4192770A.xml_0\t1980\tdigital camera\tprev_V=use\tlast_word=camera",
+        u"US4192770A.xml_1\t1980\tcaf\xe9 lens\tlast_word=lens",
+        u"US4192770A.xml_12\t1980\tdigital camera\t"],
+    '0980/old.xml': [
+        u"old.xml_3\t0980\tsun dial\tlast_word=dial"],
+    'unknown/doc.xml': [
+        u"doc.xml_1\t9999a\tthing\tlast_word=thing\tprev_V=use"],
+    '1981/breaks.xml': [
+        u"breaks.xml_0\t1981\tc\x85d\tlast_word=x\u2028y",
+        u"breaks.xml_1\t1981\te\x1cf\tlast_word=thing"]}
+
+
+class BinaryFeatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dataset = tempfile.mkdtemp()
+        for filename, lines in FILES.items():
+            path = os.path.join(self.dataset, 'files', filename)
+            ensure_path(os.path.dirname(path))
+            fh = open_output_file(path)
+            for line in lines:
+                fh.write(line + u"\n")
+            fh.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dataset)
+
+    def test_round_trip(self):
+        feats2bin.convert_to_binary(self.dataset)
+        reader = feats2bin.BinaryFeatsReader(self.dataset)
+        for filename, lines in FILES.items():
+            self.assertEqual([line.rstrip(u"\n") for line in reader.lines(filename)], lines)
+
+    def test_text_output(self):
+        feats2bin.convert_to_binary(self.dataset)
+        output = os.path.join(self.dataset, 'text')
+        feats2bin.convert_to_text(self.dataset, output)
+        for filename, lines in FILES.items():
+            fh = open_input_file(os.path.join(output, filename))
+            self.assertEqual(fh.read(), u"".join(line + u"\n" for line in lines))
+            fh.close()
+
+    def test_conversion_in_two_runs(self):
+        feats2bin.convert_to_binary(self.dataset)
+        terms = feats2bin.BinaryFeatsReader(self.dataset).terms.strings
+        feats2bin.convert_to_binary(self.dataset)
+        reader = feats2bin.BinaryFeatsReader(self.dataset)
+        self.assertEqual(reader.terms.strings, terms)
+        self.assertEqual(list(reader.lines('0980/old.xml'))[0].split(u"\t")[1], u"0980")
+
+    def test_files_are_hidden_until_flushed(self):
+        writer = feats2bin.BinaryFeatsWriter(self.dataset)
+        writer.write('0980/old.xml', feats2bin.read_text_records(writer.text_file('0980/old.xml')))
+        self.assertFalse(os.path.exists(writer.binary_file('0980/old.xml')))
+        self.assertFalse(os.path.exists(writer.terms.filename))
+        writer.flush()
+        self.assertTrue(os.path.exists(writer.binary_file('0980/old.xml')))
+        self.assertEqual(feats2bin.BinaryFeatsReader(self.dataset).terms.strings, [u"sun dial"])
+
+
+
+class VocabularyTest(unittest.TestCase):
+
+    def test_reload(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'vocabulary.txt')
+            vocabulary = feats2bin.Vocabulary(filename)
+            strings = [u"a", u"c\x85d", u"e\u2028f\x1cg", u"b"]
+            for string in strings:
+                vocabulary.intern(string)
+            vocabulary.save()
+            loaded = feats2bin.Vocabulary(filename)
+            self.assertEqual(loaded.strings, strings)
+            self.assertEqual(loaded.intern(u"b"), 3)
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
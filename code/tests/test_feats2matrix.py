@@ -0,0 +1,64 @@
+"""Tests for building sparse matrices from d3_feats files."""
+
+import os, sys, ast, array, shutil, tempfile, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import feats2matrix
+from utils.path import ensure_path, open_output_file
+
+
+def read_npy(fname):
+    """Return the shape in the header of an npy file and its values."""
+    with open(fname, 'rb') as fh:
+        header = fh.read(feats2matrix.NPY_HEADER_SIZE)
+        shape = ast.literal_eval(header[10:].strip())['shape']
+        values = array.array('l' if fname.endswith('indptr.npy') else 'i')
+        values.fromstring(fh.read())
+    return shape, list(values)
+
+
+class BuildMatricesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.corpus = os.path.join(self.directory, 'corpus')
+        self.output = os.path.join(self.directory, 'matrices')
+        ensure_path(os.path.join(self.corpus, 'config'))
+        with open(os.path.join(self.corpus, 'config', 'files.txt'), 'w') as fh:
+            fh.write("1980\tsources/a.xml\t1980/a.xml\n")
+            fh.write("1981\tsources/b.xml\t1981/b.xml\n")
+        self.write_feats('02', '1980/a.xml', [
+            u"a.xml_0\t1980\tcamera\tf=1\tg=1",
+            u"a.xml_1\t1980\tlens\tg=1\tg=1"])
+        self.write_feats('02', '1981/b.xml', [
+            u"b.xml_0\t1981\tcamera\th=1\tf=1"])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_feats(self, version, filename, lines):
+        fname = os.path.join(self.corpus, 'data', 'd3_feats', version, 'files', filename)
+        ensure_path(os.path.dirname(fname))
+        fh = open_output_file(fname)
+        for line in lines:
+            fh.write(line + u"\n")
+        fh.close()
+
+    def test_build_matrices(self):
+        feats2matrix.build_matrices(self.corpus, self.output, version='02')
+        with open(os.path.join(self.output, 'features.txt')) as fh:
+            self.assertEqual(fh.read(), "f=1\ng=1\nh=1\n")
+        with open(os.path.join(self.output, 'terms.txt')) as fh:
+            self.assertEqual(fh.read(), "camera\nlens\n")
+        npy = lambda name: read_npy(os.path.join(self.output, name + '.npy'))
+        self.assertEqual(npy('occurrences.indptr'), ((4,), [0, 2, 3, 5]))
+        self.assertEqual(npy('occurrences.indices'), ((5,), [0, 1, 1, 0, 2]))
+        self.assertEqual(npy('occurrences.data'), ((5,), [1, 1, 1, 1, 1]))
+        self.assertEqual(npy('terms.indptr'), ((3,), [0, 3, 4]))
+        self.assertEqual(npy('terms.indices'), ((4,), [0, 1, 2, 1]))
+        self.assertEqual(npy('terms.data'), ((4,), [2, 1, 1, 1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for the per-document manifests of data sets."""
+
+import os, sys, shutil, tempfile, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import manifest
+from utils.path import ensure_path
+
+
+TXT_FILE = """FH_TITLE:
+A camera
+FH_DATE:
+19800415
+FH_SUBJECT:
+Optics \xc3\xa9
+FH_ABSTRACT:
+The camera has a lens.
+"""
+
+
+class ManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for dataset in ('d1_txt', 'd2_tag'):
+            ensure_path(os.path.join(self.directory, dataset, 'state'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_add_and_read(self):
+        txt = manifest.Manifest(os.path.join(self.directory, 'd1_txt'))
+        txt.add('1980/a.xml', {'year': '1980', 'txt_lines': 8})
+        txt.add('1980/b.xml', {'year': '1980', 'subject': u"a\tb"})
+        txt.add('1980/a.xml', {'txt_lines': 9})
+        tag = manifest.Manifest(os.path.join(self.directory, 'd2_tag'))
+        tag.add('1980/a.xml', {'sentences': 2}, inherited=txt)
+        tag.add('1980/c.xml', {'sentences': 1}, inherited=txt)
+        txt = manifest.Manifest(os.path.join(self.directory, 'd1_txt'))
+        tag = manifest.Manifest(os.path.join(self.directory, 'd2_tag'))
+        self.assertEqual(len(txt), 2)
+        self.assertEqual(txt.get('1980/a.xml'), {'year': u'1980', 'txt_lines': u'9'})
+        self.assertEqual(txt.get('1980/b.xml', 'subject'), u"a b")
+        self.assertEqual(txt.get('1980/x.xml', 'year', '9999'), '9999')
+        self.assertEqual(tag.get('1980/a.xml'),
+                         {'year': u'1980', 'txt_lines': u'9', 'sentences': u'2'})
+        self.assertEqual(tag.get('1980/c.xml'), {'sentences': u'1'})
+
+    def test_describe_txt_file(self):
+        fname = os.path.join(self.directory, 'a.xml')
+        with open(fname, 'w') as fh:
+            fh.write(TXT_FILE)
+        self.assertEqual(manifest.describe_txt_file(fname),
+                         {'year': '1980', 'subject': u"Optics \xe9", 'txt_lines': 8,
+                          'sections': 'TITLE:0,DATE:19,SUBJECT:37,ABSTRACT:59'})
+
+    def test_count_sentences_and_tokens(self):
+        lines = ["FH_TITLE:\n", "A_DT camera_NN\n", "\n", "The_DT lens_NN ._.\n"]
+        self.assertEqual(manifest.count_sentences_and_tokens_in_lines(lines), (2, 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for utils.misc."""
+
+import os, sys, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import misc
+
+
+class SectionSelectorTest(unittest.TestCase):
+
+    LINES = ['FH_TITLE:', 'A camera', 'FH_DATE:', '1980', 'FH_ABSTRACT:', 'Abstract',
+             'FH_DESCRIPTION:', 'Description', 'FH_FIRST_CLAIM:', 'Claim', 'END']
+
+    def selected(self, selector):
+        selector.reset()
+        return [line for line in self.LINES if selector.selected(line)]
+
+    def test_selected(self):
+        selector = misc.get_section_selector('TITLE,FH_FIRST_CLAIM')
+        self.assertEqual(self.selected(selector),
+                         ['FH_TITLE:', 'A camera', 'FH_DATE:', '1980',
+                          'FH_FIRST_CLAIM:', 'Claim', 'END'])
+        self.assertEqual(self.selected(selector)[0], 'FH_TITLE:')
+
+    def test_lines_before_first_header(self):
+        selector = misc.get_section_selector('ABSTRACT')
+        selector.reset()
+        self.assertTrue(selector.selected('no header yet'))
+        self.assertFalse(selector.selected('FH_TITLE:'))
+
+    def test_all_sections(self):
+        self.assertEqual(misc.get_section_selector(None), None)
+        self.assertEqual(misc.get_section_selector('all'), None)
+
+    def test_section_name(self):
+        self.assertEqual(misc.section_name('FH_FIRST_CLAIM: \n'), 'FIRST_CLAIM')
+
+
+class CharacterClassesTest(unittest.TestCase):
+
+    def test_counts(self):
+        chars = misc.visible_chars(u" ab 12\t\xe9_\u4e2d\u3000. \n")
+        self.assertEqual(chars, u"ab12\xe9_\u4e2d.")
+        self.assertEqual(misc.count_ascii(chars), 7)
+        self.assertEqual(misc.count_letters(chars), 4)
+
+
+class SpanSplitterTest(unittest.TestCase):
+
+    def test_short_line(self):
+        splitter = misc.SpanSplitter(20)
+        self.assertEqual(splitter.split(u"A short line."), [u"A short line."])
+        self.assertEqual(splitter.counts(),
+                         {'lines': 1, 'split_lines': 0, 'spans': 0, 'skipped_lines': 0})
+
+    def test_split_points(self):
+        splitter = misc.SpanSplitter(20)
+        # sentence end, clause end, whitespace and no boundary at all
+        self.assertEqual(splitter.split(u"One sentence. Another one here."),
+                         [u"One sentence.", u"Another one here."])
+        self.assertEqual(splitter.split(u"One clause, and more, and more words"),
+                         [u"One clause, and", u"more, and more words"])
+        self.assertEqual(splitter.split(u"words without any ends at all"),
+                         [u"words without any", u"ends at all"])
+        self.assertEqual(splitter.split(u"x" * 45), [u"x" * 20, u"x" * 20, u"x" * 5])
+        self.assertEqual(splitter.split_lines, 4)
+        self.assertEqual(splitter.spans, 9)
+
+    def test_full_width_ends(self):
+        splitter = misc.SpanSplitter(10)
+        cn = u"\u4e2d\u6587"
+        self.assertEqual(splitter.split(cn * 3 + u"\u3002" + cn * 2),
+                         [cn * 3 + u"\u3002", cn * 2])
+        # full-width ends in the first half are not used
+        self.assertEqual(splitter.split(cn + u"\u3002" + cn * 5),
+                         [cn + u"\u3002" + cn * 3 + u"\u4e2d", u"\u6587" + cn])
+
+    def test_spans_are_short_enough(self):
+        splitter = misc.SpanSplitter(30)
+        line = u" ".join([u"word%d," % i if i % 7 == 0 else u"word%d" % i for i in range(200)])
+        spans = splitter.split(line)
+        self.assertTrue(all(len(span) <= 30 for span in spans))
+        self.assertEqual(u" ".join(spans), line)
+
+    def test_skipped_lines(self):
+        splitter = misc.SpanSplitter(10, max_line=50)
+        self.assertEqual(splitter.split(u"x" * 51), [])
+        other = misc.SpanSplitter(10)
+        other.add_counts(splitter.counts())
+        self.assertEqual(other.counts(),
+                         {'lines': 1, 'split_lines': 0, 'spans': 0, 'skipped_lines': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+"""Tests for running jobs with utils.parallel."""
+
+import os, sys, time, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import parallel
+
+
+def square(n):
+    if n < 0:
+        raise ValueError("negative number")
+    return n * n
+
+
+def sleep_or_die(n):
+    if n < 0:
+        os._exit(1)
+    time.sleep(n)
+    return n
+
+
+class ScheduleTest(unittest.TestCase):
+
+    def test_list_schedule(self):
+        self.assertEqual(parallel.schedule([5, 1, 9]), [0, 1, 2])
+
+    def test_cost_schedule(self):
+        self.assertEqual(parallel.schedule([5, 1, 9, 5], parallel.SCHEDULE_COST), [2, 0, 3, 1])
+
+    def test_unknown_schedule(self):
+        self.assertRaises(ValueError, parallel.schedule, [1], 'random')
+
+
+class RunJobsTest(unittest.TestCase):
+
+    def check_results(self, results):
+        results = dict(results)
+        self.assertEqual(sorted(results), [0, 1, 2, 3])
+        self.assertEqual([results[i] for i in (0, 1, 3)], [4, 9, 1])
+        self.assertTrue(isinstance(results[2], parallel.JobFailure))
+        self.assertEqual(results[2].reason, parallel.JobFailure.ERROR)
+        self.assertTrue('negative number' in results[2].message)
+
+    def test_one_worker(self):
+        self.check_results(parallel.run_jobs(square, [2, 3, -1, 1]))
+
+    def test_pool(self):
+        self.check_results(parallel.run_jobs(square, [2, 3, -1, 1], workers=2))
+
+    def test_supervised(self):
+        self.check_results(parallel.run_jobs(square, [2, 3, -1, 1], workers=2, timeout=10))
+
+
+class SupervisedJobsTest(unittest.TestCase):
+
+    def test_timeout_and_dead_worker(self):
+        results = dict(parallel.run_jobs(sleep_or_die, [0, 5, -1, 0.1, 0],
+                                         workers=2, timeout=1))
+        self.assertEqual([results[i] for i in (0, 3, 4)], [0, 0.1, 0])
+        self.assertEqual(results[1].reason, parallel.JobFailure.TIMEOUT)
+        self.assertEqual(results[2].reason, parallel.JobFailure.DIED)
+
+
+if __name__ == '__main__':
+    unittest.main()
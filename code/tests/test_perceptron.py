@@ -0,0 +1,74 @@
+"""Tests for the tokenizer and the averaged perceptron tagger."""
+
+import os, sys, shutil, tempfile, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config, perceptron, txt2tag
+
+
+D2_TAG = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                      'data', 'patents', 'corpora', 'sample-us', 'data', 'd2_tag', '01')
+
+
+class TokenizeTest(unittest.TestCase):
+
+    def test_tokenize(self):
+        self.assertEqual(perceptron.tokenize(u'The pump (see Fig. 3) isn\'t "new", e.g. in the U.S.'),
+                         [u'The', u'pump', u'-LRB-', u'see', u'Fig.', u'3', u'-RRB-', u'is',
+                          u"n't", u'``', u'new', u"''", u',', u'e.g.', u'in', u'the', u'U.S.'])
+
+    def test_glued_periods_and_slashes(self):
+        self.assertEqual(perceptron.tokenize(u"hydrogen.Conventionally and/or 1.5"),
+                         [u'hydrogen', u'.', u'Conventionally', u'and\\/or', u'1.5'])
+
+    def test_split_sentences(self):
+        tokens = perceptron.tokenize(u'It works. "It really does." Fine')
+        self.assertEqual(perceptron.split_sentences(tokens),
+                         [[u'It', u'works', u'.'],
+                          [u'``', u'It', u'really', u'does', u'.', u"''"],
+                          [u'Fine']])
+
+
+class PerceptronTaggerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_train_save_and_tag(self):
+        files = perceptron.find_files([D2_TAG])
+        self.assertTrue(files)
+        sentences = list(perceptron.read_tagged_sentences(files))
+        tagger = perceptron.PerceptronTagger()
+        tagger.train(sentences, iterations=2)
+        correct, total = tagger.evaluate(sentences[:200])
+        self.assertTrue(correct > 0.9 * total)
+        model_file = os.path.join(self.directory, 'model.pickle.gz')
+        tagger.save(model_file)
+        loaded = perceptron.PerceptronTagger(model_file)
+        texts = [u"The pump has a control element. It works.", u""]
+        result = loaded.tag_many(texts)
+        self.assertEqual(result, tagger.tag_many(texts))
+        self.assertEqual(len(result[0]), 2)
+        self.assertEqual(result[1], [])
+        self.assertTrue(result[0][0].startswith(u"The_DT pump_NN"))
+
+    def test_default_model(self):
+        model = getattr(config, 'PERCEPTRON_TAGGER_MODEL', None)
+        try:
+            config.PERCEPTRON_TAGGER_MODEL = os.path.join(self.directory, 'model.pickle.gz')
+            self.assertEqual(txt2tag.perceptron_model(), config.PERCEPTRON_TAGGER_MODEL)
+            # older config files do not have the setting
+            del config.PERCEPTRON_TAGGER_MODEL
+            self.assertEqual(txt2tag.perceptron_model(),
+                             os.path.join(config.RESOURCES, 'perceptron-tagger-en.pickle.gz'))
+        finally:
+            if model is not None:
+                config.PERCEPTRON_TAGGER_MODEL = model
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,326 @@
+"""Tests for the storage and index classes of repository.py."""
+
+import os, sys, glob, gzip, shutil, tempfile, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import repository
+from repository import IdentifierSet, RepositoryIndex
+from utils.path import make_writable
+
+
+class IdentifierSetTest(unittest.TestCase):
+
+    IDENTIFIERS = ['12', '7', '0', '007', 'US4192770A', '12', 'a b', '123456789012345678901']
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.idx_ids = os.path.join(self.directory, 'idx-ids.txt')
+        self.cache = os.path.join(self.directory, 'idx-ids.cache')
+        with open(self.idx_ids, 'w') as fh:
+            for identifier in self.IDENTIFIERS:
+                fh.write("%s\n" % identifier)
+            fh.write("\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check_set(self, identifiers, expected):
+        self.assertEqual(len(identifiers), len(expected))
+        self.assertEqual(sorted(identifiers), sorted(expected))
+        for identifier in expected:
+            self.assertTrue(identifier in identifiers, identifier)
+        for identifier in ('1', '07', 'US', '', '12 '):
+            self.assertFalse(identifier in identifiers, identifier)
+
+    def test_add_from_file(self):
+        identifiers = IdentifierSet()
+        identifiers.add_from_file(self.idx_ids)
+        self.check_set(identifiers, set(self.IDENTIFIERS))
+        self.assertEqual(list(identifiers.numbers), [0, 7, 12])
+
+    def test_add_and_merge(self):
+        identifiers = IdentifierSet()
+        identifiers.MERGE_SIZE = 3
+        for identifier in self.IDENTIFIERS:
+            identifiers.add(identifier)
+        identifiers.add_from_file(self.idx_ids)
+        self.check_set(identifiers, set(self.IDENTIFIERS))
+        identifiers.add('5')
+        identifiers.add('b')
+        identifiers.merge()
+        self.assertEqual(list(identifiers.numbers), [0, 5, 7, 12])
+        self.check_set(identifiers, set(self.IDENTIFIERS + ['5', 'b']))
+
+    def test_cache(self):
+        identifiers = IdentifierSet.load(self.cache, self.idx_ids)
+        identifiers.save(self.cache, os.path.getsize(self.idx_ids))
+        with open(self.idx_ids, 'a') as fh:
+            fh.write("99\nUS1A\n")
+        loaded = IdentifierSet.load(self.cache, self.idx_ids)
+        self.check_set(loaded, set(self.IDENTIFIERS + ['99', 'US1A']))
+
+
+class RepositoryTestCase(unittest.TestCase):
+
+    """Creates an empty patent repository in a temporary directory."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.location = os.path.join(self.directory, 'repo')
+        repository.create_repository(self.location)
+        self.repo = repository.open_repository(self.location)
+
+    def tearDown(self):
+        if self.repo.packs is not None:
+            self.repo.packs.close()
+        if self.repo.index is not None:
+            self.repo.index.close()
+        shutil.rmtree(self.directory)
+
+    def append(self, fname, lines):
+        make_writable(fname)
+        with open(fname, 'a') as fh:
+            for line in lines:
+                fh.write(line + "\n")
+
+    def add_document(self, identifier, path, steps=()):
+        """Add a document with a source and processed files for steps to the
+        index and to the tree, the contents of each file is the identifier
+        followed by the step."""
+        self.repo.load_index()
+        t = '20140101:120000'
+        self.repo.index.add_document(t, identifier)
+        self.repo.index.add_file(t, identifier, 10, path)
+        for step in ('source',) + tuple(steps):
+            if step != 'source':
+                self.repo.index.add_processed(t, identifier, step, 'abc', '')
+            fname = self.repo._tree_path(path, step)
+            if not os.path.isdir(os.path.dirname(fname)):
+                os.makedirs(os.path.dirname(fname))
+            with gzip.open(fname, 'wb') as fh:
+                fh.write("%s %s" % (identifier, step))
+        self.repo.index.commit()
+
+
+class RepositoryIndexTest(RepositoryTestCase):
+
+    def test_import_index_files(self):
+        self.append(self.repo.idx_ids, ['US1A', 'US2A'])
+        self.append(self.repo.idx_files,
+                    ["20140101:120000\tUS1A\t100\t1980/01/US1A.xml",
+                     "20140102:120000\tUS2A\t200\t1981/01/US2A.xml",
+                     "20140103:120000\tUS1A\t110\t1980/02/US1A.xml"])
+        self.append(self.repo._processed_index_file('d2_tag'),
+                    ["20140104:120000\tabc\tUS1A\t--tagger\tstanford"])
+        self.repo.load_index()
+        self.repo.index.import_index_files()
+        index = self.repo.index
+        self.assertEqual(len(index), 2)
+        self.assertTrue('US1A' in index)
+        self.assertFalse('US3A' in index)
+        info = index.get('US1A')
+        self.assertEqual(info['timestamp'], '20140101:120000')
+        self.assertEqual(info['files'], [('20140101:120000', 100, '1980/01/US1A.xml'),
+                                         ('20140103:120000', 110, '1980/02/US1A.xml')])
+        self.assertEqual(info['processed'],
+                         {'d2_tag': ('20140104:120000', 'abc', ['--tagger', 'stanford'])})
+        self.assertEqual(index.get('US3A'), None)
+        self.assertEqual(index.source_path('US1A'), '1980/02/US1A.xml')
+        self.assertEqual(index.source_paths(['US1A', 'US2A', 'US3A']),
+                         {'US1A': '1980/02/US1A.xml', 'US2A': '1981/01/US2A.xml'})
+        self.assertEqual(index.file_statistics(), (3, 410))
+        self.assertEqual(index.processed_counts(), [('d2_tag', 1)])
+
+    def test_reopen(self):
+        self.add_document('US1A', '1980/01/US1A.xml', ['d1_txt'])
+        self.repo.index.close()
+        self.repo.index = index = RepositoryIndex(self.repo)
+        self.assertTrue('US1A' in index)
+        self.assertEqual(self.repo.get('US1A', 'd2_seg'), None)
+        self.assertEqual(self.repo.get('US1A', 'd1_txt'), ('20140101:120000', 'abc', []))
+        self.assertEqual(list(index.stored_files()),
+                         [('US1A', 'd1_txt', '1980/01/US1A.xml'),
+                          ('US1A', 'source', '1980/01/US1A.xml')])
+
+
+class AddCorporaTest(RepositoryTestCase):
+
+    PATENTS = ['US4192770A', 'US4236596A', 'US4246708A']
+
+    def make_corpus(self, name, patents, processed=(), broken=()):
+        """Create a corpus with sources for patents and d1_txt files for the
+        patents in processed, the file list also has a missing source. The
+        d1_txt file of a patent in broken is a directory, so it cannot be
+        copied."""
+        corpus = os.path.join(self.directory, name)
+        sources = os.path.join(self.directory, 'sources')
+        lines = []
+        for patent in patents + ['US9999999A']:
+            local = "1980/%s.xml" % patent
+            source = os.path.join(sources, local)
+            lines.append("1980\t%s\t%s\n" % (source, local))
+            if patent == 'US9999999A':
+                continue
+            if not os.path.isdir(os.path.dirname(source)):
+                os.makedirs(os.path.dirname(source))
+            with open(source, 'w') as fh:
+                fh.write("<patent>%s</patent>\n" % patent)
+            if patent in broken:
+                os.makedirs(os.path.join(corpus, 'data', 'd1_txt', '01', 'files', local))
+            if patent in processed:
+                fname = os.path.join(corpus, 'data', 'd1_txt', '01', 'files', local)
+                if not os.path.isdir(os.path.dirname(fname)):
+                    os.makedirs(os.path.dirname(fname))
+                with open(fname, 'w') as fh:
+                    fh.write("text of %s\n" % patent)
+        os.makedirs(os.path.join(corpus, 'config'))
+        with open(os.path.join(corpus, 'config', 'files.txt'), 'w') as fh:
+            fh.writelines(lines)
+        return corpus
+
+    def test_add_corpora(self):
+        corpus1 = self.make_corpus('corpus1', self.PATENTS[:2], processed=['US4192770A'])
+        corpus2 = self.make_corpus('corpus2', self.PATENTS, processed=['US4246708A'])
+        self.repo.add_corpora([corpus1, corpus2], workers=2)
+        index = self.repo.index
+        self.assertEqual(len(index), 3)
+        self.assertEqual(sorted(open(self.repo.idx_ids).read().split()),
+                         ['4192770', '4236596', '4246708'])
+        self.assertEqual(len(open(self.repo.idx_files).readlines()), 3)
+        self.assertEqual(index.processed_counts(), [('d1_txt', 2)])
+        self.assertEqual(sorted(self.repo.get('4192770')['processed']), ['d1_txt'])
+        self.assertEqual(self.repo.get('4236596')['processed'], {})
+        fh = self.repo.open_document('4246708', 'd1_txt')
+        self.assertEqual(fh.read(), "text of US4246708A\n")
+        fh = self.repo.open_document('4192770')
+        self.assertEqual(fh.read(), "<patent>US4192770A</patent>\n")
+        # patents that are in the repository are not added again
+        self.repo.add_corpus(corpus2, workers=2)
+        self.assertEqual(len(index), 3)
+        self.assertEqual(len(open(self.repo.idx_files).readlines()), 3)
+        self.assertEqual(len(IdentifierSet.load(self.repo.idx_ids_cache, self.repo.idx_ids)), 3)
+
+    def copies(self, patent):
+        sources = os.path.join(self.repo.data_dir, '*', '*', patent + '*')
+        processed = os.path.join(self.repo.proc_dir, '*', '*', '*', patent + '*')
+        return glob.glob(sources) + glob.glob(processed)
+
+    def test_failed_copy(self):
+        corpus = self.make_corpus('corpus', self.PATENTS, processed=['US4192770A'],
+                                  broken=['US4236596A'])
+        for workers in (1, 2):
+            self.repo.add_corpus(corpus, workers=workers)
+            self.assertEqual(sorted(open(self.repo.idx_ids).read().split()),
+                             ['4192770', '4246708'])
+            self.assertFalse('4236596' in self.repo.index)
+            # the files of the failed patent are removed, the files of the
+            # others are in the source tree and the d1_txt tree
+            self.assertEqual(self.copies('US4236596A'), [])
+            self.assertEqual(len(self.copies('US4192770A')), 2)
+        logs = glob.glob(os.path.join(self.repo.log_dir, 'add-corpus-*.txt'))
+        self.assertTrue('Traceback' in open(sorted(logs)[0]).read())
+
+
+class PackStoreTest(RepositoryTestCase):
+
+    def setUp(self):
+        RepositoryTestCase.setUp(self)
+        self.add_document('1', '1980/01/1.xml', ['d1_txt'])
+        self.add_document('2', '1980/02/2.xml')
+
+    def check_documents(self):
+        for identifier, step in (('1', 'source'), ('1', 'd1_txt'), ('2', 'source')):
+            self.assertEqual(self.repo.open_document(identifier, step).read(),
+                             "%s %s" % (identifier, step))
+        self.assertEqual(self.repo.open_document('2', 'd1_txt'), None)
+
+    def test_pack(self):
+        self.repo.pack()
+        packs = self.repo.packs
+        self.assertEqual(packs.segments(), [0])
+        self.assertEqual(packs.read('2', 'd1_txt'), None)
+        fh = packs.open('1', 'd1_txt')
+        self.assertEqual(fh.read(), "1 d1_txt")
+        self.assertTrue(os.path.exists(self.repo.tree_path('1')))
+        self.check_documents()
+        self.assertEqual([(step, count) for step, count, size in self.repo.index.packed_counts()],
+                         [('d1_txt', 1), ('source', 2)])
+
+    def test_pack_and_remove(self):
+        self.repo.pack()
+        location = self.repo.index.get_packed('1', 'source')
+        # files that are packed already are not added again
+        self.repo.pack(remove=True)
+        self.assertEqual(self.repo.index.get_packed('1', 'source'), location)
+        self.assertFalse(os.path.exists(self.repo.tree_path('1')))
+        self.assertFalse(os.path.exists(self.repo.tree_path('1', 'd1_txt')))
+        self.check_documents()
+
+    def test_rebuild_index(self):
+        self.repo.pack(remove=True)
+        locations = [self.repo.index.get_packed('1', 'source'),
+                     self.repo.index.get_packed('1', 'd1_txt')]
+        self.repo.index.clear_packed()
+        self.repo.index.commit()
+        self.assertEqual(self.repo.index.get_packed('1', 'source'), None)
+        self.repo.packs.rebuild_index()
+        self.assertEqual([self.repo.index.get_packed('1', 'source'),
+                          self.repo.index.get_packed('1', 'd1_txt')], locations)
+        self.check_documents()
+
+    def test_segments(self):
+        original = repository.PACK_SEGMENT_SIZE
+        repository.PACK_SEGMENT_SIZE = 10
+        try:
+            self.repo.pack()
+        finally:
+            repository.PACK_SEGMENT_SIZE = original
+        self.assertEqual(self.repo.packs.segments(), [0, 1, 2])
+        self.repo.packs.rebuild_index()
+        self.check_documents()
+
+
+class GetDocumentsTest(RepositoryTestCase):
+
+    def setUp(self):
+        RepositoryTestCase.setUp(self)
+        for i in range(20):
+            self.add_document(str(i), "1980/%02d/%d.xml" % (i, i), ['d1_txt'] if i % 3 else [])
+        # pack the first half, leave the second half in the tree
+        self.repo.load_packs()
+        for i in range(10):
+            for step in ('source', 'd1_txt'):
+                fname = self.repo.tree_path(str(i), step)
+                if os.path.exists(fname):
+                    self.repo.packs.add(str(i), step, open(fname, 'rb').read())
+                    os.remove(fname)
+        self.repo.index.commit()
+        self.original = repository.LOOKUP_BATCH_SIZE
+        repository.LOOKUP_BATCH_SIZE = 3
+
+    def tearDown(self):
+        repository.LOOKUP_BATCH_SIZE = self.original
+        RepositoryTestCase.tearDown(self)
+
+    def test_order(self):
+        identifiers = ['19', '3', 'x', '0', '12', '0', '7', '15', 'y', '4', '11']
+        documents = self.repo.get_documents(identifiers, contents=True, threads=4, ahead=2)
+        self.assertEqual(list(documents),
+                         [(i, "%s source" % i) for i in identifiers if i not in ('x', 'y')])
+
+    def test_step(self):
+        identifiers = [str(i) for i in range(19, -1, -1)]
+        documents = self.repo.get_documents(iter(identifiers), step='d1_txt')
+        self.assertEqual([(i, fh.read()) for i, fh in documents],
+                         [(i, "%s d1_txt" % i) for i in identifiers if int(i) % 3])
+
+    def test_close(self):
+        documents = self.repo.get_documents([str(i) for i in range(20)], ahead=4)
+        self.assertEqual(documents.next()[0], '0')
+        documents.close()
+        self.assertEqual(list(self.repo.get_documents([])), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
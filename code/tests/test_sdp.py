@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for the framing of tagger requests in sdp."""
+
+import os, sys, gzip, shutil, tempfile, unittest, Queue
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config, sdp, txt2tag
+
+
+def responses_for(output):
+    """Run read_responses() on the output of a tagger and return the list of
+    pairs it put on the queue."""
+    responses = Queue.Queue()
+    sdp.read_responses(StringIO(output.encode('utf-8')), responses)
+    result = []
+    while not responses.empty():
+        result.append(responses.get())
+    return result
+
+
+class ReadResponsesTest(unittest.TestCase):
+
+    def test_terminator_on_own_line(self):
+        output = u"The_DT cat_NN ._.\n~__SYM 0_CD\nA_DT dog_NN\n~__SYM 1_CD\n"
+        self.assertEqual(responses_for(output),
+                         [(0, [u"The_DT cat_NN ._."]), (1, [u"A_DT dog_NN"]), (None, None)])
+
+    def test_terminator_inside_line(self):
+        output = u"The_DT cat_NN ~__SYM 12_CD\n~__SYM 13_CD\n"
+        self.assertEqual(responses_for(output),
+                         [(13, [u"The_DT cat_NN ~__SYM 12_CD"]), (None, None)])
+
+    def test_tag_separators(self):
+        output = u"x/NN\n~_/SYM 4/CD\ny_NN\n~_SYM __SYM 5_CD\n"
+        self.assertEqual(responses_for(output),
+                         [(4, [u"x/NN"]), (5, [u"y_NN"]), (None, None)])
+
+    def test_empty_text_and_blank_lines(self):
+        output = u"~__SYM 3_CD\n\nx_NN\n\n~__SYM 4_CD\n"
+        self.assertEqual(responses_for(output),
+                         [(3, []), (4, [u"x_NN"]), (None, None)])
+
+    def test_non_ascii_and_tilde_in_text(self):
+        output = u"caf\xe9_NN ~_SYM 5_CD ok_JJ\n~__SYM 6_CD\n"
+        self.assertEqual(responses_for(output),
+                         [(6, [u"caf\xe9_NN ~_SYM 5_CD ok_JJ"]), (None, None)])
+
+    def test_output_without_terminator(self):
+        self.assertEqual(responses_for(u"The_DT cat_NN\n"), [(None, None)])
+
+
+# A stand-in for the tagger reading from stdin. Like the real tagger, it handles
+# each line on its own, splits off punctuation and splits sentences after
+# sentence-final punctuation, and writes one line for each sentence, with every
+# token tagged with _X.
+FAKE_TAGGER = """
+import sys, re
+for line in iter(sys.stdin.readline, ''):
+    sentence = []
+    for token in re.findall(r'[^\\s.?!]+|[.?!]', line.decode('utf-8')):
+        sentence.append(token + '_X')
+        if token in ('.', '?', '!'):
+            print ' '.join(sentence).encode('utf-8')
+            sentence = []
+    if sentence:
+        print ' '.join(sentence).encode('utf-8')
+    sys.stdout.flush()
+"""
+
+SAMPLE_TXT = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    'data', 'patents', 'corpora', 'sample-us', 'data', 'd1_txt', '01', 'files',
+    '1980', 'US4192770A.xml.gz')
+
+
+class FakeTaggerTestCase(unittest.TestCase):
+
+    """Replaces the Stanford tagger with a script."""
+
+    SCRIPT = FAKE_TAGGER
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.script = os.path.join(self.directory, 'tagger.py')
+        with open(self.script, 'w') as fh:
+            fh.write(self.SCRIPT)
+        self.tagger_command = sdp.tagger_command
+        sdp.tagger_command = lambda model: "exec %s %s" % (sys.executable, self.script)
+
+    def tearDown(self):
+        sdp.tagger_command = self.tagger_command
+        shutil.rmtree(self.directory)
+
+
+# A stand-in for the tagger that dies on a line with the token "die" and hangs
+# on a line with "hang", but only the first time, and that always dies on a
+# line with "DIE".
+FLAKY_TAGGER = """
+import os, sys, time
+directory = os.path.dirname(os.path.abspath(__file__))
+def first_time(name):
+    marker = os.path.join(directory, name)
+    if os.path.exists(marker):
+        return False
+    open(marker, 'w').close()
+    return True
+for line in iter(sys.stdin.readline, ''):
+    tokens = line.split()
+    if 'DIE' in tokens or ('die' in tokens and first_time('died')):
+        sys.exit(1)
+    if 'hang' in tokens and first_time('hung'):
+        time.sleep(60)
+    if tokens:
+        print ' '.join(token + '_X' for token in tokens)
+    sys.stdout.flush()
+"""
+
+# A stand-in for the tagger that never answers.
+SILENT_TAGGER = """
+import sys, time
+sys.stdin.read()
+time.sleep(60)
+"""
+
+
+class TaggerTest(FakeTaggerTestCase):
+
+    SCRIPT = FLAKY_TAGGER
+
+    def tag_many(self, texts, **kwargs):
+        tagger = sdp.Tagger('model', **kwargs)
+        try:
+            return tagger.tag_many(texts), tagger.restarts
+        finally:
+            tagger.stop()
+
+    def expected(self, texts):
+        return [[u" ".join(token + u"_X" for token in text.split())] for text in texts]
+
+    def test_tag_many(self):
+        texts = [u"text %d" % i for i in range(20)]
+        self.assertEqual(self.tag_many(texts, window=4), (self.expected(texts), 0))
+        tagger = sdp.Tagger('model')
+        try:
+            self.assertEqual(tagger.tag(u"one . two"), [u"one_X ._X two_X"])
+        finally:
+            tagger.stop()
+
+    def test_tagger_dies(self):
+        texts = [u"text %d" % i for i in range(10)]
+        texts[5] = u"die here"
+        self.assertEqual(self.tag_many(texts, window=4), (self.expected(texts), 1))
+
+    def test_tagger_hangs(self):
+        texts = [u"text %d" % i for i in range(10)]
+        texts[2] = u"hang here"
+        self.assertEqual(self.tag_many(texts, timeout=1, window=4), (self.expected(texts), 1))
+
+    def test_give_up(self):
+        texts = [u"text %d" % i for i in range(10)]
+        texts[3] = u"DIE here"
+        expected = self.expected(texts)
+        expected[3] = None
+        self.assertEqual(self.tag_many(texts, max_restarts=2, window=4), (expected, 3))
+
+    def test_tagger_never_answers(self):
+        with open(self.script, 'w') as fh:
+            fh.write(SILENT_TAGGER)
+        tagger = sdp.Tagger('model', timeout=0.5, max_restarts=1)
+        try:
+            self.assertRaises(sdp.TaggerError, tagger.tag, u"text")
+            self.assertEqual(tagger.restarts, 2)
+        finally:
+            tagger.stop()
+
+
+class BatchTaggerTest(FakeTaggerTestCase):
+
+    def test_tag_many(self):
+        tagger = sdp.BatchTagger('model', workspace=self.directory)
+        texts = [u"The cat sat . It slept .", u"One line\nTwo lines .", u"", u"caf\xe9 7"]
+        self.assertEqual(tagger.tag_many(texts),
+                         [[u"The_X cat_X sat_X ._X", u"It_X slept_X ._X"],
+                          [u"One_X line_X", u"Two_X lines_X ._X"],
+                          [],
+                          [u"caf\xe9_X 7_X"]])
+        self.assertEqual(os.listdir(self.directory), ['tagger.py'])
+
+    def test_processes(self):
+        texts = [u"text %d . and more" % i for i in range(7)]
+        expected = [[u"text_X %d_X ._X" % i, u"and_X more_X"] for i in range(7)]
+        for threads in (1, 3, 7, 10):
+            tagger = sdp.BatchTagger('model', threads, workspace=self.directory)
+            self.assertEqual(tagger.tag_many(texts), expected)
+        self.assertEqual(tagger.tag_many([]), [])
+
+    def test_failing_tagger(self):
+        sdp.tagger_command = lambda model: "exit 1"
+        tagger = sdp.BatchTagger('model', 2, workspace=self.directory)
+        self.assertRaises(sdp.TaggerError, tagger.tag_many, [u"text", u"more text"])
+
+
+class BackendsTest(FakeTaggerTestCase):
+
+    """The stanford and stanford-batch backends write the same tagged file."""
+
+    def tag_sample(self, backend):
+        input_file = os.path.join(self.directory, 'input.txt')
+        with open(input_file, 'w') as fh:
+            fh.write(gzip.open(SAMPLE_TXT).read())
+        output_file = os.path.join(self.directory, backend + '.txt')
+        tagger = txt2tag.Tagger('en', backend=backend, threads=2, workspace=self.directory)
+        if backend == txt2tag.STANFORD:
+            tagger.tag(input_file, output_file)
+            tagger.tagger.stop()
+        else:
+            tagger.tag_files([(input_file, output_file)])
+        return open(output_file).read()
+
+    def test_same_output(self):
+        tagged = self.tag_sample(txt2tag.STANFORD)
+        # paragraphs are split into sentences, so there are more lines than in
+        # the input
+        self.assertTrue(tagged.count("\n") > 50)
+        self.assertEqual(self.tag_sample(txt2tag.STANFORD_BATCH), tagged)
+
+
+TAGGER_JAR = os.path.join(getattr(config, 'STANFORD_TAGGER_DIR', ''), 'stanford-postagger.jar')
+
+
+@unittest.skipUnless(os.path.exists(TAGGER_JAR), "the Stanford tagger is not installed")
+class StanfordBackendsTest(BackendsTest):
+
+    """Same as BackendsTest, but with the Stanford tagger."""
+
+    def setUp(self):
+        BackendsTest.setUp(self)
+        sdp.tagger_command = self.tagger_command
+
+    def test_terminator(self):
+        tagger = sdp.Tagger(txt2tag.STANFORD_MODELS['en'], timeout=60)
+        try:
+            results = tagger.tag_many([u"One line", u"Two . Sentences ."])
+            self.assertEqual([[len(sentence.split()) for sentence in result] for result in results],
+                             [[2], [2, 2]])
+        finally:
+            tagger.stop()
+
+
+class ReadFramesTest(unittest.TestCase):
+
+    def test_frames(self):
+        output = u"\u4e2d \u6587\n\nabc\nSEGMENTER FRAME 0\n\n\nSEGMENTERFRAME1\n"
+        responses = Queue.Queue()
+        sdp.read_frames(StringIO(output.encode('utf-8')), responses)
+        self.assertEqual([responses.get() for _ in range(3)],
+                         [(0, [u"\u4e2d \u6587", u"abc"]), (1, []), (None, None)])
+
+
+# A stand-in for the segmenter that puts a space between all characters of a
+# line and that splits lines at a vertical bar, flushing after each line.
+FAKE_SEGMENTER = """
+import sys
+for line in iter(sys.stdin.readline, ''):
+    line = line.decode('utf-8').rstrip('\\n')
+    for part in line.split('|'):
+        sys.stdout.write(' '.join(part).encode('utf-8') + '\\n')
+    sys.stdout.flush()
+"""
+
+
+class SegmenterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        script = os.path.join(self.directory, 'segmenter.py')
+        with open(script, 'w') as fh:
+            fh.write(FAKE_SEGMENTER)
+        self.segmenter_command = sdp.Segmenter.segmenter_command
+        sdp.Segmenter.segmenter_command = lambda self: "exec %s %s" % (sys.executable, script)
+
+    def tearDown(self):
+        sdp.Segmenter.segmenter_command = self.segmenter_command
+        shutil.rmtree(self.directory)
+
+    def test_seg_many(self):
+        segmenter = sdp.Segmenter(timeout=10)
+        try:
+            self.assertEqual(segmenter.seg(u"\u4e2d\u6587 "), u"\u4e2d \u6587\n")
+            self.assertEqual(segmenter.seg_many([u"ab", u"", u"c|d", u"e"]),
+                             [u"a b", u"", u"c d", u"e"])
+            frames = [segmenter.send_many([u"ab"]), segmenter.send_many([u"cd"])]
+            self.assertEqual(segmenter.receive_many(frames[1], [u"cd"]), [u"c d"])
+            self.assertEqual(segmenter.receive_many(frames[0], [u"ab"]), [u"a b"])
+        finally:
+            segmenter.stop()
+
+    def test_restart(self):
+        segmenter = sdp.Segmenter(timeout=10)
+        try:
+            frame_id = segmenter.send_many([u"ab"])
+            segmenter.proc.kill()
+            self.assertEqual(segmenter.receive_many(frame_id, [u"ab"]), [u"a b"])
+        finally:
+            segmenter.stop()
+
+    def test_pool(self):
+        pool = sdp.SegmenterPool(3, timeout=10)
+        try:
+            sentences = [u"s%d" % i for i in range(10)]
+            self.assertEqual(pool.seg_many(sentences), [u"s %d" % i for i in range(10)])
+            self.assertEqual(pool.seg_many([u"x"]), [u"x"])
+            self.assertEqual(pool.seg_many([]), [])
+        finally:
+            pool.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+"""Tests for creating d3_feats files with tag2chunk, using a tagged file from the
+sample corpus."""
+
+import os, sys, shutil, tempfile, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tag2chunk
+from utils.path import open_input_file, open_output_file
+
+
+TAG_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                        'data', 'patents', 'corpora', 'sample-us', 'data', 'd2_tag', '01',
+                        'files', '1980', 'US4192770A.xml')
+
+
+def read_lines(fname):
+    fh = open_input_file(fname)
+    lines = fh.readlines()
+    fh.close()
+    return lines
+
+
+class Tag2ChunkTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def output(self, name):
+        return os.path.join(self.directory, name)
+
+    def chunk(self, name, chunker_rules='en', **kwargs):
+        """Chunk the tagged file and return the lines written to the output."""
+        tag2chunk.Doc(TAG_FILE, self.output(name), '1980', 'en',
+                      chunker_rules=chunker_rules, **kwargs)
+        return read_lines(self.output(name))
+
+
+class MultipleRuleSetsTest(Tag2ChunkTestCase):
+
+    def test_same_output_as_separate_runs(self):
+        expected = [self.chunk('en'), self.chunk('en_w_of', 'en_w_of')]
+        self.assertNotEqual(expected[0], expected[1])
+        tag2chunk.Doc(TAG_FILE, [self.output('both-en'), self.output('both-en_w_of')],
+                      '1980', 'en', chunker_rules=['en', 'en_w_of'])
+        self.assertEqual(read_lines(self.output('both-en')), expected[0])
+        self.assertEqual(read_lines(self.output('both-en_w_of')), expected[1])
+
+
+class AugmentedDocTest(Tag2ChunkTestCase):
+
+    def test_merge_features(self):
+        self.assertEqual(tag2chunk.merge_features(['b=1', 'a=1', 'c=1'], ['b=2', 'd=2']),
+                         ['a=1', 'b=2', 'c=1', 'd=2'])
+
+    def test_add_features(self):
+        expected = self.chunk('expected')
+        fh = open_output_file(self.output('augmented'))
+        for line in expected:
+            fh.write(u"\t".join([f for f in line.split(u"\t") if not f.startswith('suffix3=')]))
+        fh.close()
+        self.assertNotEqual(read_lines(self.output('augmented')), expected)
+        methods = tag2chunk.select_feature_methods('en', ['suffix3'])
+        doc = tag2chunk.AugmentedDoc(TAG_FILE, self.output('augmented'), 'en', 'en', methods)
+        self.assertEqual(doc.augmented, len(expected))
+        self.assertEqual(read_lines(self.output('augmented')), expected)
+
+
+class SentenceCacheTest(Tag2ChunkTestCase):
+
+    def test_least_recently_used(self):
+        cache = tag2chunk.SentenceCache(2)
+        cache.put('a', [1])
+        cache.put('b', [2])
+        self.assertEqual(cache.get('a'), [1])
+        cache.put('c', [3])
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), [1])
+        self.assertEqual(cache.get('c'), [3])
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+        self.assertEqual(cache.hit_rate(), 0.75)
+
+    def test_keys(self):
+        key = tag2chunk.SentenceCache.key
+        self.assertEqual(key(u"a_DT", 'en', 'en'), key(u"a_DT", 'en', 'en'))
+        self.assertNotEqual(key(u"a_DT", 'en', 'en'), key(u"a_DT", 'en_w_of', 'en'))
+
+    def test_same_output_as_without_cache(self):
+        expected = self.chunk('expected')
+        cache = tag2chunk.SentenceCache(1000)
+        self.assertEqual(self.chunk('first', cache=cache), expected)
+        self.assertEqual(self.chunk('second', cache=cache), expected)
+        self.assertTrue(cache.hits > 0)
+
+
+class CandidateFilterTest(Tag2ChunkTestCase):
+
+    def chunk_for(self, phrase):
+        return tag2chunk.CachedChunk(0, 0, phrase, phrase.lower().split(), [])
+
+    def test_rules(self):
+        candidate_filter = tag2chunk.CandidateFilter(
+            title_filter=True, stoplist=set(['present invention']), min_length=2, max_length=3)
+        title_nouns = set(['camera'])
+        for phrase, section, rule in (
+                (u"Present Invention", "DESCRIPTION", 'stoplist'),
+                (u"camera", "DESCRIPTION", 'min_length'),
+                (u"lens of the camera", "DESCRIPTION", 'max_length'),
+                (u"optical lens", "DESCRIPTION", 'title'),
+                (u"optical lens", "TITLE", None),
+                (u"digital camera", "DESCRIPTION", None)):
+            self.assertEqual(candidate_filter.rejecting_rule(
+                self.chunk_for(phrase), section, title_nouns), rule)
+            candidate_filter.accept(self.chunk_for(phrase), section, title_nouns)
+        self.assertEqual(candidate_filter.counts(),
+                         {'accepted': 2, 'stoplist': 1, 'min_length': 1,
+                          'max_length': 1, 'title': 1})
+        copy = candidate_filter.copy()
+        self.assertEqual(copy.accepted, 0)
+        copy.add_counts(candidate_filter.counts())
+        self.assertEqual(copy.counts(), candidate_filter.counts())
+
+    def test_inactive_filter(self):
+        candidate_filter = tag2chunk.CandidateFilter()
+        self.assertFalse(candidate_filter.is_active())
+        self.assertEqual(self.chunk('unfiltered', filter_p=False),
+                         self.chunk('inactive', candidate_filter=candidate_filter))
+
+    def test_read_stoplist(self):
+        fname = self.output('stoplist.txt')
+        with open(fname, 'w') as fh:
+            fh.write("# terms\nPresent Invention\n\n  method \n")
+        self.assertEqual(tag2chunk.read_stoplist(fname), set(['present invention', 'method']))
+
+    def test_stoplist(self):
+        lines = self.chunk('all', filter_p=False)
+        term = lines[0].split(u"\t")[2]
+        candidate_filter = tag2chunk.CandidateFilter(stoplist=set([term]))
+        filtered = self.chunk('filtered', candidate_filter=candidate_filter)
+        self.assertEqual([line for line in lines if line.split(u"\t")[2] != term],
+                         [line for line in filtered])
+        self.assertEqual(candidate_filter.rejected['stoplist'], len(lines) - len(filtered))
+
+    def test_counts_with_several_rule_sets(self):
+        candidate_filter = tag2chunk.CandidateFilter(title_filter=True)
+        self.chunk('single', candidate_filter=candidate_filter)
+        expected = candidate_filter.counts()
+        self.assertTrue(expected['accepted'] > 0 and expected['title'] > 0)
+        for cache in (None, tag2chunk.SentenceCache(1000)):
+            candidate_filter.reset_counts()
+            tag2chunk.Doc(TAG_FILE, [self.output('en'), self.output('en_w_of')], '1980', 'en',
+                          chunker_rules=['en', 'en_w_of'], candidate_filter=candidate_filter,
+                          cache=cache)
+            self.assertEqual(candidate_filter.counts(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
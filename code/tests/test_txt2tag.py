@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for the garbage detector in txt2tag."""
+
+import os, sys, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from txt2tag import GarbageDetector
+
+
+SENTENCE = u"The invention relates to a digital camera with an improved lens system."
+NUMBERS = u"12.5 13.7 14.2 15.9 16.1 17.3 18.8 19.0 20.4 21.6 22.2 23.9 24.5 25.1"
+SEQUENCE = u"seq acgtacgtacgt ggcattacgatc ttgacgatcagt ccgatgacgatg aattcgatcgat"
+
+
+class GarbageDetectorTest(unittest.TestCase):
+
+    def test_flagging_rule(self):
+        detector = GarbageDetector()
+        self.assertEqual(detector.flagging_rule(SENTENCE), None)
+        self.assertEqual(detector.flagging_rule(NUMBERS), 'letters')
+        self.assertEqual(detector.flagging_rule(SEQUENCE), 'words')
+        self.assertEqual(detector.flagging_rule(u"1 2 3"), None)
+        self.assertEqual(detector.counts()['lines'], 0)
+
+    def test_counts(self):
+        detector = GarbageDetector()
+        self.assertEqual(detector.check(NUMBERS), 'letters')
+        self.assertFalse(detector.is_garbage(SENTENCE))
+        self.assertTrue(detector.is_garbage(SEQUENCE))
+        self.assertEqual(detector.counts(),
+                         {'lines': 3, 'garbage_lines': 2,
+                          'garbage_chars': len(NUMBERS) + len(SEQUENCE),
+                          'flagged': {'letters': 1, 'words': 1}})
+        other = GarbageDetector()
+        other.add_counts(detector.counts())
+        self.assertEqual(other.counts(), detector.counts())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+"""Tests for iterating over views with FileChecker and RepositoryIterator."""
+
+import os, sys, glob, gzip, json, shutil, tempfile, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import repository, view
+
+
+class ViewTestCase(unittest.TestCase):
+
+    """Creates a repository with sources for two of the three identifiers in the
+    view and a tagged file for one of them."""
+
+    PATHS = [('4192770', '41927/US4192770A.xml'),
+             ('4192771', '41927/US4192771A.xml'),
+             ('5000001', '50000/US5000001A.xml')]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.repository = os.path.join(self.directory, 'repository')
+        repository.create_repository(self.repository)
+        self.view_dir = os.path.join(self.directory, 'view')
+        view.create_view(self.view_dir, self.repository)
+        self.view = view.View(self.view_dir)
+        with open(self.view.filelist_file, 'w') as fh:
+            for identifier, path in self.PATHS:
+                fh.write("%s\t%s\n" % (identifier, path))
+        self.add_file('data/sources', self.PATHS[0][1])
+        self.add_file('data/sources', self.PATHS[1][1])
+        self.add_file('data/processed/d2_tag', self.PATHS[1][1])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def add_file(self, data_dir, path):
+        fname = self.repository_file(data_dir, path)
+        if not os.path.exists(os.path.dirname(fname)):
+            os.makedirs(os.path.dirname(fname))
+        open(fname, 'w').close()
+
+    def repository_file(self, data_dir, path):
+        return os.path.join(self.view.repository.dir, data_dir, path + '.gz')
+
+
+class FileCheckerTest(ViewTestCase):
+
+    def test_exist(self):
+        checker = view.FileChecker(threads=4)
+        fnames = [self.repository_file('data/sources', path) for _, path in self.PATHS]
+        fnames.append(os.path.join(self.directory, 'missing', 'file.gz'))
+        self.assertEqual(checker.exist(fnames), [True, True, False, False])
+        self.assertEqual(checker.sizes(fnames), [0, 0, None, None])
+        checker.close()
+        self.assertTrue(checker.pool is None)
+
+
+class RepositoryIteratorTest(ViewTestCase):
+
+    def test_sources(self):
+        self.assertEqual(list(self.view.sources()),
+                         [self.repository_file('data/sources', self.PATHS[0][1]),
+                          self.repository_file('data/sources', self.PATHS[1][1]),
+                          None])
+
+    def test_small_batches(self):
+        iterator = view.RepositoryIterator(self.view, 'd2_tag', batch_size=2)
+        self.assertEqual(list(iterator),
+                         [None, self.repository_file('data/processed/d2_tag', self.PATHS[1][1]), None])
+
+    def test_checker_is_closed(self):
+        iterator = self.view.sources()
+        iterator.checker.threads = 2
+        list(iterator)
+        self.assertTrue(iterator.checker.pool is None)
+        shared = view.FileChecker(threads=2)
+        iterator = view.RepositoryIterator(self.view, checker=shared)
+        list(iterator)
+        self.assertTrue(shared.pool is not None)
+        shared.close()
+
+    def test_reset_sees_new_files(self):
+        iterator = self.view.d2_tag()
+        self.assertEqual(list(iterator)[0], None)
+        self.add_file('data/processed/d2_tag', self.PATHS[0][1])
+        iterator.reset()
+        self.assertEqual(list(iterator)[0],
+                         self.repository_file('data/processed/d2_tag', self.PATHS[0][1]))
+
+
+class ViewAnalyzerTest(ViewTestCase):
+
+    def setUp(self):
+        ViewTestCase.setUp(self)
+        fname = self.repository_file('data/sources', self.PATHS[0][1])
+        fh = gzip.open(fname, 'wb')
+        fh.write("<patent/>\n" * 100)
+        fh.close()
+        # the other files are cut off in the middle of the compressed data
+        data = open(fname, 'rb').read()
+        for data_dir in ('data/sources', 'data/processed/d2_tag'):
+            with open(self.repository_file(data_dir, self.PATHS[1][1]), 'wb') as fh:
+                fh.write(data[:len(data) / 2])
+        self.size = os.path.getsize(self.repository_file('data/sources', self.PATHS[0][1]))
+
+    def test_report(self):
+        report = view.ViewAnalyzer(self.view, threads=2, batch_size=2).analyze()
+        self.assertEqual(report['identifiers'], 3)
+        self.assertFalse(report['check_gzip'])
+        sources = report['steps']['sources']
+        self.assertEqual(sources['files'], 2)
+        self.assertEqual(sources['size'], self.size + self.size / 2)
+        self.assertEqual(sources['missing'], ['5000001'])
+        self.assertAlmostEqual(sources['coverage'], 200.0 / 3)
+        self.assertFalse('broken' in sources)
+        d2_tag = report['steps']['d2_tag']
+        self.assertEqual((d2_tag['files'], d2_tag['missing']), (1, ['4192770', '5000001']))
+        d1_txt = report['steps']['d1_txt']
+        self.assertEqual((d1_txt['files'], d1_txt['coverage']), (0, 0.0))
+
+    def test_check_gzip(self):
+        report = view.ViewAnalyzer(self.view, check_gzip=True, threads=2).analyze()
+        self.assertEqual(report['steps']['sources']['broken'], ['4192771'])
+        self.assertEqual(report['steps']['d2_tag']['broken'], ['4192771'])
+        self.assertEqual(report['steps']['d3_phr_feats']['broken'], [])
+
+    def test_json_report(self):
+        self.view.analyze(check_gzip=True, threads=2)
+        reports = glob.glob(os.path.join(self.view_dir, 'info', 'report-*.json'))
+        self.assertEqual(len(reports), 1)
+        report = json.load(open(reports[0]))
+        self.assertEqual(report['steps']['sources']['missing'], ['5000001'])
+        self.assertEqual(report['steps']['sources']['broken'], ['4192771'])
+
+if __name__ == '__main__':
+    unittest.main()
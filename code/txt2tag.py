@@ -9,65 +9,229 @@ Files are formatted as follows:
 
 A line can consist of multiple sentences, which will be split by the tagger
 
+If a SectionSelector is handed to Tagger.tag(), only the selected sections are
+written to the output, the other sections are never sent to the tagger.
+
+Lines longer than max_span characters are split into spans at sentence or
+clause boundaries, the spans are tagged separately and their results are
+written in order, as if the line had been tagged as a whole. Lines longer than
+max_line characters typically contain non-textual garbage like gene sequences
+and are skipped. See utils.misc.SpanSplitter.
+
+Shorter garbage lines, like gene sequences, tables with numbers and OCR junk,
+can be kept away from the tagger with a GarbageDetector, which looks at the
+characters and the shape of the tokens of a line. Tagging them is expensive and
+only results in useless chunks.
+
+The tagger backend is selected with get_tagger(). A backend is an object with
+a tag_many() method that takes a list of texts and returns for each text a list
+of tagged sentence strings (or None if the text could not be tagged), where a
+tagged sentence string has the tokens and their tags separated by underscores.
+There are three backends:
+
+stanford
+    The Stanford tagger runs as a subprocess that gets the lines of a file over
+    stdin, see sdp.Tagger. This is the default.
+
+stanford-batch
+    The lines of many files are collected in one input file that the Stanford
+    tagger reads in one run, possibly divided over several tagger processes,
+    the tagged lines are then written to one output file for each input file,
+    see Tagger.tag_files() and sdp.BatchTagger.
+
+perceptron
+    A pure-Python tagger trained on the output of the Stanford tagger, which is
+    less accurate but much faster to start and does not need Java, see
+    perceptron.py. It uses the model in config.PERCEPTRON_TAGGER_MODEL unless
+    another model is given, see perceptron_model().
+
+To see which lines of some txt files would be taken to be garbage:
+
+    $ python txt2tag.py --garbage FILE1 FILE2 ...
+
 """
 
-import codecs
+import os, sys, re, time, codecs
 import sdp
+import config
+import perceptron
+
+from utils.misc import SpanSplitter, visible_chars, count_letters
 
 DEBUG = False
 
+# default maximum length of a span handed to the tagger and of a line
+MAX_SPAN = 10000
+MAX_LINE = 100000
+
+
+# the tagger backends, selected with the --tagger option of --txt2tag
+STANFORD = 'stanford'
+STANFORD_BATCH = 'stanford-batch'
+PERCEPTRON = 'perceptron'
+TAGGERS = (STANFORD, STANFORD_BATCH, PERCEPTRON)
+
+STANFORD_MODELS = {'en': "english-caseless-left3words-distsim.tagger",
+                   'cn': "chinese.tagger"}
 
-def get_tagger(language):
+
+def perceptron_model():
+    """Return the default model of the perceptron tagger, which is taken from
+    config.PERCEPTRON_TAGGER_MODEL. Config files that were made before there
+    was a perceptron tagger do not have that setting, for those the model is
+    expected in the resources directory."""
+    return getattr(config, 'PERCEPTRON_TAGGER_MODEL',
+                   os.path.join(config.RESOURCES, 'perceptron-tagger-en.pickle.gz'))
+
+
+def get_tagger(language, backend=STANFORD, threads=1, workspace=None, model=None):
     """Get the tagger appropriate for the language. Stanford tagger options are listed at
     http://ufallab.ms.mff.cuni.cz/tectomt/share/data/models/tagger/stanford/README-Models.txt)
+    With the stanford-batch backend, the given number of tagger processes run
+    at the same time, see sdp.BatchTagger. The model argument is the model file
+    of the perceptron tagger.
     """
-    if language == "en":
-        return sdp.Tagger("english-caseless-left3words-distsim.tagger")
-    elif language == "cn":
-        return sdp.Tagger("chinese.tagger")
-    else:
+    if backend == PERCEPTRON:
+        if model is None:
+            if language != 'en':
+                exit("There is no perceptron tagger model for language=%s" % language)
+            model = perceptron_model()
+        return perceptron.PerceptronTagger(model)
+    if language not in STANFORD_MODELS:
         exit("There is no tagger for language=%s" % language)
+    if backend == STANFORD:
+        return sdp.Tagger(STANFORD_MODELS[language])
+    elif backend == STANFORD_BATCH:
+        return sdp.BatchTagger(STANFORD_MODELS[language], threads, workspace)
+    else:
+        exit("Unknown tagger: %s" % backend)
 
 
 class Tagger(object):
 
-    def __init__(self, language):
-        self.tagger = get_tagger(language)
+    """Wraps the tagger for a language. Keeps track of the number of characters
+    handed to the tagger and the time it took to tag them, which is used to
+    estimate how much tagging time the garbage detector saved."""
+
+    def __init__(self, language, max_span=MAX_SPAN, max_line=MAX_LINE, garbage=None,
+                 backend=STANFORD, threads=1, workspace=None, model=None):
+        self.tagger = get_tagger(language, backend, threads, workspace, model)
+        self.splitter = SpanSplitter(max_span, max_line)
+        self.garbage = garbage
+        self.tagged_chars = 0
+        self.tagging_time = 0.0
+
+    def tag(self, input_file, output_file, sections=None):
+        chars, seconds = _tag(input_file, output_file, self.tagger, sections,
+                              self.splitter, self.garbage)
+        self.tagged_chars += chars
+        self.tagging_time += seconds
 
-    def tag(self, input_file, output_file):
-        _tag(input_file, output_file, self.tagger)
+    def tag_files(self, files, sections=None):
+        """Tag a list of files, given as pairs of input file and output file,
+        with one call to the tagger for the lines of all files. This is used for
+        the batch tagger. Returns a list with the statistics for each file, see
+        stats(), where the tagging time of a file is its share of the total time
+        based on the number of characters tagged."""
+        documents, file_stats = [], []
+        for input_file, output_file in files:
+            self.reset_stats()
+            lines = _read_lines(input_file, sections, self.splitter, self.garbage)
+            self.tagged_chars = sum([len(text) for text in _texts(lines)])
+            documents.append(lines)
+            file_stats.append(self.stats())
+        texts = [text for lines in documents for text in _texts(lines)]
+        t1 = time.time()
+        results = iter(self.tagger.tag_many(texts))
+        seconds = time.time() - t1
+        for (input_file, output_file), lines in zip(files, documents):
+            _write_lines(lines, results, output_file)
+        total_chars = sum([stats['tagged_chars'] for stats in file_stats])
+        for stats in file_stats:
+            if total_chars:
+                stats['tagging_time'] = seconds * stats['tagged_chars'] / total_chars
+        return file_stats
 
+    def reset_stats(self):
+        self.splitter.reset_counts()
+        if self.garbage is not None:
+            self.garbage.reset_counts()
+        self.tagged_chars, self.tagging_time = 0, 0.0
 
-def _tag(input_file, output_file, tagger):
+    def stats(self):
+        """Return the counts of the span splitter and the garbage detector, and
+        the number of characters tagged and the time needed for that, since the
+        last call of reset_stats()."""
+        return {'splitter': self.splitter.counts(),
+                'garbage': self.garbage.counts() if self.garbage is not None else None,
+                'tagged_chars': self.tagged_chars,
+                'tagging_time': self.tagging_time}
+
+
+def _tag(input_file, output_file, tagger, sections=None, splitter=None, garbage=None):
+    """Tag all lines in input_file. The lines are collected first and then handed
+    to the tagger in one go so that the tagger can have several lines in flight,
+    see sdp.Tagger.tag_many(). Long lines are split into spans by the splitter,
+    which defaults to a SpanSplitter with MAX_SPAN and MAX_LINE. Lines that the
+    garbage detector flags are not tagged. Returns the number of characters
+    handed to the tagger and the number of seconds the tagger needed."""
+    if splitter is None:
+        splitter = SpanSplitter(MAX_SPAN, MAX_LINE)
+    lines = _read_lines(input_file, sections, splitter, garbage)
+    texts = _texts(lines)
+    t1 = time.time()
+    results = iter(tagger.tag_many(texts))
+    seconds = time.time() - t1
+    _write_lines(lines, results, output_file)
+    return sum([len(text) for text in texts]), seconds
+
+
+def _read_lines(input_file, sections, splitter, garbage):
+    """Return a list with a triple of line number, line and spans for each line
+    of input_file that needs to be written to the output. The spans are the
+    texts to hand to the tagger, they are None for section headers."""
     s_input = codecs.open(input_file, encoding='utf-8')
-    s_output = open(output_file, "w")
+    if sections is not None:
+        sections.reset()
+    lines = []
     line_no = 0
     for line in s_input:
         line_no += 1
-        if _skip_line(line):
-            # TODO: maybe write these lines to the output but mark them somehow
+        if sections is not None and not sections.selected(line):
             continue
         line = _fix_line(line)
         _debug("[tag] Processing line: %s\n" % line)
-        if line != "":
-            if line[0:3] == "FH_":
-                # do not tag section headers
-                line_out = line.encode('utf-8')
-                s_output.write("%s\n" % line_out)
-            else:
-                _debug("[tag] line: %s" % line)
-                _tag_line(line, line_no, tagger, s_output)
+        if line[0:3] == "FH_":
+            # do not tag section headers
+            lines.append((line_no, line, None))
+        elif line != "":
+            if garbage is not None and garbage.is_garbage(line):
+                _debug("[tag] garbage: %s" % line)
+                continue
+            spans = splitter.split(line)
+            if spans:
+                lines.append((line_no, line, spans))
     s_input.close()
-    s_output.close()
+    return lines
 
 
-def _skip_line(line):
-    """Very long lines typically contain non-textual garbage like gene sequences,
-     skip them because some of them break the tagger.
-    :param line:
-    :return: True or False
-    """
-    return True if len(line) > 10000 else False
+def _texts(lines):
+    return [span for (line_no, line, spans) in lines if spans is not None for span in spans]
+
+
+def _write_lines(lines, results, output_file):
+    """Write the lines to output_file, taking the tagger results for the spans
+    from the results iterator."""
+    s_output = open(output_file, "w")
+    for line_no, line, spans in lines:
+        if spans is None:
+            line_out = line.encode('utf-8')
+            s_output.write("%s\n" % line_out)
+        else:
+            _debug("[tag] line: %s" % line)
+            for span in spans:
+                _write_tag_strings(next(results), line_no, s_output)
+    s_output.close()
 
 
 def _fix_line(line):
@@ -81,18 +245,130 @@ def _fix_line(line):
     return line
 
 
-def _tag_line(line, line_no, tagger, s_output):
-    try:
-        l_tag_string = tagger.tag(line)
-        _debug("[tag] line2: %s" % line)
-        for tag_string in l_tag_string:
-            tag_string = tag_string.encode('utf-8')
-            _debug("[tag] tag_string: %s" % tag_string)
-            s_output.write("%s\n" % tag_string)
-    except Exception:
+def _write_tag_strings(l_tag_string, line_no, s_output):
+    if l_tag_string is None:
         print "WARNING: tagger error for line %d, skipping" % line_no
+        return
+    for tag_string in l_tag_string:
+        tag_string = tag_string.encode('utf-8')
+        _debug("[tag] tag_string: %s" % tag_string)
+        s_output.write("%s\n" % tag_string)
 
 
 def _debug(text):
     if DEBUG:
-        print text
\ No newline at end of file
+        print text
+
+
+# tokens that look like words: letters, possibly with hyphens and apostrophes
+# inside, and possibly surrounded by punctuation
+WORD = re.compile(r"^\W*[^\W\d_]+(?:[-'][^\W\d_]+)*\W*$", re.UNICODE)
+
+# tokens that look like pieces of a DNA or RNA sequence
+SEQUENCE = re.compile(r"^[acgtun]{8,}$", re.IGNORECASE)
+
+
+class GarbageDetector(object):
+
+    """Flags lines that are not worth tagging. Lines shorter than min_length
+    characters are never flagged. Longer lines are flagged if less than
+    min_letter_ratio of their non-whitespace characters are letters or if less
+    than min_word_ratio of their tokens look like words, where tokens longer
+    than max_word_length characters and tokens that look like pieces of a gene
+    sequence do not count as words. The detector counts the lines it saw and the
+    flagged lines and characters, with the flagged lines also counted for the
+    rule that flagged them."""
+
+    RULES = ('letters', 'words')
+
+    def __init__(self, min_length=50, min_letter_ratio=0.5, min_word_ratio=0.4,
+                 max_word_length=30):
+        self.min_length = min_length
+        self.min_letter_ratio = min_letter_ratio
+        self.min_word_ratio = min_word_ratio
+        self.max_word_length = max_word_length
+        self.reset_counts()
+
+    def __str__(self):
+        return "<GarbageDetector min_length=%d min_letter_ratio=%.2f min_word_ratio=%.2f>" \
+               % (self.min_length, self.min_letter_ratio, self.min_word_ratio)
+
+    def reset_counts(self):
+        self.lines = 0
+        self.garbage_lines = 0
+        self.garbage_chars = 0
+        self.flagged = dict([(rule, 0) for rule in self.RULES])
+
+    def counts(self):
+        return {'lines': self.lines, 'garbage_lines': self.garbage_lines,
+                'garbage_chars': self.garbage_chars, 'flagged': dict(self.flagged)}
+
+    def add_counts(self, counts):
+        self.lines += counts['lines']
+        self.garbage_lines += counts['garbage_lines']
+        self.garbage_chars += counts['garbage_chars']
+        for rule in self.RULES:
+            self.flagged[rule] += counts['flagged'][rule]
+
+    def is_garbage(self, line):
+        return self.check(line) is not None
+
+    def check(self, line):
+        """Like flagging_rule(), but also updates the counts."""
+        self.lines += 1
+        rule = self.flagging_rule(line)
+        if rule is not None:
+            self.garbage_lines += 1
+            self.garbage_chars += len(line)
+            self.flagged[rule] += 1
+        return rule
+
+    def flagging_rule(self, line):
+        """Return the name of the rule that flags the line, or None if the line
+        is not garbage. Does not change the counts."""
+        if len(line) < self.min_length:
+            return None
+        chars = visible_chars(line)
+        if not chars:
+            return None
+        if count_letters(chars) / float(len(chars)) < self.min_letter_ratio:
+            return 'letters'
+        tokens = line.split()
+        words = len([t for t in tokens if self._is_word(t)])
+        if words / float(len(tokens)) < self.min_word_ratio:
+            return 'words'
+        return None
+
+    def _is_word(self, token):
+        return (len(token) <= self.max_word_length
+                and WORD.match(token) is not None
+                and SEQUENCE.match(token) is None)
+
+
+def print_garbage(filenames, detector=None):
+    """Print the lines in the files that the detector flags, and how much of the
+    text they make up."""
+    if detector is None:
+        detector = GarbageDetector()
+    total_chars = 0
+    for filename in filenames:
+        fh = codecs.open(filename, encoding='utf-8')
+        for line in fh:
+            line = _fix_line(line)
+            if line == "" or line.startswith('FH_'):
+                continue
+            total_chars += len(line)
+            rule = detector.check(line)
+            if rule is not None:
+                print "%s\t%s\t%s" % (filename, rule, line[:100].encode('utf-8'))
+        fh.close()
+    print "\n%d of %d lines are garbage, %d of %d characters (%.2f%%), flagged by rule: %s" \
+          % (detector.garbage_lines, detector.lines, detector.garbage_chars, total_chars,
+             100.0 * detector.garbage_chars / total_chars if total_chars else 0.0,
+             ', '.join(["%s=%d" % (r, detector.flagged[r]) for r in detector.RULES]))
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) > 2 and sys.argv[1] == '--garbage':
+        print_garbage(sys.argv[2:])
@@ -86,6 +86,22 @@ class RuntimeConfig(object):
         self.datasource = datasource
         self.limit = limit
         self.verbose = verbose
+        # size of the sentence cache used by --tag2chk, 0 means no caching
+        self.sentence_cache = 0
+        # number of worker processes and the order in which files are given
+        # to them, see utils/parallel.py
+        self.workers = 1
+        self.schedule = 'list'
+        # maximum number of seconds for a document, None means no maximum, and
+        # whether to process documents again that were put in quarantine
+        self.timeout = None
+        self.retry_quarantined = False
+        # number of files tagged with one run of the batch tagger
+        self.batch_size = 100
+        # number of segmenter processes used by each worker of --txt2seg, and
+        # whether --txt2seg2tag also writes the segmented files
+        self.segmenters = 1
+        self.keep_segmented = False
         # the user can specify a file list and no corpus, allow for this here
         self.config_dir = None
         self.general_config_file = None
@@ -146,6 +162,22 @@ class RuntimeConfig(object):
         print "[get_options] WARNING: processing stage not found"
         return {}
 
+    def with_stage_options(self, stage, options):
+        """Return a copy of the configuration where the options for stage are
+        replaced with options. This is used when one run creates several data
+        sets, each of which needs a pipeline with its own settings."""
+        rconfig = RuntimeConfig(None, self.language, self.datasource, None,
+                                verbose=self.verbose, limit=self.limit)
+        rconfig.corpus = self.corpus
+        rconfig.config_dir = self.config_dir
+        rconfig.general_config_file = self.general_config_file
+        rconfig.pipeline_config_file = self.pipeline_config_file
+        rconfig.filelist = self.filelist
+        rconfig.general = self.general
+        rconfig.pipeline = [(step, options if step == stage else settings)
+                            for step, settings in self.pipeline]
+        return rconfig
+
     def pp(self):
         print "\n<RuntimeConfig>"
         print "   corpus = %s" % self.corpus
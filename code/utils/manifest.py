@@ -0,0 +1,151 @@
+"""
+
+Per-document metadata for a data set.
+
+Each data set can have a manifest in state/manifest.txt with one line for each
+processed document:
+
+    FILE_ID<tab>KEY=VALUE<tab>KEY=VALUE...
+
+The FILE_ID is the path of the document relative to the files directory of the
+data set. The --xml2txt stage creates the first manifest with the year, the
+subject, the byte offsets of the sections, the number of lines and the size of
+the source file. Later stages copy the metadata of a document from the manifest
+of their input data set and add their own counts, so the manifest of a data set
+has everything that is known about the document at that point of the pipeline.
+
+Lines are appended when a document is processed, if there is more than one line
+for a document then the keys in later lines overrule keys in earlier lines.
+
+"""
+
+import os, codecs
+
+from path import open_input_file
+
+
+MANIFEST_FILE = 'manifest.txt'
+
+
+class Manifest(object):
+
+    """Gives access to the manifest of a data set, dataset_path is the path of
+    the data set version, for example data/d1_txt/01. The manifest is read when
+    it is first needed."""
+
+    def __init__(self, dataset_path):
+        self.filename = os.path.join(dataset_path, 'state', MANIFEST_FILE)
+        self.documents = None
+
+    def __len__(self):
+        return len(self._documents())
+
+    def _documents(self):
+        if self.documents is None:
+            self.documents = read_manifest(self.filename)
+        return self.documents
+
+    def get(self, file_id, key=None, default=None):
+        """Return the value of key for the document, or all metadata of the
+        document as a dictionary if key is None."""
+        metadata = self._documents().get(file_id)
+        if metadata is None:
+            return default
+        if key is None:
+            return metadata
+        return metadata.get(key, default)
+
+    def add(self, file_id, metadata, inherited=None):
+        """Append a line for the document to the manifest. The metadata of the
+        document in the manifest handed in as inherited, if any, are written
+        first, followed by the metadata dictionary."""
+        fields = {}
+        if inherited is not None:
+            fields.update(inherited.get(file_id, default={}))
+        fields.update(metadata)
+        fh = codecs.open(self.filename, 'a', encoding='utf-8')
+        fh.write(manifest_line(file_id, fields))
+        fh.close()
+        if self.documents is not None:
+            self.documents.setdefault(file_id, {}).update(fields)
+
+
+def read_manifest(filename):
+    """Return a dictionary indexed on file identifiers with dictionaries of all
+    metadata as the values. Returns an empty dictionary if there is no manifest
+    file."""
+    documents = {}
+    if not os.path.exists(filename):
+        return documents
+    with codecs.open(filename, encoding='utf-8') as fh:
+        for line in fh:
+            fields = line.rstrip("\n").split("\t")
+            metadata = documents.setdefault(fields[0], {})
+            for field in fields[1:]:
+                key, value = field.split('=', 1)
+                metadata[key] = value
+    return documents
+
+
+def manifest_line(file_id, metadata):
+    fields = [file_id]
+    for key in sorted(metadata.keys()):
+        value = unicode(metadata[key]).replace("\t", " ").replace("\n", " ")
+        fields.append(u"%s=%s" % (key, value))
+    return u"\t".join(fields) + u"\n"
+
+
+def describe_txt_file(filename):
+    """Return a dictionary with the metadata of a d1_txt file: the year, the
+    subject, the byte offsets of the section headers and the number of lines.
+    The year is the first four characters of the first non-empty line after
+    FH_DATE, or 9999 if there is no date or if the date comes after a section
+    other than the title (this is what corpus._get_year_from_file() did). The
+    subject is taken from the first line after FH_SUBJECT or FH_SUBJECTS."""
+    year, subject = None, None
+    year_p = True
+    sections = []
+    section = None
+    lines = 0
+    offset = 0
+    fh = open(filename, 'rb')
+    for line in fh:
+        lines += 1
+        if line.startswith('FH_'):
+            section = line.strip().rstrip(': ')[3:]
+            sections.append("%s:%d" % (section, offset))
+            if section not in ('TITLE', 'DATE'):
+                year_p = False
+        elif section == 'DATE' and year_p and year is None and line.strip():
+            year = line.strip()[:4]
+        elif section in ('SUBJECT', 'SUBJECTS') and subject is None and line.strip():
+            subject = line.strip().decode('utf-8')
+        offset += len(line)
+    fh.close()
+    metadata = {'year': "9999" if year is None else year,
+                'sections': ','.join(sections),
+                'txt_lines': lines}
+    if subject is not None:
+        metadata['subject'] = subject
+    return metadata
+
+
+def count_sentences_and_tokens(filename):
+    """Return the number of sentences and tokens in a segmented or tagged file,
+    where each line that is not a section header is a sentence."""
+    fh = open_input_file(filename)
+    counts = count_sentences_and_tokens_in_lines(fh)
+    fh.close()
+    return counts
+
+
+def count_sentences_and_tokens_in_lines(lines):
+    """Like count_sentences_and_tokens(), but for the lines of a file that is
+    not written, the lines should be utf-8 encoded strings so that tokens are
+    split in the same way as in the file."""
+    sentences, tokens = 0, 0
+    for line in lines:
+        if line.strip() and not line.startswith('FH_'):
+            sentences += 1
+            tokens += len(line.split())
+    return sentences, tokens
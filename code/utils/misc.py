@@ -4,6 +4,8 @@ Miscellaneous utilities.
 
 """
 
+import re
+
 
 def findall(haystack, needle, idx=0):
     """Finds the beginning offset of all occurrences of needle in haystack and
@@ -15,3 +17,149 @@ def findall(haystack, needle, idx=0):
             offsets.append(idx)
             idx += 1
     return offsets
+
+
+class SectionSelector(object):
+
+    """Keeps track of the section of a document while its lines are read and
+    tells whether a line is in one of the selected sections. Sections are the
+    names of the FH_ section headers without the FH_ prefix and the colon, for
+    example TITLE or FIRST_CLAIM. The DATE section is always selected since it
+    has the year of the document, and so is the END line."""
+
+    def __init__(self, sections):
+        self.sections = set(sections)
+        self.sections.add('DATE')
+        self.selected_p = True
+
+    def __str__(self):
+        return "<SectionSelector %s>" % ','.join(sorted(self.sections))
+
+    def reset(self):
+        """Call this before reading the first line of a document."""
+        self.selected_p = True
+
+    def selected(self, line):
+        """Return True if the line should be processed, this should be called
+        for all lines in the order in which they occur in the document. Lines
+        before the first section header are selected."""
+        if line.startswith('FH_'):
+            self.selected_p = section_name(line) in self.sections
+        elif line.strip() == 'END':
+            return True
+        return self.selected_p
+
+
+def section_name(header):
+    """Return the section name for a header line like 'FH_TITLE:'."""
+    return header.strip().rstrip(': ')[3:]
+
+
+def get_section_selector(value):
+    """Return a SectionSelector for the value of a --sections option, which is
+    a comma-separated list of section names, or None if value is None or 'all'.
+    The FH_ prefix is optional in the section names."""
+    if value is None or value == 'all':
+        return None
+    sections = [s[3:] if s.startswith('FH_') else s for s in value.split(',')]
+    return SectionSelector([s for s in sections if s])
+
+
+# characters with an ordinal of 256 or more, which txt2tag and cn_txt2seg do not
+# count as ascii characters, and characters that are not letters
+NON_ASCII = re.compile(u'[^\x00-\xff]')
+NON_LETTER = re.compile(r'[\W\d_]', re.UNICODE)
+
+
+def visible_chars(line):
+    """Return the line without its whitespace."""
+    return u''.join(line.split())
+
+
+def count_ascii(chars):
+    """Return the number of characters with an ordinal below 256."""
+    return len(NON_ASCII.sub(u'', chars))
+
+
+def count_letters(chars):
+    """Return the number of letters."""
+    return len(NON_LETTER.sub(u'', chars))
+
+
+# characters that end a sentence or a clause, the full-width versions are used
+# in Chinese text where they are not followed by a space
+SENTENCE_ENDS = u'.!?\u3002\uff01\uff1f'
+CLAUSE_ENDS = u';:,\uff1b\uff1a\uff0c\u3001'
+FULL_WIDTH_ENDS = u'\u3002\uff01\uff1f\uff1b\uff1a\uff0c\u3001'
+
+
+class SpanSplitter(object):
+
+    """Splits lines that are too long for the tagger or the segmenter into spans
+    of at most max_span characters. Lines are split after the last sentence end
+    in the first max_span characters, if there is none in the second half of
+    that stretch then after the last clause end, and failing that at the last
+    whitespace or, as a last resort, right at max_span. Lines longer than
+    max_line are not split but skipped, max_line=None means that no line is
+    skipped. The splitter counts how many lines it was given, how many of them
+    were split, how many spans that gave and how many lines were skipped."""
+
+    def __init__(self, max_span, max_line=None):
+        self.max_span = max_span
+        self.max_line = max_line
+        self.reset_counts()
+
+    def __str__(self):
+        return "<SpanSplitter max_span=%s max_line=%s>" % (self.max_span, self.max_line)
+
+    def reset_counts(self):
+        self.lines = 0
+        self.split_lines = 0
+        self.spans = 0
+        self.skipped_lines = 0
+
+    def counts(self):
+        return {'lines': self.lines, 'split_lines': self.split_lines,
+                'spans': self.spans, 'skipped_lines': self.skipped_lines}
+
+    def add_counts(self, counts):
+        """Add counts as returned by counts() to the counts of this splitter,
+        used to collect the counts of splitters in other processes."""
+        self.lines += counts['lines']
+        self.split_lines += counts['split_lines']
+        self.spans += counts['spans']
+        self.skipped_lines += counts['skipped_lines']
+
+    def split(self, line):
+        """Return the list of spans for line, which is just the line itself if
+        it is short enough and the empty list if the line is skipped."""
+        self.lines += 1
+        if self.max_line is not None and len(line) > self.max_line:
+            self.skipped_lines += 1
+            return []
+        if len(line) <= self.max_span:
+            return [line]
+        spans = []
+        while len(line) > self.max_span:
+            end = self._split_point(line)
+            span = line[:end].strip()
+            if span:
+                spans.append(span)
+            line = line[end:].lstrip()
+        if line:
+            spans.append(line)
+        self.split_lines += 1
+        self.spans += len(spans)
+        return spans
+
+    def _split_point(self, line):
+        window = line[:self.max_span + 1]
+        for boundaries in (SENTENCE_ENDS, CLAUSE_ENDS):
+            for i in range(self.max_span - 1, self.max_span // 2, -1):
+                c = window[i]
+                if c in boundaries and (c in FULL_WIDTH_ENDS or window[i+1].isspace()):
+                    return i + 1
+        for i in range(self.max_span, 0, -1):
+            if window[i].isspace():
+                return i
+        return self.max_span
@@ -0,0 +1,252 @@
+"""
+
+Utilities for running the per-document work of a processing stage with several
+worker processes.
+
+The work for a stage is a list of jobs, one for each document. Jobs can be run
+in the order of the list or in the order of their estimated cost, with the
+most expensive jobs first. Workers take the next job from the list as soon as
+they are done with their current job, so when the expensive jobs are started
+first the cheap jobs at the end fill up the gaps and the time needed for a batch
+gets close to the total amount of work divided by the number of workers.
+
+Jobs can also be run with a time limit. In that case each worker is a separate
+process that runs in its own process group, and a worker that takes too long on
+a job is killed together with all processes it started (for example a tagger)
+and replaced by a fresh worker. The job is then reported as a JobFailure. Jobs
+that raise an exception are reported as a JobFailure in all modes.
+
+"""
+
+import os, time, signal, select, traceback, multiprocessing
+
+
+# values of the schedule setting
+SCHEDULE_LIST = 'list'
+SCHEDULE_COST = 'cost'
+SCHEDULES = (SCHEDULE_LIST, SCHEDULE_COST)
+
+
+def file_cost(filename):
+    """Return the estimated cost of processing a file, which is simply its size
+    in bytes. Looks for the compressed version of the file if the file itself
+    does not exist and returns 0 if neither exists."""
+    for fname in (filename, filename + '.gz'):
+        if os.path.exists(fname):
+            return os.path.getsize(fname)
+    return 0
+
+
+def schedule(costs, schedule=SCHEDULE_LIST):
+    """Return the order in which jobs should be run as a list of indexes into
+    the list of job costs. With the cost schedule the most expensive jobs come
+    first, jobs with the same cost keep their order."""
+    indexes = range(len(costs))
+    if schedule == SCHEDULE_COST:
+        indexes.sort(key=lambda i: -costs[i])
+    elif schedule != SCHEDULE_LIST:
+        raise ValueError("unknown schedule: %s" % schedule)
+    return indexes
+
+
+class JobFailure(object):
+
+    """The result of a job that did not finish, the reason is one of TIMEOUT,
+    ERROR and DIED."""
+
+    TIMEOUT = 'timeout'
+    ERROR = 'error'
+    DIED = 'died'
+
+    def __init__(self, reason, elapsed, message=''):
+        self.reason = reason
+        self.elapsed = elapsed
+        self.message = message
+
+    def __str__(self):
+        return "<JobFailure %s after %.2f seconds>" % (self.reason, self.elapsed)
+
+
+def run_jobs(function, jobs, order=None, workers=1, initializer=None, initargs=(),
+             timeout=None):
+    """Run function on each job and yield pairs of the index of the job and the
+    result of the function, in the order in which the jobs finish. The order
+    argument is a list of job indexes as returned by schedule(), by default the
+    jobs are run in the order of the list. With one worker the jobs are run in
+    this process, otherwise a pool of worker processes is used where idle
+    workers take the next job. The initializer is called with initargs once in
+    each worker process (or in this process if there is one worker), it is
+    typically used to create objects like taggers that are expensive to create
+    and can be used for all jobs. Both function and initializer need to be
+    defined at the top level of a module. A job that raises an exception yields
+    a JobFailure as its result. If timeout is not None, jobs are run by
+    supervised workers, see run_supervised_jobs()."""
+    if order is None:
+        order = range(len(jobs))
+    if timeout is not None:
+        for result in run_supervised_jobs(function, jobs, order, workers,
+                                          initializer, initargs, timeout):
+            yield result
+        return
+    if workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for i in order:
+            yield _run_job((function, i, jobs[i]))
+        return
+    pool = multiprocessing.Pool(workers, initializer, initargs)
+    try:
+        tasks = [(function, i, jobs[i]) for i in order]
+        for result in pool.imap_unordered(_run_job, tasks, chunksize=1):
+            yield result
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def _run_job(task):
+    function, i, job = task
+    started = time.time()
+    try:
+        return i, function(job)
+    except Exception:
+        return i, JobFailure(JobFailure.ERROR, time.time() - started, traceback.format_exc())
+
+
+def run_supervised_jobs(function, jobs, order, workers, initializer, initargs, timeout):
+    """Like run_jobs(), but always uses worker processes, even if there is only
+    one worker, and gives each job at most timeout seconds, not counting the
+    time needed to start the worker. A worker that runs over is killed and
+    replaced. Jobs that time out, raise an exception or kill their worker yield
+    a JobFailure as their result."""
+    pending = list(reversed(order))
+    starting, idle, busy = {}, [], {}
+
+    def start_worker():
+        worker = SupervisedWorker(initializer, initargs)
+        starting[worker.fileno()] = worker
+
+    for _ in range(max(1, workers)):
+        start_worker()
+    try:
+        while pending or busy:
+            while pending and idle:
+                worker = idle.pop()
+                i = pending.pop()
+                worker.submit(function, i, jobs[i])
+                busy[worker.fileno()] = worker
+            wait = None
+            if busy:
+                deadline = min([w.started for w in busy.values()]) + timeout
+                wait = max(0, deadline - time.time())
+            ready, _, _ = select.select(starting.keys() + busy.keys(), [], [], wait)
+            for fileno in ready:
+                if fileno in starting:
+                    worker = starting.pop(fileno)
+                    worker.wait_until_ready()
+                    idle.append(worker)
+                    continue
+                worker = busy.pop(fileno)
+                i, result = worker.receive()
+                if isinstance(result, JobFailure) and result.reason == JobFailure.DIED:
+                    worker.kill()
+                    start_worker()
+                else:
+                    idle.append(worker)
+                yield i, result
+            now = time.time()
+            for fileno, worker in busy.items():
+                if now - worker.started > timeout:
+                    del busy[fileno]
+                    worker.kill()
+                    start_worker()
+                    yield worker.job_index, JobFailure(JobFailure.TIMEOUT, now - worker.started)
+    finally:
+        for worker in starting.values() + idle + busy.values():
+            worker.stop()
+
+
+class SupervisedWorker(object):
+
+    """A worker process that gets jobs over a pipe and that can be killed with
+    all its child processes."""
+
+    def __init__(self, initializer, initargs):
+        self.connection, child_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_supervised_worker_loop,
+            args=(child_connection, initializer, initargs))
+        self.process.daemon = True
+        self.process.start()
+        child_connection.close()
+        self.job_index = None
+        self.started = None
+
+    def fileno(self):
+        return self.connection.fileno()
+
+    def wait_until_ready(self):
+        """Wait for the message that the worker is initialized, raises an error
+        if the initializer failed since that would fail for all workers."""
+        try:
+            self.connection.recv()
+        except (EOFError, IOError):
+            self.kill()
+            raise RuntimeError("could not initialize worker process")
+
+    def submit(self, function, i, job):
+        self.job_index = i
+        self.started = time.time()
+        self.connection.send((function, i, job))
+
+    def receive(self):
+        """Return the index of the current job and its result."""
+        i = self.job_index
+        try:
+            ok, result = self.connection.recv()
+        except (EOFError, IOError):
+            return i, JobFailure(JobFailure.DIED, time.time() - self.started)
+        if not ok:
+            return i, JobFailure(JobFailure.ERROR, time.time() - self.started, result)
+        return i, result
+
+    def kill(self):
+        """Kill the worker and all processes in its process group."""
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        self.process.join()
+        self.connection.close()
+
+    def stop(self):
+        """Ask an idle worker to exit, a busy worker is killed."""
+        if self.process.is_alive():
+            try:
+                self.connection.send(None)
+            except (IOError, OSError):
+                pass
+            self.process.join(1)
+        if self.process.is_alive():
+            self.kill()
+
+
+def _supervised_worker_loop(connection, initializer, initargs):
+    # a new process group so that the worker can be killed together with the
+    # processes it started
+    os.setpgrp()
+    if initializer is not None:
+        initializer(*initargs)
+    connection.send(True)
+    while True:
+        task = connection.recv()
+        if task is None:
+            break
+        function, i, job = task
+        try:
+            connection.send((True, function(job)))
+        except Exception:
+            connection.send((False, traceback.format_exc()))
@@ -10,7 +10,7 @@ the repository and optionally on the corpus they were created from.
 USAGE (COMMAD LINE):
 
     $ python view.py --initialize-from-corpus --view PATH --repository PATH --corpus PATH
-    $ python view.py --analyze --view PATH
+    $ python view.py --analyze --view PATH [--check-gzip] [--threads N]
 
 The first form creates a view from a corpus. The view is linked to a repository,
 which must be an existing repository (it can be in repository.REPOSITORY_DIR or
@@ -39,8 +39,15 @@ Example:
            --corpus /home/j/corpuswork/fuse/FUSEData/corpora/ln-us-A21-computers/subcorpora/1997
 
 The second form checks whether identifiers listed in index/files.txt actually
-can be associated with files in the repository. It writes results to an info
-directory, which will be created the first time --analyze is executed.
+can be associated with files in the repository. For the sources and each
+processing step it prints how many identifiers have a file, what percentage of
+the identifiers that is and the total size of the compressed files. With
+--check-gzip all files are also uncompressed to find broken files, which takes
+much longer. Files are checked by a pool of threads, 16 by default. It writes
+results to an info directory, which will be created the first time --analyze is
+executed. The info directory gets a time-stamped text file with what was printed
+and a json report that also lists the identifiers without a file and the
+identifiers with a broken file.
 
 
 USAGE (IN SCRIPS):
@@ -63,14 +70,29 @@ tagged files in a view. This can be done as follows:
 
 This will print a list of absolute paths accessable through the view.
 
+The iterators read the identifiers from index/files.txt and check files a
+thousand identifiers at a time, using a pool of threads and listing each
+directory only once (see FileChecker). Iterators can be restarted with reset().
+Note that they only look at the tree of files in the repository, files that
+were moved to the packed store of the repository show up as None.
+
 """
 
-import os, sys, shutil, glob, getopt, time
+import os, sys, shutil, glob, getopt, time, collections, gzip, zlib, json
+from multiprocessing.pool import ThreadPool
 
 import repository
 from utils.path import read_only
 
 
+# number of identifiers that a RepositoryIterator checks in one go and the
+# number of threads used for checking files
+ITERATOR_BATCH_SIZE = 1000
+CHECK_THREADS = 16
+
+# the names under which sources and processed files are reported by analyze()
+ANALYZED_STEPS = ('sources',) + repository.PROCESSING_STEPS
+
 
 def create_view(view_dir, repository_dir):
     """Create a new empty view in directory view_dir and hook it up to the
@@ -174,67 +196,272 @@ class View(object):
                 ids.append(line.split())
         return ids
 
-    def analyze(self):
+    def identifier_paths(self):
+        """Like identifiers(), but yields the identifier-path pairs one by one
+        without reading the whole list."""
+        with open(self.filelist_file) as fh:
+            for line in fh:
+                fields = line.split()
+                if fields:
+                    yield fields
+
+    def analyze(self, check_gzip=False, threads=CHECK_THREADS):
         """The files.txt list of a view contains files that may not occur in the
         repository, both sources and processed. This method prints the number of
-        actual files in the repository pointed at by the view. Results are also
-        written to disk in the info directory in a time-stamped file. This takes
-        about 10-12 seconds for a view with 1000 elements (on a NFS share)"""
+        actual files in the repository pointed at by the view, the percentage of
+        identifiers that have a file and the total size of the compressed files.
+        If check_gzip is True then all files are uncompressed to check whether
+        they are intact. Results are also written to disk in the info directory
+        in a time-stamped file, together with a json report that also has the
+        identifiers without a file and the identifiers with a broken file. See
+        ViewAnalyzer for the report."""
         t0 = time.time()
         self.info_dir = os.path.join(self.dir, 'info')
         if not os.path.exists(self.info_dir):
             os.makedirs(self.info_dir)
-        info_file = os.path.join(self.info_dir, "info-%s.txt" % repository.timestamp())
+        stamp = repository.timestamp()
+        info_file = os.path.join(self.info_dir, "info-%s.txt" % stamp)
+        report_file = os.path.join(self.info_dir, "report-%s.json" % stamp)
+        report = ViewAnalyzer(self, check_gzip, threads).analyze()
         fh = open(info_file, 'w')
-        counts = { 'sources': sum(1 for _ in self.sources()) }
-        for step in repository.PROCESSING_STEPS:
-            counts[step] = sum(1 for e in self.processed(step) if e)
-        fh.write("%6d  sources\n" % counts['sources'])
-        print "%6d  sources" % counts['sources']
-        for step in repository.PROCESSING_STEPS:
-            fh.write("%6d  %s\n" % (counts[step], step))
-            print "%6d  %s" % (counts[step], step)
-        print "Results written to", fh.name
+        for step in ANALYZED_STEPS:
+            results = report['steps'][step]
+            line = "%6d  %-12s  %5.1f%%  %6dMB" % (results['files'], step,
+                                                  results['coverage'], results['size'] / 1000000)
+            if check_gzip:
+                line += "  %d broken" % len(results['broken'])
+            fh.write(line + "\n")
+            print line
+        fh.close()
+        with open(report_file, 'w') as fh:
+            json.dump(report, fh, indent=2, sort_keys=True)
+        print "Results written to", info_file, "and", report_file
         print "Processing time: %s seconds" % (time.time() - t0)
 
 
 class RepositoryIterator(object):
 
-    """Iterator object to iterate over files in a repository given a view."""
+    """Iterator object to iterate over files in a repository given a view. The
+    identifiers are read from the files.txt list of the view in batches of
+    batch_size and the files of a batch are checked by a FileChecker, which can
+    be handed in so it can be shared by several iterators. A checker created by
+    the iterator is closed when the iterator is exhausted. Resetting the
+    iterator clears the directory listings cached by the checker, so files
+    added since the last pass are found."""
 
-    def __init__(self, view, step=None):
+    def __init__(self, view, step=None, batch_size=ITERATOR_BATCH_SIZE, checker=None):
+        self.view = view
         self.repository = view.repository.dir
         self.path = "data/processed%s%s" %  (os.sep, step) if step else 'data/sources'
-        self.ids = view.identifiers()
+        self.batch_size = batch_size
+        self.own_checker = checker is None
+        self.checker = FileChecker() if checker is None else checker
+        self.ids = None
+        self.reset()
 
     def __iter__(self):
         return self
 
     def next(self):
-        try:
-            next = self.ids.pop(0)
-            fname = os.path.join(self.repository, self.path, next[1] + '.gz')
-            if os.path.exists(fname):
-                return fname
-            else:
-                return None
-        except IndexError:
+        if not self.buffer:
+            self._fill_buffer()
+        if not self.buffer:
+            if self.own_checker:
+                self.checker.close()
             raise StopIteration
+        return self.buffer.popleft()
 
     def reset(self):
-        self.ids = view.identifiers()
+        self.ids = self.view.identifier_paths()
+        self.buffer = collections.deque()
+        self.checker.listings.clear()
+
+    def _fill_buffer(self):
+        fnames = []
+        for identifier, path in self.ids:
+            fnames.append(os.path.join(self.repository, self.path, path + '.gz'))
+            if len(fnames) == self.batch_size:
+                break
+        for fname, exists in zip(fnames, self.checker.exist(fnames)):
+            self.buffer.append(fname if exists else None)
+
+
+class ViewAnalyzer(object):
+
+    """Collects what the repository has for the identifiers of a view. The
+    identifiers are read in batches and for each batch the files for all steps
+    are checked with a FileChecker, optionally the checker is also used to see
+    whether each file can be uncompressed. The result is a dictionary with the
+    view, the repository, the number of identifiers and, for sources and each
+    processing step, the number of files, the coverage (the percentage of the
+    identifiers that have a file), the total size of the compressed files, the
+    list of identifiers without a file and, if files were uncompressed, the
+    list of identifiers with a broken file."""
+
+    def __init__(self, view, check_gzip=False, threads=CHECK_THREADS,
+                 batch_size=ITERATOR_BATCH_SIZE):
+        self.view = view
+        self.check_gzip = check_gzip
+        self.batch_size = batch_size
+        self.checker = FileChecker(threads)
+        self.directories = { 'sources': os.path.join(view.repository.dir, 'data', 'sources') }
+        for step in repository.PROCESSING_STEPS:
+            self.directories[step] = os.path.join(view.repository.dir, 'data', 'processed', step)
+
+    def __str__(self):
+        return "<ViewAnalyzer on %s>" % self.view
+
+    def analyze(self):
+        report = { 'view': self.view.dir,
+                   'repository': self.view.repository.dir,
+                   'identifiers': 0,
+                   'check_gzip': self.check_gzip,
+                   'steps': {} }
+        for step in ANALYZED_STEPS:
+            report['steps'][step] = { 'files': 0, 'size': 0, 'missing': [] }
+            if self.check_gzip:
+                report['steps'][step]['broken'] = []
+        batch = []
+        try:
+            for pair in self.view.identifier_paths():
+                batch.append(pair)
+                if len(batch) == self.batch_size:
+                    self._analyze_batch(batch, report)
+                    batch = []
+            if batch:
+                self._analyze_batch(batch, report)
+        finally:
+            self.checker.close()
+        for results in report['steps'].values():
+            results['coverage'] = 0.0
+            if report['identifiers']:
+                results['coverage'] = 100.0 * results['files'] / report['identifiers']
+        return report
+
+    def _analyze_batch(self, batch, report):
+        report['identifiers'] += len(batch)
+        for step in ANALYZED_STEPS:
+            results = report['steps'][step]
+            fnames = [os.path.join(self.directories[step], path + '.gz') for _, path in batch]
+            existing = []
+            for (identifier, _), fname, size in zip(batch, fnames, self.checker.sizes(fnames)):
+                if size is None:
+                    results['missing'].append(identifier)
+                else:
+                    results['files'] += 1
+                    results['size'] += size
+                    existing.append((identifier, fname))
+            if self.check_gzip:
+                intact = self.checker.map(gzip_file_is_intact, [f for _, f in existing])
+                for (identifier, _), ok in zip(existing, intact):
+                    if not ok:
+                        results['broken'].append(identifier)
+
+
+def gzip_file_is_intact(fname):
+    """Return True if the compressed file can be read to the end, which includes
+    a check on the size and the checksum of the contents."""
+    try:
+        fh = gzip.open(fname)
+        try:
+            while fh.read(1 << 20):
+                pass
+        finally:
+            fh.close()
+    except (IOError, EOFError, zlib.error):
+        return False
+    return True
+
+
+class FileChecker(object):
+
+    """Checks whether files exist, many at a time. Files are grouped on their
+    directory. Directories with more than one of the files are listed once and
+    the listing is cached, other files are checked with a stat call. The work is
+    spread over a pool of threads, which helps when the files are on a network
+    file system."""
+
+    def __init__(self, threads=CHECK_THREADS):
+        self.threads = threads
+        self.listings = {}
+        self.pool = None
+
+    def __str__(self):
+        return "<FileChecker threads=%d listings=%d>" % (self.threads, len(self.listings))
+
+    def exist(self, fnames):
+        """Return a list of booleans for the list of file names."""
+        directories = collections.defaultdict(list)
+        for fname in fnames:
+            directories[os.path.dirname(fname)].append(fname)
+        existing = set()
+        for found in self.map(self._check_directory, directories.items()):
+            existing.update(found)
+        return [fname in existing for fname in fnames]
+
+    def sizes(self, fnames):
+        """Return a list with the size of each file, or None for files that do
+        not exist."""
+        existing = [fname for fname, exists in zip(fnames, self.exist(fnames)) if exists]
+        sizes = dict(zip(existing, self.map(_file_size, existing)))
+        return [sizes.get(fname) for fname in fnames]
+
+    def listing(self, dirname):
+        """Return the set of names in the directory, which is empty if the
+        directory does not exist."""
+        names = self.listings.get(dirname)
+        if names is None:
+            try:
+                names = set(os.listdir(dirname))
+            except OSError:
+                names = set()
+            self.listings[dirname] = names
+        return names
+
+    def _check_directory(self, item):
+        dirname, fnames = item
+        if len(fnames) == 1 and dirname not in self.listings:
+            return [fname for fname in fnames if os.path.exists(fname)]
+        names = self.listing(dirname)
+        return [fname for fname in fnames if os.path.basename(fname) in names]
+
+    def map(self, function, items):
+        """Apply function to each item, using the thread pool if there is more
+        than one thread."""
+        if self.threads <= 1 or len(items) < 2:
+            return map(function, items)
+        if self.pool is None:
+            self.pool = ThreadPool(self.threads)
+        return self.pool.map(function, items)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+def _file_size(fname):
+    try:
+        return os.path.getsize(fname)
+    except OSError:
+        return None
 
 
 
 if __name__ == '__main__':
 
-    options = ['initialize-from-corpus', 'corpus=', 'view=', 'analyze', 'repository=']
+    options = ['initialize-from-corpus', 'corpus=', 'view=', 'analyze', 'repository=',
+               'check-gzip', 'threads=']
     (opts, args) = getopt.getopt(sys.argv[1:], 'r:v:c:', options)
     init_p, analyze_p = False, False
+    check_gzip, threads = False, CHECK_THREADS
     repo, view, corpus = None, None, None
     for opt, val in opts:
         if opt == '--initialize-from-corpus': init_p = True
         if opt == '--analyze': analyze_p = True
+        if opt == '--check-gzip': check_gzip = True
+        if opt == '--threads': threads = int(val)
         if opt in ('-r', '--repository'): repo = val
         if opt in ('-v', '--view'): view = val
         if opt in ('-c', '--corpus'): corpus = val
@@ -248,4 +475,4 @@ if __name__ == '__main__':
     elif analyze_p:
         if view is None: exit("WARNING: no view defined")
         view = View(view)
-        view.analyze()
+        view.analyze(check_gzip, threads)